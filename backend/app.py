@@ -1,18 +1,18 @@
+# 启动耗时统计最先导入，各阶段结束时 profiler.mark()
+from modules.startup import profiler
+
 import os
 import cv2
 import threading
 import time
 import shutil
-import tkinter as tk
 import logging
 from datetime import datetime
-import pymongo
-from openai import OpenAI
-from tkinter import filedialog
-from flask import Flask, Response, jsonify, request, render_template
+from pymongo.errors import ConnectionFailure
+from flask import Flask, Response, jsonify, request, make_response, render_template, send_file
 from flask_cors import CORS
-from ultralytics import YOLO
 from werkzeug.utils import secure_filename
+# ultralytics / openai / tkinter 导入较慢或依赖桌面环境，改为在用到的函数内导入
 
 # 导入模块
 try:
@@ -27,9 +27,22 @@ from modules.auth import has_role
 
 # 【新增】导入功能模块蓝图
 from modules.statistics import statistics_bp
-from modules.alarms import alarms_bp, save_alarm_record
+from modules.alarms import alarms_bp, save_alarm_record, init_notifier
 from modules.settings import settings_bp
 from modules.extensions import extensions_bp
+from modules.settings import get_settings_section
+from modules.detection_service import cameras_bp, init_service
+from modules.batching import BatchScheduler
+from modules.perception import PerceptionModule, ModelHandle, extract_detections, draw_detections
+from modules.motion import MotionGate
+from modules.tracking import AdaptiveStride, detect_adaptive
+from modules.pipeline import FramePipeline
+from modules.broadcaster import BroadcastHub
+from modules.retention import RetentionWorker, storage_usage
+from modules.tiering import TieringWorker
+from modules.spool import replayer
+from modules.db import get_db, mongo
+profiler.mark("imports")
 
 # ================= 配置区域 =================
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -38,6 +51,10 @@ FRONTEND_DIST = os.path.join(BASE_DIR, '..', 'frontend', 'dist')
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
 MODEL_PATH = os.path.join(BASE_DIR, 'best.pt')
 EVIDENCE_DIR = os.path.join(BASE_DIR, 'evidence')
+HISTORY_PAGE_SIZE = 100  # /api/history 分页（传 limit 或 cursor）时的默认每页条数
+HISTORY_MAX_PAGE_SIZE = 500
+VIDEO_CACHE_SECONDS = 3600  # 证据视频内容不会变化，浏览器可缓存
+PREVIEW_CACHE_SECONDS = 365 * 24 * 3600  # 预览图生成后不再变化，长期缓存
 FALL_LABELS = ['fall', 'falling', 'down', 'faint', 'lying', 'accident', 'fallen']
 
 def load_local_env():
@@ -64,16 +81,25 @@ load_local_env()
 # DeepSeek API 配置
 DEEPSEEK_API_KEY = os.environ.get('DEEPSEEK_API_KEY', '').strip()
 
-# 初始化 OpenAI 客户端
+# OpenAI 客户端在首次 AI 分析时创建
 deepseek_client = None
-if DEEPSEEK_API_KEY:
-    deepseek_client = OpenAI(
-        api_key=DEEPSEEK_API_KEY,
-        base_url="https://api.deepseek.com/v1"
-    )
-else:
+deepseek_lock = threading.Lock()
+if not DEEPSEEK_API_KEY:
     print("[Config] 未检测到 DEEPSEEK_API_KEY，AI 分析功能将不可用。")
 
+def get_deepseek_client():
+    """未配置 DEEPSEEK_API_KEY 时返回 None"""
+    global deepseek_client
+    if deepseek_client is None and DEEPSEEK_API_KEY:
+        with deepseek_lock:
+            if deepseek_client is None:
+                from openai import OpenAI
+                deepseek_client = OpenAI(
+                    api_key=DEEPSEEK_API_KEY,
+                    base_url="https://api.deepseek.com/v1"
+                )
+    return deepseek_client
+
 for path in [UPLOAD_FOLDER, EVIDENCE_DIR]:
     if not os.path.exists(path): os.makedirs(path)
 
@@ -88,6 +114,7 @@ class NoPollingFilter(logging.Filter):
         return True
 
 logging.getLogger('werkzeug').addFilter(NoPollingFilter())
+profiler.mark("config")
 
 # ================= Flask 初始化 =================
 app = Flask(__name__, 
@@ -101,16 +128,46 @@ app.register_blueprint(statistics_bp)
 app.register_blueprint(alarms_bp)
 app.register_blueprint(settings_bp)
 app.register_blueprint(extensions_bp)
+app.register_blueprint(cameras_bp)
+profiler.mark("blueprints")
+
+@app.errorhandler(ConnectionFailure)
+def handle_db_unavailable(e):
+    """请求中途数据库断开：断开熔断器，之后的请求在冷却期内直接失败，不再逐个等待超时"""
+    mongo.record_failure(e)
+    return jsonify({"error": "数据库暂不可用"}), 503
 
 # ================= 模块初始化 =================
+# 各模块导入时只登记 init_db，这里统一探活一次并初始化（数据库不可用时只等待一次超时）
+mongo.connect()
+
 # 使用条件初始化，避免多次导入时重复初始化
 if 'auth_module' not in globals():
     auth_module = AuthModule(db_name=os.path.join(BASE_DIR, 'users.db'))
 
+storage_settings = get_settings_section("storage")
+
 if 'storage' not in globals():
     storage = None
     if StorageModule:
-        storage = StorageModule(save_dir=EVIDENCE_DIR, buffer_seconds=3, after_seconds=2, fps=30)
+        storage = StorageModule(save_dir=EVIDENCE_DIR, buffer_seconds=3, after_seconds=2, fps=30,
+                                buffer_codec=storage_settings.get("bufferCodec", "raw"),
+                                keep_local_copy=bool(storage_settings.get("keepLocalCopy", False)))
+
+# 证据保留策略：统计现有占用后启动后台清理线程；较旧的片段由分层线程转码降级、归档
+retention_worker = None
+tiering_worker = None
+if storage:
+    storage_usage.scan(EVIDENCE_DIR, storage.db)
+    retention_worker = RetentionWorker(storage, lambda: get_settings_section("storage")).start()
+    storage.on_clip_saved = retention_worker.notify
+    tiering_worker = TieringWorker(storage, lambda: get_settings_section("storage")).start()
+
+# 数据库离线期间的写入暂存在本地 spool，后台重连后按顺序重放
+replayer.start()
+# 报警邮件 / 短信通知的分发队列与工作线程
+init_notifier(get_settings_section("notification"))
+profiler.mark("db")
 
 # ================= 模块 1: 训练管理器 =================
 class TrainingManager:
@@ -125,13 +182,12 @@ class TrainingManager:
         self._init_db()
 
     def _init_db(self):
-        try:
-            self.mongo_client = pymongo.MongoClient("mongodb://localhost:27017/", serverSelectionTimeoutMS=2000)
-            self.db = self.mongo_client["fall_detection_db"]
-            self.mongo_client.server_info()
-        except Exception as e:
-            print(f"[Training] MongoDB 连接失败，训练日志将仅输出到控制台: {e}")
-            self.db = None
+        # 共享 modules.db 的连接池；可用状态变化时重新调用
+        mongo.subscribe(self._init_db)
+        self.db = get_db()
+        self.mongo_client = mongo.client if self.db is not None else None
+        if self.db is None:
+            print(f"[Training] MongoDB 连接失败，训练日志将仅输出到控制台: {mongo.last_error}")
 
     def reset(self):
         self.metrics = {"epochs": [], "box_loss": [], "cls_loss": [], "map50": [], "precision": [], "recall": []}
@@ -187,6 +243,22 @@ class TrainingManager:
         finally:
             self.current_log_id = None
 
+    def _quantize(self, data_path, imgsz):
+        """训练完成后做 INT8 量化，精度与延迟对比写入训练日志"""
+        from modules.quantization import quantize_model
+        print("[Training] 开始 INT8 量化...")
+        report = quantize_model(
+            MODEL_PATH, data_path, imgsz,
+            max_map_drop=float(advanced_settings.get("quantizeMaxMapDrop", 0.01)),
+            fraction=float(advanced_settings.get("quantizeCalibrationFraction", 0.1))
+        )
+        if self.db is None or self.current_log_id is None:
+            return
+        try:
+            self.db.model_training_logs.update_one({"_id": self.current_log_id}, {"$set": {"quantization": report}})
+        except Exception as e:
+            print(f"[Training] 写入量化结果失败: {e}")
+
     def on_train_epoch_end(self, trainer):
         if self.stop_requested:
             trainer.stop = True
@@ -222,6 +294,7 @@ class TrainingManager:
                 print(f"[Training] 首次运行，正在下载预训练权重...")
             self._create_training_log(data_path, epochs, batch, imgsz, optimizer, lr0, pretrained_weights)
             
+            from ultralytics import YOLO
             model = YOLO(pretrained_weights) 
             model.add_callback("on_train_epoch_end", self.on_train_epoch_end)
             print(f"开始训练: {data_path}")
@@ -245,8 +318,11 @@ class TrainingManager:
                 if os.path.exists(trained_weight):
                     shutil.copy(trained_weight, MODEL_PATH)
                     print(">>> 模型已更新: best.pt")
-                    global detect_model
-                    detect_model = None 
+                    if advanced_settings.get("quantize", False):
+                        self._quantize(data_path, imgsz)
+                    # 新权重在后台加载预热后原子替换，视频流不中断
+                    perception.reload_async(MODEL_PATH)
+                    if inference_pool is not None: inference_pool.reload_async(MODEL_PATH)
                     self._finalize_training_log("completed", trained_weight)
                 else:
                     self._finalize_training_log("completed", "")
@@ -280,78 +356,193 @@ trainer = TrainingManager()
 # ================= 模块 2: 检测与视频流 =================
 video_state = { "source": 0, "conf": 0.30, "iou": 0.45, "table_data": [], "is_alarm": False, "last_alarm_print": 0, "last_alarm_save": 0, "is_paused": False, "last_frame_bytes": None, "is_running": True }
 lock = threading.Lock()
-detect_model = None 
+advanced_settings = get_settings_section("advanced")
+# 开启量化时优先加载通过验证的 INT8 模型，否则使用配置的后端
+perception = PerceptionModule(
+    MODEL_PATH,
+    backend="int8" if advanced_settings.get("quantize", False) else advanced_settings.get("backend", "torch"),
+    fallback_backend=advanced_settings.get("backend", "torch")
+)
+inference_pool = None
+if advanced_settings.get("processPool", False):
+    # 推理放到独立进程池，Web 进程不再承担模型计算
+    from modules.inference_pool import InferencePool
+    inference_pool = InferencePool(MODEL_PATH, backend=perception.backend,
+                                   fallback_backend=perception.fallback_backend,
+                                   workers=int(advanced_settings.get("workers", 4))).start()
+else:
+    # 启动时后台预加载并预热模型，首帧不再等待加载
+    perception.warmup_async(on_ready=lambda seconds: profiler.record("model", seconds))
+stream_hub = BroadcastHub()
+profiler.mark("model")
 
 def get_detect_model():
-    global detect_model
-    if detect_model is None:
-        if os.path.exists(MODEL_PATH):
-            print(f"\033[92m[System] 加载自定义模型\033[0m")
-            detect_model = YOLO(MODEL_PATH)
-        else:
-            print("\033[93m[System] 加载官方模型\033[0m")
-            detect_model = YOLO("yolov8n.pt")
-    return detect_model
+    """返回当前推理模型；开启进程池时返回进程池"""
+    if inference_pool is not None: return inference_pool
+    return perception.load_model()
+
+def create_motion_gate():
+    """按配置为每个视频流创建运动门控，关闭时返回 None"""
+    if not advanced_settings.get("motionGate", True): return None
+    return MotionGate(refresh_seconds=float(advanced_settings.get("motionRefreshSeconds", 5)))
+
+def create_stride():
+    """按配置为每个视频流创建自适应跨帧检测，关闭时返回 None"""
+    if not advanced_settings.get("adaptiveStride", False): return None
+    return AdaptiveStride(max_stride=int(advanced_settings.get("maxStride", 4)),
+                          max_latency_ms=float(advanced_settings.get("maxAlarmLatencyMs", 300)))
+
+def open_video_capture(source):
+    if source == 0 and os.name == 'nt':
+        return cv2.VideoCapture(0, cv2.CAP_DSHOW)
+    return cv2.VideoCapture(source)
+
+def run_detector(model, frame, conf, iou):
+    """执行一次模型推理，返回检测列表"""
+    if inference_pool is not None and model is inference_pool:
+        return inference_pool.detect(frame, conf, iou)
+    results = model(frame, conf=conf, iou=iou, verbose=False)
+    return extract_detections(results, model.names)
+
+def evaluate_detections(detections):
+    """跌倒判定，返回 (表格数据, 是否跌倒)；跟踪器外推的框同样参与判定"""
+    current_data = []
+    fall_detected_in_frame = False
+    for i, det in enumerate(detections):
+        cls_name = det["cls_name"]
+        is_fall = False
+        if cls_name.lower() in FALL_LABELS: is_fall = True
+        elif cls_name == 'person':
+            x1, y1, x2, y2 = det["coords"]
+            w = x2 - x1; h = y2 - y1
+            if (w / h if h > 0 else 0) > 1.2: is_fall = True
+        display_name = cls_name
+        if is_fall: fall_detected_in_frame = True; display_name = "FALLING"
+        current_data.append({ "id": i + 1, "class": display_name, "conf": f"{det['conf']:.1%}", "bbox": str(det["coords"]) })
+    return current_data, fall_detected_in_frame
+
+def analyze_frame(model, frame, motion_gate=None, stride=None):
+    """推理阶段：执行检测、跌倒判定并更新共享状态，返回 (检测列表, 表格数据, 是否跌倒)"""
+    conf, iou = video_state["conf"], video_state["iou"]
+    detections = detect_adaptive(
+        frame, lambda: run_detector(model, frame, conf, iou),
+        motion_gate=motion_gate, stride=stride,
+        alarm=video_state["is_alarm"], tracking=bool(video_state["table_data"]))
+    current_data, fall_detected_in_frame = evaluate_detections(detections)
+    with lock: video_state["table_data"] = current_data; video_state["is_alarm"] = fall_detected_in_frame
+    if fall_detected_in_frame:
+        if storage: storage.save_event_clip()
+        if time.time() - video_state["last_alarm_print"] > 1.0:
+            print(f"\033[91m[ALARM] 跌倒检测触发!\033[0m")
+            video_state["last_alarm_print"] = time.time()
+        if time.time() - video_state["last_alarm_save"] > 5.0:
+            src = video_state["source"]
+            loc = "摄像头" if src == 0 else os.path.basename(str(src))
+            save_alarm_record(location=loc, alarm_type="跌倒")
+            video_state["last_alarm_save"] = time.time()
+    return detections, current_data, fall_detected_in_frame
+
+def annotate_frame(frame, analysis):
+    """编码阶段：绘制检测框与报警提示"""
+    detections, current_data, fall_detected_in_frame = analysis
+    annotated_frame = draw_detections(frame, detections, labels=[d["class"] for d in current_data])
+    if fall_detected_in_frame:
+        cv2.rectangle(annotated_frame, (0, 0), (annotated_frame.shape[1], annotated_frame.shape[0]), (0, 0, 255), 10)
+        cv2.putText(annotated_frame, "!!! FALL DETECTED !!!", (50, 80), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 255), 4)
+    return annotated_frame
+
+def build_pipeline(source):
+    motion_gate = create_motion_gate()
+    stride = create_stride()
+    return FramePipeline(
+        open_capture=lambda: open_video_capture(source),
+        # 每帧取当前模型，训练完成后的热替换在下一帧生效
+        infer=lambda frame: analyze_frame(get_detect_model(), frame, motion_gate, stride),
+        annotate=annotate_frame,
+        # 证据缓冲直接持有帧环句柄，不再复制像素
+        on_capture=storage.buffer_frame if storage else None,
+        is_paused=lambda: video_state["is_paused"],
+        loop=isinstance(source, str),
+        motion_gate=motion_gate,
+        stride=stride,
+        ring_slots=(storage.held_frames if storage else 0) + 8
+    )
+
+def on_stream_stopped(source):
+    print("[System] 资源释放")
+    with lock: video_state["table_data"] = []; video_state["is_alarm"] = False
 
 def generate_frames():
     with lock: video_state["is_running"] = True
-    cap = cv2.VideoCapture(video_state["source"]) if not (video_state["source"] == 0 and os.name == 'nt') else cv2.VideoCapture(0, cv2.CAP_DSHOW)
-    model = get_detect_model()
+    source = video_state["source"]
+    # 同一视频源的所有观看者共享一条检测流水线
+    subscription = stream_hub.subscribe(source, lambda: build_pipeline(source), on_stop=on_stream_stopped)
     print("[System] 视频流已开启...")
     try:
-        while cap.isOpened():
+        while True:
             if not video_state["is_running"]: break
             if video_state["is_paused"]:
                 if video_state["last_frame_bytes"]: yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + video_state["last_frame_bytes"] + b'\r\n')
                 time.sleep(0.1)
                 continue
-            success, frame = cap.read()
-            if not success:
-                if isinstance(video_state["source"], str): cap.set(cv2.CAP_PROP_POS_FRAMES, 0); continue
-                else: break 
-            if storage: storage.buffer_frame(frame.copy())
-            results = model(frame, conf=video_state["conf"], iou=video_state["iou"], verbose=False)
-            annotated_frame = results[0].plot()
-            current_data = []
-            fall_detected_in_frame = False
-            for r in results:
-                for i, box in enumerate(r.boxes):
-                    coords = box.xyxy[0].cpu().numpy().astype(int)
-                    conf = float(box.conf[0])
-                    cls_id = int(box.cls[0])
-                    cls_name = model.names[cls_id]
-                    is_fall = False
-                    if cls_name.lower() in FALL_LABELS: is_fall = True
-                    elif cls_name == 'person':
-                        x1, y1, x2, y2 = coords
-                        w = x2 - x1; h = y2 - y1
-                        if (w / h if h > 0 else 0) > 1.2: is_fall = True
-                    display_name = cls_name
-                    if is_fall: fall_detected_in_frame = True; display_name = "FALLING"
-                    current_data.append({ "id": i + 1, "class": display_name, "conf": f"{conf:.1%}", "bbox": str(coords.tolist()) })
-            with lock: video_state["table_data"] = current_data; video_state["is_alarm"] = fall_detected_in_frame
-            if fall_detected_in_frame:
-                cv2.rectangle(annotated_frame, (0, 0), (annotated_frame.shape[1], annotated_frame.shape[0]), (0, 0, 255), 10)
-                cv2.putText(annotated_frame, "!!! FALL DETECTED !!!", (50, 80), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 255), 4)
-                if storage: storage.save_event_clip()
-                if time.time() - video_state["last_alarm_print"] > 1.0:
-                    print(f"\033[91m[ALARM] 跌倒检测触发!\033[0m")
-                    video_state["last_alarm_print"] = time.time()
-                if time.time() - video_state["last_alarm_save"] > 5.0:
-                    src = video_state["source"]
-                    loc = "摄像头" if src == 0 else os.path.basename(str(src))
-                    save_alarm_record(location=loc, alarm_type="跌倒")
-                    video_state["last_alarm_save"] = time.time()
-            ret, buffer = cv2.imencode('.jpg', annotated_frame)
-            frame_bytes = buffer.tobytes()
+            frame_bytes = subscription.next(timeout=1.0)
+            if frame_bytes is None:
+                if subscription.finished: break
+                continue
             video_state["last_frame_bytes"] = frame_bytes
             yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
     except GeneratorExit: print("[System] 前端断开连接")
     except Exception as e: print(f"[System] 视频流异常: {e}")
     finally:
-        if cap.isOpened(): cap.release()
-        print("[System] 资源释放")
-        with lock: video_state["table_data"] = []; video_state["is_alarm"] = False
+        subscription.close()
+
+# ================= 模块 3: 多路摄像头检测服务 =================
+def create_detect_model():
+    """为每个推理线程创建独立模型实例（与单路视频流使用相同的推理后端，训练完成后一起热替换）"""
+    if inference_pool is not None: return inference_pool
+    instance = perception.spawn()
+    instance.load_model()
+    return ModelHandle(instance)
+
+def create_camera_storage(worker):
+    if not StorageModule: return None
+    camera_storage = StorageModule(save_dir=EVIDENCE_DIR, buffer_seconds=3, after_seconds=2,
+                                   fps=int(worker.framerate or 30), location=worker.location,
+                                   buffer_codec=storage_settings.get("bufferCodec", "raw"),
+                                   keep_local_copy=bool(storage_settings.get("keepLocalCopy", False)))
+    if retention_worker: camera_storage.on_clip_saved = retention_worker.notify
+    return camera_storage
+
+batch_size = int(advanced_settings.get("batchSize", 4))
+batch_scheduler = None
+camera_model_factory = create_detect_model
+if batch_size > 1 and inference_pool is None:
+    # 多路摄像头的帧汇聚成微批，由调度线程独占一个模型实例
+    batch_scheduler = BatchScheduler(create_detect_model, max_batch=batch_size,
+                                     deadline_ms=float(advanced_settings.get("batchDeadlineMs", 15)))
+    camera_model_factory = batch_scheduler.as_model
+
+def camera_thresholds():
+    """多路检测使用系统配置中的检测阈值"""
+    detection = get_settings_section("detection")
+    return float(detection.get("confidence", 0.30)), float(detection.get("iou", 0.45))
+
+camera_service = init_service(
+    model_factory=camera_model_factory,
+    detect=run_detector,
+    evaluate=evaluate_detections,
+    annotate=annotate_frame,
+    open_capture=open_video_capture,
+    storage_factory=create_camera_storage,
+    on_alarm=lambda worker: save_alarm_record(location=worker.location, alarm_type="跌倒"),
+    gate_factory=create_motion_gate,
+    stride_factory=create_stride,
+    get_thresholds=camera_thresholds,
+    # 推理线程数不少于批大小，否则批次无法填满
+    workers=max(int(advanced_settings.get("workers", 4)), batch_size)
+)
+if advanced_settings.get("multiCamera"):
+    camera_service.reload()
 
 # ================= API 路由 =================
 @app.route('/')
@@ -391,15 +582,125 @@ def verify_token():
 # --- 其他接口 (保持不变) ---
 @app.route('/api/video/db/<string:file_id>')
 def stream_video_from_db(file_id):
+    """支持 Range 分段请求与 ETag/Last-Modified 缓存；只读取请求范围内的数据"""
+    if not storage: return "Storage module not initialized", 500
+    video = storage.open_video(file_id)
+    if not video: return "Video not found", 404
+    if video.get("path"):
+        # 本地文件交给 send_file 处理 Range/条件请求（支持时使用 sendfile）
+        return send_file(video["path"], mimetype='video/mp4', conditional=True, max_age=VIDEO_CACHE_SECONDS)
+    return gridfs_range_response(video["grid_out"])
+
+@app.route('/api/video/db/<string:file_id>/<any(poster, sprite):kind>.jpg')
+def video_preview_image(file_id, kind):
+    """片段封面 / 拖动预览图，列表页只需加载几 KB 的图片而不是整个视频"""
     if not storage: return "Storage module not initialized", 500
-    video_blob = storage.get_video_blob(file_id)
-    if not video_blob: return "Video not found", 404
-    return Response(video_blob, mimetype='video/mp4')
+    preview = storage.get_preview(file_id, kind)
+    if not preview: return "Preview not found", 404
+    if preview.get("pending"): return preview_pending_response("Preview not ready")
+    if preview.get("path"):
+        response = send_file(preview["path"], mimetype='image/jpeg', conditional=True)
+    else:
+        grid_out = preview["grid_out"]
+        response = Response(grid_out.read(), mimetype='image/jpeg')
+        response.set_etag(str(grid_out._id))
+        response.last_modified = grid_out.upload_date
+        grid_out.close()
+        response.make_conditional(request)
+    response.headers["Cache-Control"] = f"private, max-age={PREVIEW_CACHE_SECONDS}, immutable"
+    return response
+
+@app.route('/api/video/db/<string:file_id>/preview')
+def video_preview_meta(file_id):
+    """预览图地址与拖动预览图的网格信息（每张缩略图对应的时间点）"""
+    if not storage: return jsonify({"error": "Storage module not initialized"}), 500
+    preview = storage.get_preview(file_id, "meta")
+    if preview is None: return jsonify({"error": "Preview not found"}), 404
+    if preview.get("pending"): return preview_pending_response(jsonify({"error": "Preview not ready"}))
+    response = jsonify({
+        "poster": f"/api/video/db/{file_id}/poster.jpg",
+        "sprite": f"/api/video/db/{file_id}/sprite.jpg",
+        **preview["meta"]
+    })
+    response.headers["Cache-Control"] = f"private, max-age={PREVIEW_CACHE_SECONDS}, immutable"
+    return response
+
+def preview_pending_response(body):
+    """预览图正在后台补生成：返回 404 且不缓存，客户端稍后重试即可拿到"""
+    response = make_response(body, 404)
+    response.headers["Cache-Control"] = "no-store"
+    response.headers["Retry-After"] = "5"
+    return response
+
+def gridfs_range_response(grid_out, chunk_size=256 * 1024):
+    """GridFS 文件的分段响应：按请求范围 seek 后逐块读取，内存占用与片段大小无关"""
+    length = grid_out.length
+    etag = f"{grid_out._id}-{length}"
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": f"private, max-age={VIDEO_CACHE_SECONDS}"}
+    not_modified = Response(status=304, headers=headers)
+    not_modified.set_etag(etag)
+    not_modified.last_modified = grid_out.upload_date
+    if request.if_none_match.contains(etag):
+        grid_out.close(); return not_modified
+    if not request.if_none_match and request.if_modified_since and grid_out.upload_date:
+        if grid_out.upload_date.replace(microsecond=0, tzinfo=None) <= request.if_modified_since.replace(tzinfo=None):
+            grid_out.close(); return not_modified
+
+    start, stop, status = 0, length, 200
+    byte_range = request.range
+    # If-Range 与当前版本不一致时忽略 Range，返回完整文件
+    if_range = request.if_range
+    if byte_range and (not (if_range.etag or if_range.date) or if_range.etag == etag):
+        span = byte_range.range_for_length(length)
+        if span is None:
+            grid_out.close()
+            return Response(status=416, headers={"Content-Range": f"bytes */{length}"})
+        start, stop = span
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{length}"
+    headers["Content-Length"] = str(stop - start)
+
+    def generate():
+        try:
+            grid_out.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = grid_out.read(min(chunk_size, remaining))
+                if not chunk: break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            grid_out.close()
+
+    response = Response(generate(), status=status, mimetype='video/mp4', headers=headers, direct_passthrough=True)
+    response.set_etag(etag)
+    response.last_modified = grid_out.upload_date
+    return response
 
 @app.route('/api/history', methods=['GET'])
 def get_history():
+    """
+    分页历史记录：?limit=&cursor=&start=&end=
+    响应体仍为数组（兼容前端），下一页游标放在 X-Next-Cursor 响应头；
+    limit 与 cursor 都未传时返回全部记录（回放页一次加载并在本地搜索），只传 cursor 时每页 HISTORY_PAGE_SIZE 条
+    """
     if not storage: return jsonify([])
-    return jsonify(storage.get_all_records())
+    cursor = request.args.get('cursor') or None
+    limit = None
+    if 'limit' in request.args or cursor is not None:
+        try:
+            limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+        except ValueError:
+            return jsonify({"error": "limit 参数无效"}), 400
+    try:
+        records, next_cursor = storage.get_records(limit, cursor, request.args.get('start'), request.args.get('end'))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    response = jsonify(records)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Access-Control-Expose-Headers'] = 'X-Next-Cursor'
+    return response
 
 @app.route('/api/history/<string:record_id>', methods=['DELETE'])
 def delete_history(record_id):
@@ -407,6 +708,31 @@ def delete_history(record_id):
     ok, msg = storage.delete_record(record_id)
     return jsonify({"success": ok, "msg": msg}), (200 if ok else 500)
 
+@app.route('/api/video/pipeline')
+def get_pipeline_stats():
+    streams = stream_hub.stats()
+    return jsonify({"running": bool(streams), "streams": streams})
+
+@app.route('/api/cameras/batching')
+def get_batching_stats():
+    if batch_scheduler is None: return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **batch_scheduler.stats()})
+
+@app.route('/api/spool')
+def get_spool_stats():
+    """离线写入缓冲状态：待重放 / 已重放 / 丢弃的记录数，以及共享连接的熔断状态"""
+    return jsonify({**replayer.stats(), "db": mongo.stats()})
+
+@app.route('/api/system/startup')
+def get_startup_stats():
+    """启动各阶段耗时（毫秒）；model 为后台加载预热耗时，完成后才出现"""
+    return jsonify(profiler.stats())
+
+@app.route('/api/inference/pool')
+def get_inference_pool_stats():
+    if inference_pool is None: return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **inference_pool.stats()})
+
 @app.route('/api/video/stop', methods=['POST'])
 def stop_video_stream():
     with lock: video_state["is_running"] = False
@@ -418,6 +744,8 @@ def browse_dataset_file():
     if not allowed:
         return jsonify({"success": False, "msg": "仅管理员可访问"}), 403
     try:
+        import tkinter as tk
+        from tkinter import filedialog
         root = tk.Tk(); root.withdraw(); root.attributes('-topmost', True)
         file_path = filedialog.askopenfilename(title="Select data.yaml", filetypes=[("YAML", "*.yaml"), ("All", "*.*")])
         root.destroy()
@@ -490,7 +818,8 @@ def get_alarm_status():
 def ai_analyze():
     """DeepSeek AI 分析跌倒检测数据"""
     try:
-        if deepseek_client is None:
+        client = get_deepseek_client()
+        if client is None:
             return jsonify({
                 "success": False,
                 "error": "未配置 DEEPSEEK_API_KEY，请在 .env 或环境变量中设置"
@@ -536,7 +865,7 @@ def ai_analyze():
 请用简洁专业的中文回答，不超过200字。"""
         
         # 使用 OpenAI 客户端调用 DeepSeek API
-        response = deepseek_client.chat.completions.create(
+        response = client.chat.completions.create(
             model="deepseek-chat",
             messages=[
                 {"role": "system", "content": "你是一个专业的跌倒检测分析助手，擅长分析视频监控数据并提供安全建议。"},
@@ -562,6 +891,9 @@ def ai_analyze():
             "error": str(e)
         }), 500
 
+profiler.mark("routes")
+profiler.finish()
+
 if __name__ == '__main__':
     print("系统启动成功！访问 http://localhost:5000")
     app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
@@ -0,0 +1,127 @@
+"""
+推理后端一致性与延迟对比
+以 torch 后端为基准，比较 onnx / openvino 在样例帧上的检测结果（同类别、IoU、置信度），
+并输出各后端的单帧延迟；任一后端一致性不达标时以非零状态码退出
+一致性断言同时由 tests/test_backend_parity.py 在测试中执行
+
+用法（在 backend 目录下）:
+    python benchmarks/bench_backends.py --video uploads/test.mp4
+    python benchmarks/bench_backends.py --images samples/ --backends onnx openvino
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from modules.perception import PerceptionModule, extract_detections  # noqa: E402
+from modules.tracking import box_iou  # noqa: E402
+
+
+def load_frames(args):
+    import cv2
+    frames = []
+    if args.video:
+        cap = cv2.VideoCapture(args.video)
+        step = max(1, int(args.stride))
+        index = 0
+        while len(frames) < args.count:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if index % step == 0:
+                frames.append(frame)
+            index += 1
+        cap.release()
+    elif args.images:
+        for name in sorted(os.listdir(args.images)):
+            if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                frames.append(cv2.imread(os.path.join(args.images, name)))
+            if len(frames) >= args.count:
+                break
+    if not frames:
+        print("未提供样例视频/图片，使用随机帧（仅能比较延迟，一致性结果无意义）")
+        rng = np.random.default_rng(0)
+        frames = [rng.integers(0, 255, (480, 640, 3), dtype=np.uint8) for _ in range(args.count)]
+    return frames
+
+
+def run_backend(backend, frames, args):
+    model = PerceptionModule(args.weights, backend=backend).load_model()
+    # 预热
+    for frame in frames[:3]:
+        model(frame, conf=args.conf, iou=args.iou, verbose=False)
+    outputs, latencies = [], []
+    for frame in frames:
+        started = time.perf_counter()
+        results = model(frame, conf=args.conf, iou=args.iou, verbose=False)
+        latencies.append(time.perf_counter() - started)
+        outputs.append(extract_detections(results, model.names))
+    return outputs, latencies
+
+
+def compare(reference, candidate, iou_threshold, conf_tolerance):
+    """返回 (匹配框数, 基准框数, 候选框数)"""
+    matched = 0
+    total_ref = total_cand = 0
+    for ref_dets, cand_dets in zip(reference, candidate):
+        total_ref += len(ref_dets)
+        total_cand += len(cand_dets)
+        used = set()
+        for ref in ref_dets:
+            for j, cand in enumerate(cand_dets):
+                if j in used or cand["cls_name"] != ref["cls_name"]:
+                    continue
+                if box_iou(ref["coords"], cand["coords"]) >= iou_threshold and \
+                        abs(ref["conf"] - cand["conf"]) <= conf_tolerance:
+                    used.add(j)
+                    matched += 1
+                    break
+    return matched, total_ref, total_cand
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推理后端一致性与延迟对比")
+    parser.add_argument('--backends', nargs='+', default=['onnx', 'openvino'])
+    parser.add_argument('--weights', default=os.path.join(BACKEND_DIR, 'best.pt'))
+    parser.add_argument('--video', default='')
+    parser.add_argument('--images', default='')
+    parser.add_argument('--count', type=int, default=50)
+    parser.add_argument('--stride', type=int, default=5, help='视频取样间隔帧数')
+    parser.add_argument('--conf', type=float, default=0.30)
+    parser.add_argument('--iou', type=float, default=0.45)
+    parser.add_argument('--match-iou', type=float, default=0.9)
+    parser.add_argument('--conf-tolerance', type=float, default=0.05)
+    parser.add_argument('--min-match', type=float, default=0.95, help='匹配率下限')
+    args = parser.parse_args()
+
+    frames = load_frames(args)
+    reference, ref_latency = run_backend('torch', frames, args)
+    rows = [('torch', ref_latency, None)]
+    failed = False
+    for backend in args.backends:
+        outputs, latency = run_backend(backend, frames, args)
+        matched, total_ref, total_cand = compare(reference, outputs, args.match_iou, args.conf_tolerance)
+        denominator = max(total_ref, total_cand)
+        rate = matched / denominator if denominator else 1.0
+        failed = failed or rate < args.min_match
+        rows.append((backend, latency, rate))
+
+    print(f"{len(frames)} 帧, conf={args.conf}, iou={args.iou}")
+    print(f"{'backend':>9} | {'p50 ms':>7} | {'p95 ms':>7} | {'speedup':>7} | {'match':>6}")
+    print("-" * 50)
+    ref_p50 = np.percentile(ref_latency, 50)
+    for backend, latency, rate in rows:
+        p50, p95 = np.percentile(latency, 50), np.percentile(latency, 95)
+        match = "-" if rate is None else f"{rate:.1%}"
+        print(f"{backend:>9} | {p50 * 1000:>7.1f} | {p95 * 1000:>7.1f} | {ref_p50 / p50:>6.2f}x | {match:>6}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
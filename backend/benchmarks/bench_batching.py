@@ -0,0 +1,119 @@
+"""
+微批推理基准测试
+模拟多路视频流并发提交帧，统计批大小 1~8 下的吞吐 (frames/sec) 与 p95 延迟
+
+用法（在 backend 目录下）:
+    python benchmarks/bench_batching.py --streams 8 --seconds 10
+    python benchmarks/bench_batching.py --video uploads/test.mp4 --deadline-ms 20
+    python benchmarks/bench_batching.py --fake   # 不加载模型，用模拟耗时验证调度逻辑
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from modules.batching import BatchScheduler  # noqa: E402
+
+
+class FakeModel:
+    """模拟批推理耗时：固定开销 + 每帧边际开销"""
+    names = {0: "person"}
+
+    def __init__(self, fixed_ms=25, per_frame_ms=8):
+        self.fixed = fixed_ms / 1000.0
+        self.per_frame = per_frame_ms / 1000.0
+
+    def __call__(self, frames, conf=0.25, iou=0.45, verbose=False):
+        frames = frames if isinstance(frames, list) else [frames]
+        time.sleep(self.fixed + self.per_frame * len(frames))
+        return [None] * len(frames)
+
+
+def load_frames(video_path, count=32, size=(640, 480)):
+    if video_path:
+        import cv2
+        cap = cv2.VideoCapture(video_path)
+        frames = []
+        while len(frames) < count:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+        cap.release()
+        if frames:
+            return frames
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8) for _ in range(count)]
+
+
+def model_factory(args):
+    if args.fake:
+        return FakeModel()
+    from ultralytics import YOLO
+    weights = args.weights or os.path.join(BACKEND_DIR, 'best.pt')
+    if not os.path.exists(weights):
+        weights = 'yolov8n.pt'
+    return YOLO(weights)
+
+
+def run_once(args, frames, batch_size):
+    scheduler = BatchScheduler(lambda: model_factory(args), max_batch=batch_size, deadline_ms=args.deadline_ms)
+    scheduler.as_model()
+    # 预热，避免首批包含模型初始化开销
+    scheduler.infer(frames[0], args.conf, args.iou)
+    scheduler.batches = scheduler.frames = 0
+    scheduler._latencies.clear()
+
+    stop = threading.Event()
+
+    def stream(index):
+        i = index
+        while not stop.is_set():
+            scheduler.infer(frames[i % len(frames)], args.conf, args.iou, source=index)
+            i += 1
+
+    threads = [threading.Thread(target=stream, args=(i,), daemon=True) for i in range(args.streams)]
+    started = time.time()
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - started
+    stats = scheduler.stats()
+    scheduler.stop()
+    return stats["frames"] / elapsed, stats["p95_ms"], stats["avg_batch"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="微批推理吞吐/延迟基准")
+    parser.add_argument('--streams', type=int, default=8, help='并发视频流数量')
+    parser.add_argument('--seconds', type=float, default=10, help='每个批大小的测试时长')
+    parser.add_argument('--deadline-ms', type=float, default=15)
+    parser.add_argument('--max-batch', type=int, default=8)
+    parser.add_argument('--conf', type=float, default=0.30)
+    parser.add_argument('--iou', type=float, default=0.45)
+    parser.add_argument('--video', default='', help='用于取样的视频文件，缺省使用随机帧')
+    parser.add_argument('--weights', default='')
+    parser.add_argument('--fake', action='store_true', help='使用模拟模型')
+    args = parser.parse_args()
+
+    frames = load_frames(args.video)
+    print(f"streams={args.streams} deadline={args.deadline_ms}ms frame={frames[0].shape[1]}x{frames[0].shape[0]}")
+    print(f"{'batch':>5} | {'frames/s':>9} | {'p95 ms':>8} | {'avg batch':>9}")
+    print("-" * 42)
+    for batch_size in range(1, args.max_batch + 1):
+        fps, p95, avg_batch = run_once(args, frames, batch_size)
+        print(f"{batch_size:>5} | {fps:>9.1f} | {p95:>8.1f} | {avg_batch:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+报警通知分发压测
+用 DryRunTransport 模拟报警风暴：alarms 次报警 × 每次 recipients 个收件人，
+统计从提交到全部完成的耗时、端到端延迟分位数、发送线程数和重试情况，不连接任何外部服务
+
+用法（在 backend 目录下）:
+    python benchmarks/bench_notify.py --alarms 200 --recipients 10
+    python benchmarks/bench_notify.py --latency-ms 300 --failure-rate 0.2 --retry-base 0.05
+    python benchmarks/bench_notify.py --digest-ms 500 --interval-ms 10   # 摘要合并后的实际发送次数
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from modules.notify import DigestBuffer, DryRunTransport, NotificationDispatcher  # noqa: E402
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="报警通知分发压测（dry-run）")
+    parser.add_argument('--alarms', type=int, default=200, help='报警次数')
+    parser.add_argument('--recipients', type=int, default=10, help='每次报警的收件人数')
+    parser.add_argument('--channels', nargs='+', default=['email', 'sms'])
+    parser.add_argument('--workers', type=int, default=4, help='每个渠道的发送线程数')
+    parser.add_argument('--latency-ms', type=float, default=50, help='模拟单次发送耗时')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='模拟发送失败比例')
+    parser.add_argument('--retry-base', type=float, default=0.05, help='首次重试间隔（秒）')
+    parser.add_argument('--queue-size', type=int, default=5000)
+    parser.add_argument('--rate-limit', type=int, default=0, help='每个收件人在窗口内的发送上限，超出的推迟合并，0 为不限制')
+    parser.add_argument('--rate-window', type=float, default=1.0, help='频率限制窗口（秒）')
+    parser.add_argument('--digest-ms', type=float, default=0, help='摘要合并窗口，0 为不合并')
+    parser.add_argument('--interval-ms', type=float, default=0, help='相邻两次报警的间隔')
+    args = parser.parse_args()
+
+    latencies = []
+    results = {"ok": 0, "failed": 0}
+    done = threading.Event()
+    lock = threading.Lock()
+    total = args.alarms * args.recipients * len(args.channels)
+
+    def on_result(job, success, message):
+        # 合并后的一条通知覆盖 payload 中的全部报警
+        with lock:
+            for alarm in job.payload["alarms"]:
+                for _ in job.recipients:
+                    latencies.append(time.time() - alarm["created_at"])
+                    results["ok" if success else "failed"] += 1
+            if len(latencies) >= total:
+                done.set()
+
+    dispatcher = NotificationDispatcher(on_result=on_result, queue_size=args.queue_size, base_delay=args.retry_base,
+                                        max_delay=args.retry_base * 8, rate_limit=args.rate_limit,
+                                        rate_window=args.rate_window)
+    for channel in args.channels:
+        # 超出频率限制推迟中的通知与新报警合并，与 modules.alarms 的邮件 / 短信渠道一致
+        dispatcher.register(channel, DryRunTransport(channel, args.latency_ms / 1000.0, args.failure_rate),
+                            workers=args.workers, merge=lambda payload, newer: {"alarms": payload["alarms"] + newer["alarms"]})
+
+    def submit(key, alarms):
+        channel, recipient = key
+        dispatcher.submit(channel, recipient, {"alarms": alarms}, alarm_id=alarms[0]["id"])
+
+    digest = DigestBuffer(args.digest_ms / 1000.0, submit) if args.digest_ms else None
+    threads_before = threading.active_count()
+    started = time.time()
+    for alarm_id in range(args.alarms):
+        alarm = {"id": alarm_id, "created_at": time.time()}
+        for channel in args.channels:
+            for i in range(args.recipients):
+                key = (channel, f"{channel}-{i}")
+                if digest:
+                    digest.add(key, alarm)
+                else:
+                    submit(key, [alarm])
+        if args.interval_ms:
+            time.sleep(args.interval_ms / 1000.0)
+    submit_seconds = time.time() - started
+    peak_threads = threading.active_count() - threads_before
+    done.wait()
+    elapsed = time.time() - started
+    dispatcher.stop()
+
+    print(f"通知 {total} 条（{args.alarms} 次报警 × {args.recipients} 人 × {len(args.channels)} 渠道）")
+    print(f"提交耗时 {submit_seconds * 1000:.0f} ms，全部完成 {elapsed:.2f}s，吞吐 {total / elapsed:.0f} 条/s")
+    print(f"端到端延迟 p50 {percentile(latencies, 50) * 1000:.0f} ms  p95 {percentile(latencies, 95) * 1000:.0f} ms  "
+          f"p99 {percentile(latencies, 99) * 1000:.0f} ms")
+    print(f"成功 {results['ok']}  失败 {results['failed']}  发送线程 {peak_threads}")
+    calls = sum(entry["transport"].calls for entry in dispatcher.channels.values())
+    print(f"实际发送 {calls} 次" + (f"（合并窗口 {args.digest_ms:.0f} ms）" if digest else ""))
+    for channel, stats in dispatcher.stats()["channels"].items():
+        print(f"  {channel:<6} {stats}")
+
+
+if __name__ == '__main__':
+    main()
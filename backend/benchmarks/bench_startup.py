@@ -0,0 +1,95 @@
+"""
+启动耗时回归基准
+启动后端进程，轮询 /api/system/startup 直到返回 200，统计进程启动到首个健康响应的耗时，
+并汇总进程内各阶段耗时（imports / config / blueprints / db / model / routes）
+
+用法（在 backend 目录下）:
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --runs 3 --max-seconds 5   # 中位数超过 5 秒时退出码为 1，可用于 CI
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEALTH_PATH = '/api/system/startup'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_once(timeout):
+    """启动一次后端进程，返回 (首个健康响应耗时秒数, 进程内阶段统计)；超时返回 (None, None)"""
+    port = free_port()
+    # 不走 app.py 的 __main__（固定端口、debug 模式），直接运行导入后的 Flask 应用
+    code = f"import app; app.app.run(host='127.0.0.1', port={port}, use_reloader=False)"
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-c', code], cwd=BACKEND_DIR,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}{HEALTH_PATH}"
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"后端进程提前退出，退出码 {proc.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as resp:
+                    if resp.status == 200:
+                        elapsed = time.perf_counter() - started
+                        return elapsed, json.loads(resp.read())
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                pass
+            time.sleep(0.02)
+        return None, None
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="进程启动到首个健康响应的耗时")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=120, help='单次启动的最长等待时间（秒）')
+    parser.add_argument('--max-seconds', type=float, default=0, help='中位数超过该值时以退出码 1 结束，0 表示不检查')
+    args = parser.parse_args()
+
+    results = []
+    phases = {}
+    for i in range(args.runs):
+        elapsed, stats = start_once(args.timeout)
+        if elapsed is None:
+            print(f"第 {i + 1} 次: {args.timeout:.0f}s 内未就绪")
+            sys.exit(1)
+        results.append(elapsed)
+        if stats.get("interpreter_ms") is not None:
+            phases.setdefault("interpreter", []).append(stats["interpreter_ms"])
+        for phase in stats.get("phases", []):
+            phases.setdefault(phase["name"], []).append(phase["ms"])
+        print(f"第 {i + 1} 次: {elapsed * 1000:.0f} ms")
+
+    median = statistics.median(results)
+    print(f"\n首个健康响应: 中位数 {median * 1000:.0f} ms  最快 {min(results) * 1000:.0f} ms  "
+          f"最慢 {max(results) * 1000:.0f} ms  ({args.runs} 次)")
+    print("进程内阶段耗时（中位数）:")
+    for name, values in phases.items():
+        print(f"  {name:<12} {statistics.median(values):8.0f} ms")
+    if args.max_seconds and median > args.max_seconds:
+        print(f"❌ 启动耗时超过 {args.max_seconds:.1f}s")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,14 +4,18 @@
 """
 
 from flask import Blueprint, jsonify, request
-import pymongo
-from datetime import datetime
+from datetime import datetime, timedelta
 import smtplib
-import ssl
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import json
+import os
+import threading
 import time as _time_module
+from modules.db import get_db, mongo
+from modules.notify import (DigestBuffer, DryRunTransport, NotificationDispatcher, PermanentError, SmtpConnectionPool,
+                            SplitBatch)
+from modules.spool import spooled_write
 
 alarms_bp = Blueprint('alarms', __name__, url_prefix='/api/alarms')
 
@@ -21,12 +25,9 @@ db = None
 
 
 def log_audit(action, username="system", details="", target_type="", target_id=None, status="success"):
-    """写入审计日志，失败时静默降级为控制台输出"""
-    if db is None:
-        print(f"[Audit] skip {action}: DB not connected")
-        return
+    """写入审计日志；数据库不可用时暂存本地 spool，恢复后重放"""
     try:
-        db.audit_logs.insert_one({
+        spooled_write(db, "audit_logs", "insert_one", {
             "username": username or "system",
             "action": action,
             "details": details,
@@ -39,37 +40,108 @@ def log_audit(action, username="system", details="", target_type="", target_id=N
         print(f"[Audit] 写入失败: {e}")
 
 
-def log_notification(channel, recipient, success, message="", alarm_id=None):
-    """记录通知发送结果"""
-    if db is None:
-        print(f"[Notification Log] skip {channel}: DB not connected")
-        return
+def log_notification(channel, recipient, success, message="", alarm_id=None, latency_ms=None):
+    """记录通知发送结果（latency_ms: 报警产生到发送完成的耗时）；数据库不可用时暂存本地 spool"""
     try:
-        db.notification_logs.insert_one({
+        spooled_write(db, "notification_logs", "insert_one", {
             "alarm_id": alarm_id,
             "channel": channel,
             "recipient": recipient,
             "success": bool(success),
             "message": message,
+            "latency_ms": round(latency_ms, 1) if latency_ms is not None else None,
             "created_at": datetime.now()
         })
     except Exception as e:
         print(f"[Notification Log] 写入失败: {e}")
 
 def init_db():
-    """初始化数据库连接"""
+    """初始化数据库连接（共享 modules.db 的连接池，可用状态变化时重新调用）"""
     global mongo_client, db
-    try:
-        mongo_client = pymongo.MongoClient("mongodb://localhost:27017/", serverSelectionTimeoutMS=2000)
-        db = mongo_client["fall_detection_db"]
-        mongo_client.server_info()
+    db = get_db()
+    mongo_client = mongo.client if db is not None else None
+    if db is not None:
         print("[Alarms] ✅ MongoDB 连接成功")
-    except Exception as e:
-        print(f"[Alarms] ❌ MongoDB 连接失败: {e}")
-        db = None
+    else:
+        print(f"[Alarms] ❌ MongoDB 连接失败: {mongo.last_error}")
+
+# 数据库在 app 启动时统一连接（modules.db.mongo.connect）
+mongo.on_connect(init_db)
+
+# 通知分发器：报警邮件 / 短信经有界队列由固定的工作线程发送
+notifier = None
+# 邮件发送线程共享的 SMTP 长连接；开启摘要模式时同一收件人窗口内的报警合并为一封邮件
+smtp_pool = SmtpConnectionPool()
+email_digest = None
+sms_batch_size = 100  # 每次短信请求的号码数上限
+
+
+def _log_delivery(job, success, message):
+    if job.channel == "alarm":
+        # 报警分发任务（查询配置和联系人）只在失败时打印，实际通知各自记录
+        if not success:
+            print(f"[Alarms] 报警 {job.alarm_id} 通知分发失败: {message}")
+        return
+    tag = "[Email]" if job.channel == "email" else "[SMS]"
+    if success:
+        print(f"{tag} ✅ 报警通知已发送至: {job.label}")
+    else:
+        print(f"{tag} ❌ 发送至 {job.label} 失败: {message}")
+    # 摘要邮件包含多条报警、批量短信包含多个号码：每条报警的每个收件人各记录一次，延迟从各自报警产生时算起
+    now = _time_module.time()
+    alarms = job.payload.get("alarms") if isinstance(job.payload, dict) else None
+    for alarm in alarms or [{"alarm_id": job.alarm_id}]:
+        latency_ms = (now - alarm.get("created_at", job.created_at)) * 1000
+        for recipient in job.recipients:
+            log_notification(job.channel, recipient, success, message, alarm_id=alarm.get("alarm_id"),
+                             latency_ms=latency_ms)
+
+
+def init_notifier(settings=None):
+    """
+    按系统配置的 notification 分组创建通知分发器（app 启动时调用，未调用时首次报警按默认值创建）
+    dryRun 或环境变量 NOTIFY_DRY_RUN=1 时使用替身发送，不连接 SMTP / 短信服务
+    """
+    global notifier, email_digest, sms_batch_size
+    settings = settings or {}
+    dispatcher = NotificationDispatcher(
+        on_result=_log_delivery,
+        queue_size=int(settings.get("queueSize", 500)),
+        max_attempts=int(settings.get("maxAttempts", 4)),
+        base_delay=float(settings.get("retryBaseSeconds", 2)),
+        rate_limit=int(settings.get("rateLimit", 10)),
+        rate_window=float(settings.get("rateWindowSeconds", 600))
+    )
+    dry_run = bool(settings.get("dryRun", False)) or os.environ.get("NOTIFY_DRY_RUN") == "1"
+    if dry_run:
+        print("[Notify] 通知以 dry-run 模式运行，不会实际发送")
+    # 报警分发任务：在通知线程中查询配置和联系人后提交邮件 / 短信，不占用检测线程
+    dispatcher.register("alarm", _dispatch_alarm, workers=1, rate_limited=False)
+    dispatcher.register("email", DryRunTransport("email") if dry_run else _smtp_transport,
+                        workers=int(settings.get("emailWorkers", 2)), merge=_merge_email_payload)
+    dispatcher.register("sms", DryRunTransport("sms") if dry_run else _sms_transport,
+                        workers=int(settings.get("smsWorkers", 4)), merge=_merge_sms_payload)
+    sms_batch_size = int(settings.get("smsBatchSize", 100))
+    digest_seconds = float(settings.get("emailDigestSeconds", 0) or 0)
+    email_digest = DigestBuffer(digest_seconds, _flush_email_digest) if digest_seconds > 0 else None
+    previous, notifier = notifier, dispatcher
+    if previous is not None:
+        previous.stop()
+    return dispatcher
+
+
+def get_notifier():
+    return notifier or init_notifier()
+
+
+def _merge_email_payload(payload, newer):
+    """超出频率限制推迟中的邮件与同一收件人的新报警合并为一封汇总邮件（SMTP 配置取最新）"""
+    return {"smtp": newer["smtp"], "alarms": payload["alarms"] + newer["alarms"]}
+
 
-# 初始化数据库
-init_db()
+def _merge_sms_payload(payload, newer):
+    """推迟中的短信合并新报警：短信内容取最新一条报警，发送结果按合并的每条报警记录"""
+    return {**newer, "alarms": payload.get("alarms", []) + newer.get("alarms", [])}
 
 
 @alarms_bp.route('', methods=['GET'])
@@ -298,8 +370,8 @@ def manage_contacts():
         return jsonify({"error": str(e)}), 500
 
 
-def _send_sms_notify(cfg, location, alarm_type, phones=None, alarm_id=None):
-    """通过阿里云官方 SDK 发送报警短信"""
+def _send_sms_notify(cfg, location, alarm_type, phones=None, alarm_id=None, alarm_time=None):
+    """通过阿里云官方 SDK 发送报警短信；alarm_time 为报警产生时间（time.time()），缺省为当前时间"""
     access_key_id = cfg.get('sms_access_key_id', '')
     access_key_secret = cfg.get('sms_access_key_secret', '')
     sign_name = cfg.get('sms_sign_name', '')
@@ -322,46 +394,86 @@ def _send_sms_notify(cfg, location, alarm_type, phones=None, alarm_id=None):
         log_notification("sms", "", False, "无有效手机号", alarm_id=alarm_id)
         return
 
-    try:
-        from alibabacloud_dysmsapi20170525 import models as sms_models
+    payload = _sms_payload(cfg, location, alarm_type, alarm_id, alarm_time)
+    # 同一模板参数的多个号码合并为一次请求（SendSms 支持逗号分隔的多个号码），各批由短信发送线程并发发送
+    dispatcher = get_notifier()
+    queued = dispatcher.submit_batch("sms", list(dict.fromkeys(phones)), payload, alarm_id=alarm_id,
+                                     batch_size=sms_batch_size)
+    print(f"[SMS] 已提交 {queued}/{len(phones)} 条报警短信")
+
+
+def _sms_payload(cfg, location, alarm_type, alarm_id=None, alarm_time=None):
+    """短信发送参数：AccessKey、签名、模板和模板参数，alarms 用于按报警记录送达延迟"""
+    alarm_time = alarm_time or _time_module.time()
+    timestamp = _time_module.strftime('%Y-%m-%d %H:%M', _time_module.localtime(alarm_time))
+    code_value = f"{timestamp} {location}检测到{alarm_type}"
+    return {
+        "access_key_id": cfg.get('sms_access_key_id', ''),
+        "access_key_secret": cfg.get('sms_access_key_secret', ''),
+        "sign_name": cfg.get('sms_sign_name', ''),
+        "template_code": cfg.get('sms_template_code', ''),
+        "template_param": json.dumps({"code": code_value}, ensure_ascii=False, separators=(',', ':')),
+        # 送达延迟从报警产生时算起，包含报警写入和分发任务排队的时间
+        "alarms": [{"alarm_id": alarm_id, "created_at": alarm_time}]
+    }
+
+
+# 服务商限流类错误码，稍后重试可能成功；号码类错误码说明批量中个别号码无效，拆成单个号码重发；
+# 其余非 OK 错误码（签名/模板错误等）不重试
+_SMS_RETRYABLE_CODES = ("isv.BUSINESS_LIMIT_CONTROL", "Throttling", "isp.SYSTEM_ERROR")
+_SMS_NUMBER_CODES = ("isv.MOBILE_NUMBER_ILLEGAL", "isv.MOBILE_COUNT_OVER_LIMIT", "isv.BLACK_KEY_CONTROL_LIMIT")
+# AccessKey -> SmsClient；客户端内部复用 HTTP 连接，不必每条报警重建
+_sms_clients = {}
+_sms_clients_lock = threading.Lock()
+
+
+def _get_sms_client(access_key_id, access_key_secret):
+    key = (access_key_id, access_key_secret)
+    client = _sms_clients.get(key)
+    if client is None:
         from alibabacloud_dysmsapi20170525.client import Client as SmsClient
         from alibabacloud_tea_openapi import models as open_api_models
-    except ImportError:
-        print("[SMS] 请先安装 SDK: pip install alibabacloud_dysmsapi20170525")
-        log_notification("sms", "", False, "缺少阿里云 SMS SDK", alarm_id=alarm_id)
-        return
+        with _sms_clients_lock:
+            client = _sms_clients.get(key)
+            if client is None:
+                if len(_sms_clients) >= 4:
+                    # 更换 AccessKey 后旧客户端不再使用
+                    _sms_clients.clear()
+                config = open_api_models.Config(
+                    access_key_id=access_key_id,
+                    access_key_secret=access_key_secret,
+                    endpoint='dysmsapi.aliyuncs.com'
+                )
+                client = _sms_clients[key] = SmsClient(config)
+    return client
 
-    timestamp = _time_module.strftime('%Y-%m-%d %H:%M', _time_module.localtime())
-    code_value = f"{timestamp} {location}检测到{alarm_type}"
-    template_param = json.dumps({"code": code_value}, ensure_ascii=False, separators=(',', ':'))
 
-    config = open_api_models.Config(
-        access_key_id=access_key_id,
-        access_key_secret=access_key_secret,
-        endpoint='dysmsapi.aliyuncs.com'
+def _sms_transport(phones, payload):
+    """通知分发器的短信发送实现：一次请求发送给一批号码（phones 为号码元组或单个号码）"""
+    try:
+        from alibabacloud_dysmsapi20170525 import models as sms_models
+        client = _get_sms_client(payload["access_key_id"], payload["access_key_secret"])
+    except ImportError:
+        raise PermanentError("缺少阿里云 SMS SDK，请先安装: pip install alibabacloud_dysmsapi20170525")
+
+    phones = phones if isinstance(phones, tuple) else (phones,)
+    send_req = sms_models.SendSmsRequest(
+        phone_numbers=",".join(phones),
+        sign_name=payload["sign_name"],
+        template_code=payload["template_code"],
+        template_param=payload["template_param"]
     )
-    client = SmsClient(config)
-
-    for phone in phones:
-        try:
-            send_req = sms_models.SendSmsRequest(
-                phone_numbers=phone,
-                sign_name=sign_name,
-                template_code=template_code,
-                template_param=template_param
-            )
-            resp = client.send_sms(send_req)
-            code = resp.body.code if resp.body else 'UNKNOWN'
-            message = resp.body.message if resp.body else ''
-            if code == 'OK':
-                print(f"[SMS] ✅ 短信已发送至: {phone}")
-                log_notification("sms", phone, True, "发送成功", alarm_id=alarm_id)
-            else:
-                print(f"[SMS] ❌ 发送失败 {phone}: Code={code} Message={message}")
-                log_notification("sms", phone, False, f"Code={code} Message={message}", alarm_id=alarm_id)
-        except Exception as e:
-            print(f"[SMS] ❌ 发送异常 {phone}: {e}")
-            log_notification("sms", phone, False, str(e), alarm_id=alarm_id)
+    resp = client.send_sms(send_req)
+    code = resp.body.code if resp.body else 'UNKNOWN'
+    message = resp.body.message if resp.body else ''
+    if code == 'OK':
+        return "发送成功"
+    detail = f"Code={code} Message={message}"
+    if code.startswith(_SMS_RETRYABLE_CODES):
+        raise ConnectionError(detail)
+    if code.startswith(_SMS_NUMBER_CODES) and len(phones) > 1:
+        raise SplitBatch(detail)
+    raise PermanentError(detail)
 
 
 @alarms_bp.route('/sms/test', methods=['POST'])
@@ -397,15 +509,31 @@ def test_sms():
         'sms_sign_name': sign_name,
         'sms_template_code': template_code,
     }
-    try:
-        _send_sms_notify(test_cfg, "测试位置", "测试短信", phones=phones)
-        return jsonify({"success": True, "message": f"✅ 测试短信已发送至 {phones}"})
-    except Exception as e:
-        return jsonify({"success": False, "message": f"❌ 发送失败: {str(e)}"})
-
-
-def _send_email_notify(cfg, location, alarm_type, alarm_id=None):
-    """通过 SMTP 向所有有邮箱的联系人发送报警邮件"""
+    # 测试短信同步发送，不经过通知队列和频率限制，签名 / 模板等错误直接返回给设置页
+    payload = _sms_payload(test_cfg, "测试位置", "测试短信")
+    phones = list(dict.fromkeys(phones))
+    errors = []
+    for start in range(0, len(phones), max(1, sms_batch_size)):
+        batch = tuple(phones[start:start + max(1, sms_batch_size)])
+        try:
+            message = _sms_transport(batch, payload)
+            success = True
+        except Exception as e:
+            message = str(e)
+            success = False
+            errors.append(message)
+        for phone in batch:
+            log_notification("sms", phone, success, message)
+    if errors:
+        return jsonify({"success": False, "message": f"❌ 发送失败: {errors[0]}"})
+    return jsonify({"success": True, "message": f"✅ 测试短信已发送至 {phones}"})
+
+
+def _send_email_notify(cfg, location, alarm_type, alarm_id=None, recipients=None, alarm_time=None):
+    """
+    通过 SMTP 向所有有邮箱的联系人发送报警邮件（开启摘要模式时参与合并）
+    recipients 为空时查询 contacts 集合；alarm_time 为报警产生时间（time.time()），缺省为当前时间
+    """
     smtp_host = cfg.get('smtp_host', '')
     smtp_port = int(cfg.get('smtp_port', 465))
     smtp_user = cfg.get('smtp_user', '')
@@ -416,12 +544,13 @@ def _send_email_notify(cfg, location, alarm_type, alarm_id=None):
         log_notification("email", "", False, "SMTP 未配置", alarm_id=alarm_id)
         return
 
-    # 直接从 contacts 集合读，避免与 alarm_config 不同步
-    if db is not None:
-        all_contacts = list(db.contacts.find({}, {"_id": 0}))
-    else:
-        all_contacts = cfg.get('contacts', [])
-    recipients = [c['email'] for c in all_contacts if c.get('email', '').strip()]
+    if recipients is None:
+        # 直接从 contacts 集合读，避免与 alarm_config 不同步
+        if db is not None:
+            all_contacts = list(db.contacts.find({}, {"_id": 0}))
+        else:
+            all_contacts = cfg.get('contacts', [])
+        recipients = [c['email'] for c in all_contacts if c.get('email', '').strip()]
 
     if not recipients:
         print("[Email] 无有效收件人邮箱，跳过发送（请先添加含有邮箱的联系人）")
@@ -430,41 +559,118 @@ def _send_email_notify(cfg, location, alarm_type, alarm_id=None):
 
     print(f"[Email] 准备发送至: {recipients}, SMTP: {smtp_host}:{smtp_port}, 用户: {smtp_user}")
 
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    subject = f"⚠️ 跌倒报警通知 - {timestamp}"
+    smtp = {"host": smtp_host, "port": smtp_port, "user": smtp_user, "password": smtp_password}
+    alarm = _email_alarm(location, alarm_type, alarm_id, alarm_time)
+    buffer = email_digest
+    if buffer is not None:
+        for recipient in recipients:
+            buffer.add(recipient, (smtp, alarm))
+        return
+    dispatcher = get_notifier()
+    payload = {"smtp": smtp, "alarms": [alarm]}
+    queued = sum(1 for recipient in recipients if dispatcher.submit("email", recipient, payload, alarm_id=alarm_id))
+    print(f"[Email] 已提交 {queued}/{len(recipients)} 封报警邮件")
+
+
+def _email_alarm(location, alarm_type, alarm_id=None, alarm_time=None):
+    """邮件正文中的一条报警；alarm_time 缺省为当前时间"""
+    alarm_time = alarm_time or _time_module.time()
+    return {
+        "created_at": alarm_time,
+        "time": datetime.fromtimestamp(alarm_time).strftime('%Y-%m-%d %H:%M:%S'),
+        "location": location,
+        "type": alarm_type,
+        "alarm_id": alarm_id
+    }
+
+
+def _flush_email_digest(recipient, items):
+    """摘要窗口结束：同一收件人的多条报警合并为一封邮件（SMTP 配置取最新一条）"""
+    alarms = [alarm for _, alarm in items]
+    get_notifier().submit("email", recipient, {"smtp": items[-1][0], "alarms": alarms},
+                          alarm_id=alarms[0]["alarm_id"])
+
+
+def _render_alarm_email(alarms):
+    """返回 (主题, HTML 正文)；多条报警时按时间列出"""
+    if len(alarms) == 1:
+        alarm = alarms[0]
+        subject = f"⚠️ 跌倒报警通知 - {alarm['time']}"
+        body = (
+            f"<h2 style='color:red'>⚠️ 跌倒事件报警</h2>"
+            f"<p><b>时间：</b>{alarm['time']}</p>"
+            f"<p><b>位置：</b>{alarm['location']}</p>"
+            f"<p><b>类型：</b>{alarm['type']}</p>"
+            f"<p>请及时处理。</p>"
+        )
+        return subject, body
+    rows = "".join(
+        f"<tr><td>{alarm['time']}</td><td>{alarm['location']}</td><td>{alarm['type']}</td></tr>" for alarm in alarms)
+    subject = f"⚠️ 跌倒报警汇总（{len(alarms)} 条）- {alarms[-1]['time']}"
     body = (
-        f"<h2 style='color:red'>⚠️ 跌倒事件报警</h2>"
-        f"<p><b>时间：</b>{timestamp}</p>"
-        f"<p><b>位置：</b>{location}</p>"
-        f"<p><b>类型：</b>{alarm_type}</p>"
+        f"<h2 style='color:red'>⚠️ 跌倒事件报警汇总</h2>"
+        f"<p>{alarms[0]['time']} 至 {alarms[-1]['time']} 共 {len(alarms)} 条报警：</p>"
+        f"<table border='1' cellpadding='4' cellspacing='0'>"
+        f"<tr><th>时间</th><th>位置</th><th>类型</th></tr>{rows}</table>"
         f"<p>请及时处理。</p>"
     )
+    return subject, body
 
-    try:
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = smtp_user
-        msg['To'] = ', '.join(recipients)
-        msg.attach(MIMEText(body, 'html', 'utf-8'))
-
-        ctx = ssl.create_default_context()
-        if smtp_port == 465:
-            with smtplib.SMTP_SSL(smtp_host, smtp_port, context=ctx, timeout=10) as server:
-                server.login(smtp_user, smtp_password)
-                server.sendmail(smtp_user, recipients, msg.as_string())
-        else:
-            with smtplib.SMTP(smtp_host, smtp_port, timeout=10) as server:
-                server.starttls(context=ctx)
-                server.login(smtp_user, smtp_password)
-                server.sendmail(smtp_user, recipients, msg.as_string())
 
-        print(f"[Email] ✅ 报警邮件已发送至: {recipients}")
-        for recipient in recipients:
-            log_notification("email", recipient, True, "发送成功", alarm_id=alarm_id)
-    except Exception as e:
-        print(f"[Email] ❌ 邮件发送失败: {e}")
-        for recipient in recipients:
-            log_notification("email", recipient, False, str(e), alarm_id=alarm_id)
+def _smtp_transport(recipient, payload):
+    """通知分发器的邮件发送实现：通过连接池中的长连接向单个收件人发送一封邮件"""
+    smtp = payload["smtp"]
+    subject, body = _render_alarm_email(payload["alarms"])
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = smtp["user"]
+    msg['To'] = recipient
+    msg.attach(MIMEText(body, 'html', 'utf-8'))
+
+    for attempt in range(2):
+        try:
+            with smtp_pool.session(smtp["host"], smtp["port"], smtp["user"], smtp["password"],
+                                   fresh=attempt > 0) as server:
+                server.sendmail(smtp["user"], [recipient], msg.as_string())
+            return "发送成功"
+        except smtplib.SMTPServerDisconnected:
+            # 复用的连接已被服务器断开（未到 NOOP 探活间隔），换新连接立即再试一次
+            if attempt:
+                raise
+        except (smtplib.SMTPAuthenticationError, smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused) as e:
+            # 授权码错误、地址被拒收：重试不会成功
+            raise PermanentError(str(e))
+
+
+@alarms_bp.route('/notify/stats', methods=['GET'])
+def notify_stats():
+    """通知分发器状态：各渠道已发送 / 失败 / 重试 / 限流 / 排队数量"""
+    return jsonify({
+        **get_notifier().stats(),
+        "smtp": smtp_pool.stats(),
+        "digest_merged": email_digest.merged if email_digest else 0
+    })
+
+
+@alarms_bp.route('/notify/latency', methods=['GET'])
+def notify_latency():
+    """最近 days 天（默认 7）成功通知的报警到送达耗时分位数（毫秒），按渠道统计，最多取最近 10000 条"""
+    if db is None:
+        return jsonify({"error": "数据库未连接"}), 500
+    days = request.args.get('days', 7, type=float)
+    docs = db.notification_logs.find(
+        {"success": True, "latency_ms": {"$ne": None}, "created_at": {"$gte": datetime.now() - timedelta(days=days)}},
+        {"_id": 0, "channel": 1, "latency_ms": 1}
+    ).sort("created_at", -1).limit(10000)
+    by_channel = {}
+    for doc in docs:
+        by_channel.setdefault(doc.get("channel", ""), []).append(doc["latency_ms"])
+    result = {}
+    for channel, values in by_channel.items():
+        values.sort()
+        result[channel] = {"count": len(values),
+                           **{f"p{p}": values[min(len(values) - 1, len(values) * p // 100)] for p in (50, 95, 99)}}
+    return jsonify(result)
 
 
 @alarms_bp.route('/email/test', methods=['POST'])
@@ -497,29 +703,58 @@ def test_email():
     if not recipients:
         return jsonify({"success": False, "message": "无有效收件人，请先添加含邮箱的联系人"})
 
-    test_cfg = {
-        'smtp_host': smtp_host,
-        'smtp_port': smtp_port,
-        'smtp_user': smtp_user,
-        'smtp_password': smtp_password
+    # 测试邮件同步发送，不经过通知队列、摘要合并和频率限制，授权码错误等直接返回给设置页
+    payload = {
+        "smtp": {"host": smtp_host, "port": smtp_port, "user": smtp_user, "password": smtp_password},
+        "alarms": [_email_alarm("测试位置", "测试邮件")]
     }
-    try:
-        _send_email_notify(test_cfg, "测试位置", "测试邮件")
-        return jsonify({"success": True, "message": f"✅ 测试邮件已发送至 {recipients}"})
-    except Exception as e:
-        return jsonify({"success": False, "message": f"❌ 发送失败: {str(e)}"})
+    errors = []
+    for recipient in recipients:
+        try:
+            message = _smtp_transport(recipient, payload)
+            success = True
+        except Exception as e:
+            message = str(e)
+            success = False
+            errors.append(message)
+        log_notification("email", recipient, success, message)
+    if errors:
+        return jsonify({"success": False, "message": f"❌ 发送失败: {errors[0]}"})
+    return jsonify({"success": True, "message": f"✅ 测试邮件已发送至 {recipients}"})
+
+
+def _dispatch_alarm(location, alarm):
+    """
+    通知分发器 alarm 渠道的实现：读取报警配置和联系人，按配置提交邮件 / 短信
+    数据库暂不可用时抛出异常，由分发器按退避间隔重试
+    """
+    if db is None:
+        raise ConnectionError("数据库未连接，无法读取报警配置")
+    cfg = db.alarm_config.find_one({"key": "main_config"}) or {}
+    if not cfg.get('email', False) and not cfg.get('sms', False):
+        return "未启用邮件 / 短信通知"
+    contacts = list(db.contacts.find({}, {"_id": 0}))
+    # 以下只提交到各渠道队列，不再访问数据库，重试本任务不会重复发送
+    if cfg.get('email', False):
+        emails = [c['email'] for c in contacts if c.get('email', '').strip()]
+        _send_email_notify(cfg, location, alarm["type"], alarm["alarm_id"], recipients=emails,
+                           alarm_time=alarm["created_at"])
+    if cfg.get('sms', False):
+        phones = [c['phone'] for c in contacts if c.get('phone', '').strip()]
+        _send_sms_notify(cfg, location, alarm["type"], phones, alarm["alarm_id"], alarm_time=alarm["created_at"])
+    return "已提交"
 
 
 def save_alarm_record(location="未知", alarm_type="跌倒"):
-    """由检测模块调用，将跌倒事件写入报警集合，并按配置发送邮件"""
-    if db is None:
-        return
+    """由检测模块调用，将跌倒事件写入报警集合，并提交通知分发任务（配置和联系人在通知线程中查询）"""
     try:
         import time as _time
-        alarm_id = int(_time.time() * 1000) % 2147483647
-        db.alarms.insert_one({
+        created_at = _time.time()
+        alarm_id = int(created_at * 1000) % 2147483647
+        # 数据库不可用时报警记录暂存本地 spool，恢复后重放
+        spooled_write(db, "alarms", "insert_one", {
             "id": alarm_id,
-            "timestamp": datetime.now(),
+            "timestamp": datetime.fromtimestamp(created_at),
             "location": location,
             "type": alarm_type,
             "status": "待处理"
@@ -531,13 +766,7 @@ def save_alarm_record(location="未知", alarm_type="跌倒"):
             target_type="alarm",
             target_id=alarm_id
         )
-
-        # 读取配置，按需触发邮件/短信
-        cfg = db.alarm_config.find_one({"key": "main_config"}) or {}
-        import threading
-        if cfg.get('email', False):
-            threading.Thread(target=_send_email_notify, args=(cfg, location, alarm_type, alarm_id), daemon=True).start()
-        if cfg.get('sms', False):
-            threading.Thread(target=_send_sms_notify, args=(cfg, location, alarm_type, None, alarm_id), daemon=True).start()
+        get_notifier().submit("alarm", location, {"location": location, "type": alarm_type, "alarm_id": alarm_id,
+                                                  "created_at": created_at}, alarm_id=alarm_id)
     except Exception as e:
         print(f"[Alarms] 写入报警记录失败: {e}")
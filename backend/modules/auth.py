@@ -2,6 +2,8 @@ import pymongo
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
 import datetime
 import os
+from modules.db import get_db, mongo
+from modules.spool import spooled_write
 
 # 密钥，用于签名，生产环境应放在环境变量中
 SECRET_KEY = "your_secret_key_here_change_this"
@@ -46,10 +48,8 @@ def has_role(request, *roles):
 
 
 def _log_auth_audit(db, action, username, status="success", details=""):
-    if db is None:
-        return
     try:
-        db.audit_logs.insert_one({
+        spooled_write(db, "audit_logs", "insert_one", {
             "username": username or "anonymous",
             "action": action,
             "status": status,
@@ -79,16 +79,16 @@ class AuthModule:
 
     def _init_db(self):
         try:
-            # 连接 MongoDB
-            self.client = pymongo.MongoClient(self.mongo_uri, serverSelectionTimeoutMS=2000)
-            self.db = self.client[self.db_name]
+            # 共享 modules.db 的连接池；可用状态变化时重新调用
+            mongo.subscribe(self._init_db)
+            self.db = get_db()
+            if self.db is None:
+                raise ConnectionError(mongo.last_error)
+            self.client = mongo.client
             self.users_collection = self.db["users"]
             
             # 创建唯一索引以确保用户名唯一
             self.users_collection.create_index("username", unique=True)
-            
-            # 测试连接
-            self.client.server_info()
             print("[Auth] ✅ MongoDB 用户数据库连接成功")
         except Exception as e:
             print(f"[Auth] ❌ MongoDB 连接失败: {e}")
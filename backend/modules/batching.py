@@ -0,0 +1,186 @@
+"""
+微批推理调度模块
+把多路视频流的帧收集成小批次统一送入模型：
+批次达到上限或最早一帧等待超过截止时间即派发，结果按请求路由回各自的视频流
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+
+
+class BatchRequest:
+    """单帧推理请求（类似 Future）"""
+
+    def __init__(self, frame, conf, iou, source=None):
+        self.frame = frame
+        self.conf = conf
+        self.iou = iou
+        self.source = source
+        self.enqueued_at = time.time()
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def set_result(self, result):
+        self.result = result
+        self._done.set()
+
+    def set_error(self, error):
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError("推理请求超时")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class BatchedModel:
+    """与 YOLO 模型调用方式兼容的适配器，调用时提交到调度器并等待结果"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    @property
+    def names(self):
+        self.scheduler.check_ready()
+        return self.scheduler.model.names
+
+    def __call__(self, frame, conf=0.25, iou=0.45, verbose=False, source=None):
+        return [self.scheduler.infer(frame, conf, iou, source=source)]
+
+
+class BatchScheduler:
+    """
+    截止时间驱动的微批调度器
+    - max_batch: 单批最大帧数
+    - deadline_ms: 批次中第一帧允许等待的最长时间
+    模型加载失败时调度线程退出并记录 load_error，之后的请求立即失败；下一次 as_model() 重新尝试加载
+    """
+
+    def __init__(self, model_factory, max_batch=4, deadline_ms=15, latency_window=500):
+        self.model_factory = model_factory
+        self.max_batch = max(1, int(max_batch))
+        self.deadline = max(0.0, float(deadline_ms)) / 1000.0
+        self.model = None
+        self.requests = queue.Queue()
+        self.stop_event = threading.Event()
+        self.ready_event = threading.Event()
+        self.load_error = None
+        self.thread = None
+        self.batches = 0
+        self.frames = 0
+        self._latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.thread is None or (self.load_error is not None and not self.thread.is_alive()):
+            self.load_error = None
+            self.ready_event.clear()
+            self.thread = threading.Thread(target=self._dispatch_loop, name="batch-scheduler", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(2.0)
+            self.thread = None
+
+    def as_model(self):
+        """返回可直接替代 YOLO 模型实例的适配器"""
+        self.start()
+        self.ready_event.wait()
+        self.check_ready()
+        return BatchedModel(self)
+
+    def check_ready(self):
+        """模型加载失败时抛出，调用方不必等到请求超时"""
+        error = self.load_error
+        if error is not None:
+            raise RuntimeError(f"批量推理模型加载失败: {error}")
+
+    def submit(self, frame, conf, iou, source=None):
+        self.check_ready()
+        request = BatchRequest(frame, conf, iou, source)
+        self.requests.put(request)
+        return request
+
+    def infer(self, frame, conf, iou, source=None, timeout=30.0):
+        return self.submit(frame, conf, iou, source).wait(timeout)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0
+        return {
+            "max_batch": self.max_batch,
+            "deadline_ms": round(self.deadline * 1000, 1),
+            "batches": self.batches,
+            "frames": self.frames,
+            "avg_batch": round(self.frames / self.batches, 2) if self.batches else 0,
+            "p95_ms": round(p95 * 1000, 1)
+        }
+
+    # ---------- 调度线程 ----------
+    def _collect(self):
+        try:
+            first = self.requests.get(timeout=0.2)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first.enqueued_at + self.deadline
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            try:
+                batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch_loop(self):
+        try:
+            self.model = self.model_factory()
+        except Exception as e:
+            print(f"[Batch] 模型加载失败: {e}")
+            self.load_error = e
+            # 加载期间已提交的请求直接失败
+            while True:
+                try:
+                    self.requests.get_nowait().set_error(RuntimeError(f"批量推理模型加载失败: {e}"))
+                except queue.Empty:
+                    break
+            return
+        finally:
+            self.ready_event.set()
+        while not self.stop_event.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            # conf/iou 不同的请求不能共用一次调用
+            groups = {}
+            for request in batch:
+                groups.setdefault((request.conf, request.iou), []).append(request)
+            for (conf, iou), requests in groups.items():
+                self._run_group(requests, conf, iou)
+
+    def _run_group(self, requests, conf, iou):
+        try:
+            results = self.model([r.frame for r in requests], conf=conf, iou=iou, verbose=False)
+        except Exception as e:
+            print(f"[Batch] 批量推理异常: {e}")
+            for request in requests:
+                request.set_error(e)
+            return
+        finished = time.time()
+        with self._lock:
+            self.batches += 1
+            self.frames += len(requests)
+            for request in requests:
+                self._latencies.append(finished - request.enqueued_at)
+        for request, result in zip(requests, results):
+            request.set_result(result)
@@ -0,0 +1,161 @@
+"""
+视频广播模块
+每个视频源只运行一条检测流水线，将标注后的 JPEG 帧分发给任意数量的观看者；
+慢速观看者只会跳帧，不会拖慢生产者；最后一个观看者断开后生产者自动停止；
+观看者断开后很快重连时，新的生产者先等旧生产者释放视频源并执行完 on_stop 再启动
+"""
+
+import threading
+
+
+class Subscription:
+    """单个观看者的订阅句柄，只取最新帧，跳过来不及消费的中间帧"""
+
+    def __init__(self, broadcaster, on_close):
+        self.broadcaster = broadcaster
+        self.last_seq = 0
+        self.closed = False
+        self._on_close = on_close
+
+    def next(self, timeout=1.0):
+        """等待比上次更新的一帧，超时或生产者结束时返回 None"""
+        seq, frame = self.broadcaster.wait_frame(self.last_seq, timeout)
+        if frame is None:
+            return None
+        self.last_seq = seq
+        return frame
+
+    @property
+    def finished(self):
+        return self.broadcaster.finished
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._on_close(self)
+
+
+class FrameBroadcaster:
+    """单个视频源的共享生产者；previous 为同一视频源上一个已停止订阅的广播器，新生产者启动前等待它的生产者退出"""
+
+    JOIN_TIMEOUT = 10.0
+
+    def __init__(self, key, pipeline_factory, on_stop=None, previous=None):
+        self.key = key
+        self.pipeline_factory = pipeline_factory
+        self.on_stop = on_stop
+        self.subscribers = 0
+        self.finished = False
+        self.pipeline = None
+        self._seq = 0
+        self._latest = None
+        self._cond = threading.Condition()
+        self._run_stop = None
+        self._thread = previous._thread if previous is not None else None
+
+    def add_subscriber(self):
+        with self._cond:
+            self.subscribers += 1
+            if self._run_stop is None:
+                self.finished = False
+                self._run_stop = threading.Event()
+                thread = threading.Thread(target=self._produce, args=(self._run_stop, self._thread),
+                                          name=f"broadcast-{self.key}", daemon=True)
+                self._thread = thread
+                thread.start()
+
+    def remove_subscriber(self):
+        """返回剩余订阅者数量，归零时通知生产者退出"""
+        with self._cond:
+            self.subscribers = max(0, self.subscribers - 1)
+            if self.subscribers == 0 and self._run_stop is not None:
+                self._run_stop.set()
+                self._run_stop = None
+            return self.subscribers
+
+    def wait_frame(self, last_seq, timeout=1.0):
+        with self._cond:
+            if self._seq <= last_seq and not self.finished:
+                self._cond.wait(timeout)
+            if self._seq <= last_seq:
+                return last_seq, None
+            return self._seq, self._latest
+
+    def stats(self):
+        pipeline = self.pipeline
+        return {
+            "source": str(self.key),
+            "subscribers": self.subscribers,
+            "stages": pipeline.stats() if pipeline else []
+        }
+
+    def _publish(self, frame_bytes):
+        with self._cond:
+            self._seq += 1
+            self._latest = frame_bytes
+            self._cond.notify_all()
+
+    def _produce(self, run_stop, previous):
+        pipeline = None
+        if previous is not None and previous.is_alive():
+            # 旧生产者仍在停止中：等它关闭视频源并执行 on_stop，避免两条流水线同时打开摄像头、旧的 on_stop 清掉新流的状态
+            previous.join(self.JOIN_TIMEOUT)
+            if previous.is_alive():
+                print(f"[Broadcast] 视频源 {self.key} 旧生产者 {self.JOIN_TIMEOUT:.0f}s 内未退出，继续启动")
+        try:
+            if run_stop.is_set():
+                return
+            pipeline = self.pipeline_factory().start()
+            self.pipeline = pipeline
+            print(f"[Broadcast] 视频源 {self.key} 生产者已启动")
+            while not run_stop.is_set() and pipeline.is_alive():
+                frame_bytes = pipeline.next_jpeg(timeout=0.5)
+                if frame_bytes is not None and not run_stop.is_set():
+                    self._publish(frame_bytes)
+        except Exception as e:
+            print(f"[Broadcast] 视频源 {self.key} 生产者异常: {e}")
+        finally:
+            if pipeline is not None:
+                pipeline.stop()
+            with self._cond:
+                if self.pipeline is pipeline:
+                    self.pipeline = None
+                # 视频源自然结束（非订阅者归零）时，唤醒等待中的观看者
+                if not run_stop.is_set():
+                    self.finished = True
+                    self._run_stop = None
+                self._cond.notify_all()
+            print(f"[Broadcast] 视频源 {self.key} 生产者已停止")
+            if self.on_stop:
+                self.on_stop(self.key)
+
+
+class BroadcastHub:
+    """按视频源索引的广播器注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._broadcasters = {}
+        self._retired = {}  # 视频源 -> 订阅者归零后移除的广播器，其生产者可能仍在停止中
+
+    def subscribe(self, key, pipeline_factory, on_stop=None):
+        with self._lock:
+            broadcaster = self._broadcasters.get(key)
+            if broadcaster is None:
+                broadcaster = FrameBroadcaster(key, pipeline_factory, on_stop=on_stop,
+                                               previous=self._retired.pop(key, None))
+                self._broadcasters[key] = broadcaster
+            broadcaster.add_subscriber()
+            return Subscription(broadcaster, self._unsubscribe)
+
+    def _unsubscribe(self, subscription):
+        broadcaster = subscription.broadcaster
+        with self._lock:
+            if broadcaster.remove_subscriber() == 0 and self._broadcasters.get(broadcaster.key) is broadcaster:
+                del self._broadcasters[broadcaster.key]
+                self._retired[broadcaster.key] = broadcaster
+
+    def stats(self):
+        with self._lock:
+            broadcasters = list(self._broadcasters.values())
+        return [b.stats() for b in broadcasters]
@@ -0,0 +1,225 @@
+"""
+MongoDB 连接管理
+进程内所有模块共享一个 MongoClient（一个连接池），首次使用时才建立连接；
+熔断：探活或操作失败后在 reset_timeout 内直接判定数据库不可用，接口快速失败而不是各自等待 serverSelectionTimeout，
+冷却结束后放行一次探活；驱动的心跳监控发现服务恢复时立即闭合
+
+连接参数来自环境变量：MONGO_URI、MONGO_DB、MONGO_MAX_POOL_SIZE、MONGO_MIN_POOL_SIZE、MONGO_TIMEOUT_MS
+
+各模块的用法：
+    db = get_db()              # 不可用时返回 None
+    mongo.on_connect(init_db)  # 导入时只登记；app 启动调用 mongo.connect() 后执行，之后可用状态变化时再次回调
+"""
+
+import os
+import threading
+import time
+
+import pymongo
+from pymongo import monitoring
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/")
+DB_NAME = os.environ.get("MONGO_DB", "fall_detection_db")
+
+
+class CircuitBreaker:
+    """
+    - failure_threshold: 连续失败次数达到后断开
+    - reset_timeout: 断开后的冷却时间（秒），之后允许一次探活（半开）
+    """
+
+    def __init__(self, failure_threshold=1, reset_timeout=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """闭合，或断开已超过冷却时间（放行一次探活，并重新计时）"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.reset_timeout:
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def record_success(self):
+        """返回 True 表示由断开恢复为闭合"""
+        with self._lock:
+            recovered = self.opened_at is not None
+            self.failures = 0
+            self.opened_at = None
+            return recovered
+
+    def record_failure(self):
+        """返回 True 表示本次失败使熔断器断开"""
+        with self._lock:
+            self.failures += 1
+            if self.opened_at is None and self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+                return True
+            return False
+
+
+class _HeartbeatListener(monitoring.ServerHeartbeatListener):
+    """驱动后台监控线程的心跳结果同步到熔断器"""
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.manager.record_success()
+
+    def failed(self, event):
+        self.manager.record_failure(event.reply)
+
+
+class MongoManager:
+    """
+    - max_pool_size / min_pool_size: 共享连接池大小
+    - timeout_ms: 服务器选择超时（毫秒），探活与普通操作共用
+    - health_interval: 距上次成功不超过该秒数时 get_db 不再探活
+    - probe_timeout: 熔断冷却后半开探活的超时（秒），比正常超时短，探活失败也只让一个请求短暂等待
+    """
+
+    def __init__(self, uri=MONGO_URI, db_name=DB_NAME, max_pool_size=None, min_pool_size=None, timeout_ms=None,
+                 health_interval=5.0, probe_timeout=0.5, breaker=None):
+        self.uri = uri
+        self.db_name = db_name
+        self.max_pool_size = int(max_pool_size or os.environ.get("MONGO_MAX_POOL_SIZE", 50))
+        self.min_pool_size = int(min_pool_size or os.environ.get("MONGO_MIN_POOL_SIZE", 0))
+        self.timeout_ms = int(timeout_ms or os.environ.get("MONGO_TIMEOUT_MS", 2000))
+        self.health_interval = health_interval
+        self.probe_timeout = probe_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.last_ok = 0.0
+        self.last_error = None
+        self._client = None
+        self._subscribers = []
+        self.connected = False  # connect() 是否已调用
+        self._connecting = False
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """共享客户端（connect=False：创建时不连接，首次操作时才建立连接）"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = pymongo.MongoClient(
+                        self.uri,
+                        maxPoolSize=self.max_pool_size,
+                        minPoolSize=self.min_pool_size,
+                        serverSelectionTimeoutMS=self.timeout_ms,
+                        connect=False,
+                        event_listeners=[_HeartbeatListener(self)])
+        return self._client
+
+    @property
+    def available(self):
+        return not self.breaker.is_open
+
+    def get_db(self):
+        """返回共享的 Database；熔断中或探活失败返回 None"""
+        if not self.breaker.allow():
+            return None
+        if time.time() - self.last_ok < self.health_interval:
+            return self.client[self.db_name]
+        try:
+            if self.breaker.is_open:
+                with pymongo.timeout(self.probe_timeout):
+                    self.client.admin.command("ping")
+            else:
+                self.client.admin.command("ping")
+        except Exception as e:
+            self.record_failure(e)
+            return None
+        self.record_success()
+        return self.client[self.db_name]
+
+    def record_success(self):
+        self.last_ok = time.time()
+        if self.breaker.record_success():
+            print("[DB] ✅ MongoDB 已恢复")
+            self._notify()
+
+    def record_failure(self, error=None):
+        """操作或探活失败（ConnectionFailure 等）时调用"""
+        self.last_ok = 0.0
+        self.last_error = str(error) if error is not None else None
+        if self.breaker.record_failure():
+            print(f"[DB] ❌ MongoDB 不可用，{self.breaker.reset_timeout:.0f} 秒内请求直接失败: {error}")
+            self._notify()
+
+    def subscribe(self, callback):
+        """可用状态变化时调用 callback()（同一回调只登记一次）"""
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """取消 subscribe 登记的回调（持有回调的对象销毁前调用，否则会一直被引用并收到状态变化）"""
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def on_connect(self, callback):
+        """
+        模块级 init_db 的登记方式：导入模块时不连接数据库，connect() 时统一执行；
+        connect() 之后才导入的模块立即执行。之后与 subscribe 相同，可用状态变化时回调
+        """
+        self.subscribe(callback)
+        if self.connected:
+            callback()
+
+    def connect(self):
+        """启动时调用一次：探活后依次执行已登记的回调，返回数据库是否可用"""
+        self.connected = True
+        self._connecting = True
+        try:
+            available = self.get_db() is not None
+        finally:
+            self._connecting = False
+        for callback in list(self._subscribers):
+            try:
+                callback()
+            except Exception as e:
+                print(f"[DB] 连接状态回调失败: {e}")
+        return available
+
+    def _notify(self):
+        if self._connecting:
+            # connect() 随后会同步执行全部回调
+            return
+        # 心跳监听器运行在驱动的监控线程中，回调放到独立线程执行，避免在监控线程内发起数据库操作
+        def run():
+            for callback in list(self._subscribers):
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"[DB] 连接状态回调失败: {e}")
+        threading.Thread(target=run, name="mongo-state", daemon=True).start()
+
+    def stats(self):
+        return {
+            "available": self.available,
+            "failures": self.breaker.failures,
+            "last_error": self.last_error,
+            "max_pool_size": self.max_pool_size
+        }
+
+
+mongo = MongoManager()
+
+
+def get_db():
+    return mongo.get_db()
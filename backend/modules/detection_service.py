@@ -0,0 +1,425 @@
+"""
+多路摄像头检测服务
+根据 devices 集合为每个启用的设备启动采集线程，推理线程在所有摄像头之间共享，
+每路摄像头维护独立的检测状态、报警位置和证据缓冲
+"""
+
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import cv2
+from flask import Blueprint, Response, jsonify, request
+
+from modules.auth import has_role
+from modules.pipeline import DropOldestQueue, StageStats
+from modules.db import get_db, mongo
+from modules.spool import spooled_write
+from modules.tracking import detect_adaptive
+
+cameras_bp = Blueprint('cameras', __name__, url_prefix='/api/cameras')
+
+# MongoDB 连接
+mongo_client = None
+db = None
+
+# 由 app.py 通过 init_service 创建
+service = None
+
+
+def init_db():
+    """初始化数据库连接（共享 modules.db 的连接池，可用状态变化时重新调用）"""
+    global mongo_client, db
+    db = get_db()
+    mongo_client = mongo.client if db is not None else None
+    if db is not None:
+        print("[Cameras] ✅ MongoDB 连接成功")
+    else:
+        print(f"[Cameras] ❌ MongoDB 连接失败: {mongo.last_error}")
+
+# 数据库在 app 启动时统一连接（modules.db.mongo.connect）
+mongo.on_connect(init_db)
+
+
+def parse_source(source_url):
+    """devices.source_url 为字符串，纯数字视为本地摄像头编号"""
+    if isinstance(source_url, int):
+        return source_url
+    source_url = str(source_url or "0").strip()
+    return int(source_url) if source_url.isdigit() else source_url
+
+
+def load_enabled_devices():
+    """读取所有启用的设备（未设置 enabled 字段的设备视为启用）"""
+    if db is None:
+        return []
+    try:
+        return list(db.devices.find({"enabled": {"$ne": False}}))
+    except Exception as e:
+        print(f"[Cameras] 读取设备列表失败: {e}")
+        return []
+
+
+def update_device_status(device_id, status):
+    try:
+        spooled_write(db, "devices", "update_one",
+                      {"device_id": device_id}, {"$set": {"status": status, "status_at": datetime.now()}})
+    except Exception as e:
+        print(f"[Cameras] 更新设备状态失败: {e}")
+
+
+class CameraWorker:
+    """单路摄像头：采集线程 + 独立检测状态"""
+
+    ALARM_SAVE_INTERVAL = 5.0
+    MAX_RECONNECT_DELAY = 30.0
+
+    def __init__(self, device, service):
+        self.device_id = device.get("device_id") or str(device.get("_id"))
+        self.name = device.get("name", self.device_id)
+        self.location = device.get("location") or self.device_id
+        self.source = parse_source(device.get("source_url", "0"))
+        self.framerate = float(device.get("framerate") or 0)
+        self.service = service
+        self.slot = DropOldestQueue(1)
+        self.scheduled = False
+        self.stats = {"capture": StageStats("capture"), "inference": StageStats("inference")}
+        self.status = "starting"
+        self.table_data = []
+        self.is_alarm = False
+        self.last_alarm_save = 0
+        self.last_result = None
+        self.storage = service.storage_factory(self) if service.storage_factory else None
+        self.motion_gate = service.gate_factory() if service.gate_factory else None
+        self.stride = service.stride_factory() if service.stride_factory else None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._capture_loop, name=f"camera-{self.device_id}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(2.0)
+        if self.storage:
+            self.storage.close()
+
+    def _set_status(self, status):
+        if status != self.status:
+            self.status = status
+            update_device_status(self.device_id, status)
+
+    def _capture_loop(self):
+        is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+        delay = 1.0
+        while not self.stop_event.is_set():
+            cap = self.service.open_capture(self.source)
+            if not cap.isOpened():
+                self._set_status("error")
+                print(f"[Cameras] {self.device_id} 打开视频源失败，{delay:.0f} 秒后重试")
+                self.stop_event.wait(delay)
+                delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+                continue
+            self._set_status("online")
+            delay = 1.0
+            fps = self.framerate or (cap.get(cv2.CAP_PROP_FPS) if is_file else 0)
+            frame_interval = 1.0 / fps if is_file and fps and fps > 0 else 0
+            try:
+                while not self.stop_event.is_set():
+                    started = time.time()
+                    success, frame = cap.read()
+                    if not success:
+                        if is_file:
+                            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                            continue
+                        break
+                    if self.storage: self.storage.buffer_frame(frame)
+                    self.slot.put(frame)
+                    self.service.schedule(self)
+                    self.stats["capture"].tick(time.time() - started)
+                    if frame_interval:
+                        remaining = frame_interval - (time.time() - started)
+                        if remaining > 0:
+                            time.sleep(remaining)
+            finally:
+                cap.release()
+            if not self.stop_event.is_set():
+                self._set_status("error")
+                print(f"[Cameras] {self.device_id} 视频流中断，准备重连")
+        self.table_data = []
+        self.is_alarm = False
+        self._set_status("offline")
+
+    def on_result(self, frame, analysis, table_data, fall_detected):
+        """推理线程回调：更新本路摄像头状态并处理报警"""
+        self.last_result = (frame, analysis)
+        self.table_data = table_data
+        self.is_alarm = fall_detected
+        if not fall_detected:
+            return
+        if self.storage: self.storage.save_event_clip()
+        if time.time() - self.last_alarm_save > self.ALARM_SAVE_INTERVAL:
+            self.last_alarm_save = time.time()
+            print(f"\033[91m[ALARM] {self.device_id} ({self.location}) 跌倒检测触发!\033[0m")
+            if self.service.on_alarm:
+                self.service.on_alarm(self)
+
+    def reconfigure(self, device):
+        """视频源未变时原地更新名称和位置，之后的报警记录使用新位置"""
+        self.name = device.get("name", self.device_id)
+        self.location = device.get("location") or self.device_id
+        if self.storage:
+            self.storage.location = self.location
+
+    def status_dict(self):
+        inference = self.stats["inference"].snapshot(self.slot.dropped)
+        if self.motion_gate is not None:
+            inference["motion"] = self.motion_gate.stats()
+        if self.stride is not None:
+            inference["stride"] = self.stride.stats()
+        return {
+            "device_id": self.device_id,
+            "name": self.name,
+            "location": self.location,
+            "source": str(self.source),
+            "status": self.status,
+            "is_alarm": self.is_alarm,
+            "detections": len(self.table_data),
+            "stages": [self.stats["capture"].snapshot(), inference]
+        }
+
+
+class DetectionService:
+    """
+    多路检测服务
+    - model_factory(): 为每个推理线程创建独立模型实例（YOLO 模型不保证线程安全）
+    - detect(model, frame, conf, iou): 执行一次推理，返回检测列表
+    - evaluate(detections): 跌倒判定，返回 (table_data, fall_detected)
+    - annotate(frame, analysis): 绘制标注帧，analysis 为 (检测列表, table_data, fall_detected)
+    - open_capture(source): 打开视频源
+    - storage_factory(worker): 为每路摄像头创建证据存储（可选）
+    - on_alarm(worker): 报警回调（已按摄像头节流）
+    - gate_factory(): 为每路摄像头创建运动门控（可选）
+    - stride_factory(): 为每路摄像头创建自适应跨帧检测（可选）
+    - get_thresholds(): 返回 (conf, iou)，来自系统配置的检测参数；每 THRESHOLD_REFRESH_SECONDS 秒和 sync() 时重新读取
+    """
+
+    THRESHOLD_REFRESH_SECONDS = 10.0
+
+    def __init__(self, model_factory, detect, evaluate, annotate, open_capture, storage_factory=None,
+                 on_alarm=None, workers=4, conf=0.30, iou=0.45, gate_factory=None, stride_factory=None,
+                 get_thresholds=None):
+        self.model_factory = model_factory
+        self.detect = detect
+        self.evaluate = evaluate
+        self.annotate = annotate
+        self.open_capture = open_capture
+        self.storage_factory = storage_factory
+        self.on_alarm = on_alarm
+        self.gate_factory = gate_factory
+        self.stride_factory = stride_factory
+        self.workers = max(1, int(workers))
+        self.conf = conf
+        self.iou = iou
+        self.get_thresholds = get_thresholds
+        self.thresholds_at = 0.0
+        self.cameras = {}
+        self.ready = queue.Queue()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.inference_threads = []
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        if self.inference_threads:
+            return
+        self.stop_event.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._inference_loop, name=f"camera-infer-{i}", daemon=True)
+            t.start()
+            self.inference_threads.append(t)
+        print(f"[Cameras] 检测服务已启动，共享推理线程 {self.workers} 个")
+
+    def stop(self):
+        with self.lock:
+            cameras = list(self.cameras.values())
+            self.cameras = {}
+        for worker in cameras:
+            worker.stop()
+        self.stop_event.set()
+        for t in self.inference_threads:
+            t.join(2.0)
+        self.inference_threads = []
+        print("[Cameras] 检测服务已停止")
+
+    def refresh_thresholds(self, force=False):
+        """重新读取检测阈值（读取失败时沿用当前值）"""
+        if self.get_thresholds is None:
+            return
+        now = time.time()
+        if not force and now - self.thresholds_at < self.THRESHOLD_REFRESH_SECONDS:
+            return
+        self.thresholds_at = now
+        try:
+            conf, iou = self.get_thresholds()
+            self.conf, self.iou = float(conf), float(iou)
+        except Exception as e:
+            print(f"[Cameras] 读取检测阈值失败: {e}")
+
+    def sync(self, devices):
+        """按设备列表增删摄像头，视频源变化的设备会被重启，名称 / 位置变化的设备原地更新"""
+        self.refresh_thresholds(force=True)
+        wanted = {}
+        for device in devices:
+            device_id = device.get("device_id") or str(device.get("_id"))
+            wanted[device_id] = device
+        with self.lock:
+            current = dict(self.cameras)
+        for device_id, worker in current.items():
+            device = wanted.get(device_id)
+            if device is None or parse_source(device.get("source_url", "0")) != worker.source:
+                worker.stop()
+                with self.lock:
+                    self.cameras.pop(device_id, None)
+            else:
+                worker.reconfigure(device)
+        for device_id, device in wanted.items():
+            with self.lock:
+                if device_id in self.cameras:
+                    continue
+                worker = CameraWorker(device, self)
+                self.cameras[device_id] = worker
+            worker.start()
+        self.start()
+        return len(wanted)
+
+    def reload(self):
+        return self.sync(load_enabled_devices())
+
+    # ---------- 调度 ----------
+    def schedule(self, worker):
+        """同一摄像头同一时刻最多一个待处理任务，保证单路结果按序且各路轮转公平"""
+        with self.lock:
+            if not worker.scheduled:
+                worker.scheduled = True
+                self.ready.put(worker)
+
+    def _finish(self, worker):
+        with self.lock:
+            worker.scheduled = False
+            if len(worker.slot) and not worker.stop_event.is_set():
+                worker.scheduled = True
+                self.ready.put(worker)
+
+    def _load_model(self):
+        """创建推理线程的模型实例；加载失败（含批量调度器加载失败）时按退避间隔重试，服务停止时返回 None"""
+        delay = 1.0
+        while not self.stop_event.is_set():
+            try:
+                return self.model_factory()
+            except Exception as e:
+                print(f"[Cameras] 推理模型加载失败，{delay:.0f} 秒后重试: {e}")
+                self.stop_event.wait(delay)
+                delay = min(delay * 2, 60.0)
+        return None
+
+    def _inference_loop(self):
+        model = self._load_model()
+        while not self.stop_event.is_set():
+            self.refresh_thresholds()
+            try:
+                worker = self.ready.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            frame = worker.slot.get(timeout=0)
+            try:
+                if frame is not None and not worker.stop_event.is_set():
+                    started = time.time()
+                    conf, iou = self.conf, self.iou
+                    # 同一摄像头的任务串行执行，门控与跟踪状态无需额外加锁
+                    detections = detect_adaptive(
+                        frame, lambda: self.detect(model, frame, conf, iou),
+                        motion_gate=worker.motion_gate, stride=worker.stride,
+                        alarm=worker.is_alarm, tracking=bool(worker.table_data))
+                    table_data, fall_detected = self.evaluate(detections)
+                    worker.on_result(frame, (detections, table_data, fall_detected), table_data, fall_detected)
+                    worker.stats["inference"].tick(time.time() - started)
+            except Exception as e:
+                print(f"[Cameras] {worker.device_id} 推理异常: {e}")
+            finally:
+                self._finish(worker)
+
+    # ---------- 查询 ----------
+    def get_camera(self, device_id):
+        with self.lock:
+            return self.cameras.get(device_id)
+
+    def status(self):
+        with self.lock:
+            cameras = list(self.cameras.values())
+        return [worker.status_dict() for worker in cameras]
+
+
+def init_service(**kwargs):
+    """由 app.py 注入模型与检测逻辑后创建服务实例"""
+    global service
+    service = DetectionService(**kwargs)
+    return service
+
+
+# ================= API =================
+
+@cameras_bp.route('', methods=['GET'])
+def list_cameras():
+    if service is None: return jsonify([])
+    return jsonify(service.status())
+
+
+@cameras_bp.route('/reload', methods=['POST'])
+def reload_cameras():
+    allowed, _ = has_role(request, 'admin')
+    if not allowed: return jsonify({"success": False, "msg": "仅管理员可操作"}), 403
+    if service is None: return jsonify({"success": False, "msg": "检测服务未初始化"}), 500
+    count = service.reload()
+    return jsonify({"success": True, "cameras": count})
+
+
+@cameras_bp.route('/stop', methods=['POST'])
+def stop_cameras():
+    allowed, _ = has_role(request, 'admin')
+    if not allowed: return jsonify({"success": False, "msg": "仅管理员可操作"}), 403
+    if service is None: return jsonify({"success": False, "msg": "检测服务未初始化"}), 500
+    service.stop()
+    return jsonify({"success": True})
+
+
+@cameras_bp.route('/<device_id>/data', methods=['GET'])
+def camera_data(device_id):
+    worker = service.get_camera(device_id) if service else None
+    if worker is None: return jsonify({"error": "摄像头未运行"}), 404
+    return jsonify({"is_alarm": worker.is_alarm, "table_data": worker.table_data})
+
+
+@cameras_bp.route('/<device_id>/feed')
+def camera_feed(device_id):
+    worker = service.get_camera(device_id) if service else None
+    if worker is None: return "Camera not running", 404
+
+    def generate():
+        last_result = None
+        while not worker.stop_event.is_set():
+            result = worker.last_result
+            if result is None or result is last_result:
+                time.sleep(0.03)
+                continue
+            last_result = result
+            frame, analysis = result
+            ok, buffer = cv2.imencode('.jpg', service.annotate(frame, analysis))
+            if ok:
+                yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+
+    return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
@@ -1,17 +1,20 @@
 from flask import Blueprint, jsonify, request
-import pymongo
 from datetime import datetime, timedelta
 from bson import ObjectId
 from modules.auth import has_role, get_request_user
+from modules.db import get_db, mongo
+from modules.spool import spooled_write
 
 extensions_bp = Blueprint('extensions', __name__, url_prefix='/api/ext')
 
-# MongoDB 连接
-try:
-    mongo_client = pymongo.MongoClient("mongodb://localhost:27017/", serverSelectionTimeoutMS=2000)
-    db = mongo_client["fall_detection_db"]
-except Exception as e:
-    db = None
+# MongoDB 连接（共享 modules.db 的连接池，可用状态变化时刷新）
+db = None
+
+def init_db():
+    global db
+    db = get_db()
+
+mongo.on_connect(init_db)
 
 def serialize_doc(doc):
     if '_id' in doc:
@@ -25,10 +28,8 @@ def serialize_doc(doc):
 
 
 def write_audit(action, details="", target_type="", target_id=None, username="system", status="success"):
-    if db is None:
-        return
     try:
-        db.audit_logs.insert_one({
+        spooled_write(db, "audit_logs", "insert_one", {
             "username": username,
             "action": action,
             "details": details,
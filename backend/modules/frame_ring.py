@@ -0,0 +1,195 @@
+"""
+共享内存帧环
+预分配固定数量的帧槽，采集直接解码进槽位，推理、证据缓冲、编码共享同一份像素；
+槽位带引用计数，最后一个持有者释放后才会被重新写入
+
+帧在各模块之间可以是普通 ndarray，也可以是 FrameSlot 句柄，
+retain / release / pixels 对两者通用，已有的 ndarray 调用方无需修改
+"""
+
+import threading
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+_rings = weakref.WeakSet()
+
+
+class FrameSlot:
+    """槽位句柄；array 为槽内像素（只读约定：持有者不得原地修改）"""
+
+    __slots__ = ("ring", "index", "array", "__weakref__")
+
+    def __init__(self, ring, index, array):
+        self.ring = ring
+        self.index = index
+        self.array = array
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def retain(self):
+        if self.ring is not None:
+            self.ring._retain(self.index)
+        return self
+
+    def release(self):
+        if self.ring is not None:
+            self.ring._release(self.index)
+
+
+class FrameRing:
+    """
+    - shape: 帧尺寸 (h, w, 3)，尺寸变化时由 RingReader 重建新的帧环
+    - slots: 槽位数，应覆盖所有持有者同时持有的最大帧数（证据缓冲 + 流水线队列）
+    槽位耗尽时 acquire 退化为普通内存分配，不阻塞采集
+    """
+
+    def __init__(self, shape, slots=8, dtype=np.uint8):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = max(2, int(slots))
+        self.frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=self.frame_bytes * self.slots)
+        self.buffer = np.ndarray((self.slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        self.refcounts = [0] * self.slots
+        self.next_index = 0
+        self.closed = False
+        self.acquired = 0
+        self.overflow = 0
+        self._lock = threading.Lock()
+        _rings.add(self)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def acquire(self):
+        """取一个空闲槽位（引用计数 1）；没有空闲槽位时返回独立分配的句柄"""
+        with self._lock:
+            for step in range(self.slots):
+                index = (self.next_index + step) % self.slots
+                if self.refcounts[index] == 0:
+                    self.refcounts[index] = 1
+                    self.next_index = (index + 1) % self.slots
+                    self.acquired += 1
+                    return FrameSlot(self, index, self.buffer[index])
+            self.overflow += 1
+        return FrameSlot(None, -1, np.empty(self.shape, dtype=self.dtype))
+
+    def _retain(self, index):
+        with self._lock:
+            self.refcounts[index] += 1
+
+    def _release(self, index):
+        with self._lock:
+            if self.refcounts[index] > 0:
+                self.refcounts[index] -= 1
+            idle = self.closed and not any(self.refcounts)
+        if idle:
+            self._free()
+
+    def locate(self, array):
+        """array 若位于本帧环中，返回其字节偏移，否则返回 None"""
+        if self.closed or array.dtype != self.dtype or array.shape != self.shape:
+            return None
+        offset = array.ctypes.data - self.buffer.ctypes.data
+        if 0 <= offset < self.frame_bytes * self.slots and offset % self.frame_bytes == 0:
+            return offset
+        return None
+
+    def close(self):
+        """停止分配；所有槽位释放后回收共享内存"""
+        with self._lock:
+            self.closed = True
+            idle = not any(self.refcounts)
+        if idle:
+            self._free()
+
+    def _free(self):
+        if self.buffer is None:
+            return
+        self.buffer = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # 仍有外部视图引用像素时，映射随这些视图回收
+            pass
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "slots": self.slots,
+                "in_use": sum(1 for c in self.refcounts if c),
+                "acquired": self.acquired,
+                "overflow": self.overflow
+            }
+
+
+class RingReader:
+    """把 VideoCapture 的帧直接解码进帧环槽位"""
+
+    def __init__(self, slots=8):
+        self.slots = slots
+        self.ring = None
+
+    def read(self, cap):
+        """返回 (success, FrameSlot)；首帧或分辨率变化时按新尺寸重建帧环"""
+        if self.ring is not None:
+            slot = self.ring.acquire()
+            success, frame = cap.read(slot.array)
+            if not success:
+                slot.release()
+                return False, None
+            if frame.ctypes.data == slot.array.ctypes.data:
+                return True, slot
+            # 解码器没有写入给定缓冲（分辨率变化），释放槽位按新帧处理
+            slot.release()
+        else:
+            success, frame = cap.read()
+            if not success:
+                return False, None
+        if self.ring is None or self.ring.shape != frame.shape:
+            self.close()
+            self.ring = FrameRing(frame.shape, self.slots, frame.dtype)
+        slot = self.ring.acquire()
+        np.copyto(slot.array, frame)
+        return True, slot
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+    def stats(self):
+        return self.ring.stats() if self.ring is not None else {}
+
+
+def locate(array):
+    """返回 (共享内存名, 字节偏移)，array 不在任何帧环中时返回 None"""
+    for ring in list(_rings):
+        offset = ring.locate(array)
+        if offset is not None:
+            return ring.name, offset
+    return None
+
+
+def pixels(frame):
+    return frame.array if isinstance(frame, FrameSlot) else frame
+
+
+def retain(frame):
+    if isinstance(frame, FrameSlot):
+        frame.retain()
+    return frame
+
+
+def release(frame):
+    if isinstance(frame, FrameSlot):
+        frame.release()
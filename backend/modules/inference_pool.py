@@ -0,0 +1,417 @@
+"""
+多进程推理池
+推理放到独立的工作进程中执行，Web 进程只负责采集、编码和接口，避免与 GIL / torch 线程争用；
+帧位于共享内存帧环 (modules.frame_ring) 时只传递槽位位置，否则复制进每个进程独占的共享内存，结果以 N×6 float32 数组 (x1, y1, x2, y2, conf, cls) 返回
+
+工作进程以 `python -m modules.inference_pool` 独立启动（不经 multiprocessing spawn），
+因此不会重新导入 app.py 的顶层代码
+"""
+
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from modules.frame_ring import locate
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUTHKEY_ENV = "FALL_POOL_AUTHKEY"
+CONNECT_TIMEOUT = 60.0  # 工作进程启动到连回父进程的最长等待时间（导入 numpy / 本模块）
+
+
+def to_detections(array, names):
+    """N×6 结果数组 -> 检测列表 [{"coords", "conf", "cls_name"}]"""
+    return [{
+        "coords": row[:4].astype(int).tolist(),
+        "conf": float(row[4]),
+        "cls_name": names[int(row[5])]
+    } for row in array]
+
+
+class _WorkerHandle:
+    """父进程侧的工作进程句柄"""
+
+    def __init__(self, index, process, conn, shm):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.shm = shm
+        self.version = 0
+        self.alive = True
+
+    def close(self):
+        self.alive = False
+        try:
+            self.conn.send(("stop",))
+        except (OSError, EOFError):
+            pass
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class InferencePool:
+    """
+    推理进程池
+    - workers: 进程数（来自 advanced.workers）
+    - slot_bytes: 每个进程共享内存大小，超过的帧退化为管道传输
+    - torch 线程数按 CPU 核数平分，避免各进程的 intra-op 线程互相抢占
+    """
+
+    def __init__(self, model_path, backend='torch', fallback_backend='torch', imgsz=640, workers=2,
+                 slot_bytes=1920 * 1080 * 3, timeout=30.0):
+        self.model_path = model_path
+        self.backend = backend
+        self.fallback_backend = fallback_backend
+        self.imgsz = imgsz
+        self.workers = max(1, int(workers))
+        self.slot_bytes = int(slot_bytes)
+        self.timeout = timeout
+        self.threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+        self.names = {}
+        self.version = 0
+        self.handles = []
+        self.idle = queue.Queue()
+        self.ready_event = threading.Event()
+        self.frames = 0
+        self.busy_seconds = 0.0
+        self._authkey = os.urandom(16)
+        self._listener = None
+        self._lock = threading.Lock()
+        self._spawn_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._reload_queue = None  # 热更新期间，旧版本的进程用完后交给更新线程而不是放回 idle
+        self._stopped = False
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        """后台依次启动工作进程，每个进程加载并预热完成后即可接收请求"""
+        self._listener = Listener(('127.0.0.1', 0), authkey=self._authkey)
+        threading.Thread(target=self._spawn_all, name="inference-pool-start", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped = True
+        with self._lock:
+            handles, self.handles = self.handles, []
+        for handle in handles:
+            handle.close()
+        if self._listener is not None:
+            self._listener.close()
+
+    def _spawn_all(self):
+        for index in range(self.workers):
+            if self._stopped:
+                return
+            self._spawn(index)
+
+    def _spawn(self, index):
+        shm = shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+        env = dict(os.environ)
+        env[AUTHKEY_ENV] = self._authkey.hex()
+        env["OMP_NUM_THREADS"] = str(self.threads_per_worker)
+        address = self._listener.address
+        process = None
+        try:
+            with self._spawn_lock:
+                process = subprocess.Popen(
+                    [sys.executable, "-m", "modules.inference_pool", address[0], str(address[1]), shm.name,
+                     str(self.threads_per_worker)],
+                    cwd=BACKEND_DIR, env=env)
+                conn = self._accept(process)
+            conn.send((self.model_path, self.backend, self.fallback_backend, self.imgsz))
+            if not conn.poll(600):
+                raise TimeoutError("模型加载超时")
+            status, payload = conn.recv()
+            if status != "ready":
+                raise RuntimeError(payload)
+        except Exception as e:
+            print(f"[Pool] 推理进程 {index} 启动失败: {e}")
+            if process is not None and process.poll() is None:
+                process.kill()
+            if process is not None:
+                process.wait()
+            shm.close()
+            shm.unlink()
+            return None
+        handle = _WorkerHandle(index, process, conn, shm)
+        handle.version = self.version
+        with self._lock:
+            self.names = payload
+            self.handles.append(handle)
+        print(f"[Pool] 推理进程 {index} 就绪 (pid={process.pid}, threads={self.threads_per_worker})")
+        self.idle.put(handle)
+        self.ready_event.set()
+        return handle
+
+    def _accept(self, process, timeout=CONNECT_TIMEOUT):
+        """
+        等待刚启动的工作进程连回；进程提前退出（如导入失败）或超时时抛出，不会一直占着 _spawn_lock
+        已被放弃的进程留在连接队列中的连接握手失败，跳过后继续等待
+        """
+        deadline = time.time() + timeout
+        listen_socket = self._listener._listener._socket
+        listen_socket.settimeout(1.0)
+        try:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"推理进程启动后退出，退出码 {process.returncode}")
+                if time.time() > deadline:
+                    raise TimeoutError(f"推理进程 {timeout:.0f}s 内未连接")
+                try:
+                    return self._listener.accept()
+                except socket.timeout:
+                    continue
+                except (AuthenticationError, EOFError, ConnectionError) as e:
+                    print(f"[Pool] 忽略无效的工作进程连接: {e}")
+        finally:
+            listen_socket.settimeout(None)
+
+    def _discard(self, handle):
+        """进程异常退出：回收资源并在后台重启同编号的进程"""
+        with self._lock:
+            if handle in self.handles:
+                self.handles.remove(handle)
+        try:
+            handle.close()
+        except Exception:
+            pass
+        if not self._stopped:
+            print(f"[Pool] 推理进程 {handle.index} 异常退出，正在重启")
+            threading.Thread(target=self._spawn, args=(handle.index,), daemon=True).start()
+
+    # ---------- 推理 ----------
+    def detect(self, frame, conf=0.3, iou=0.45):
+        """提交一帧并等待结果，返回检测列表"""
+        if not self.ready_event.wait(self.timeout):
+            raise TimeoutError("推理进程尚未就绪")
+        handle = self.idle.get(timeout=self.timeout)
+        started = time.time()
+        try:
+            ring_ref = locate(frame)
+            if ring_ref is not None:
+                # 调用方在推理返回前持有槽位，工作进程直接读取帧环中的像素
+                handle.conn.send(("infer_ring", ring_ref[0], ring_ref[1], frame.shape, frame.dtype.str, conf, iou))
+            elif frame.nbytes <= handle.shm.size:
+                view = np.ndarray(frame.shape, dtype=frame.dtype, buffer=handle.shm.buf)
+                view[...] = frame
+                handle.conn.send(("infer", frame.shape, frame.dtype.str, conf, iou))
+            else:
+                handle.conn.send(("infer_inline", frame, conf, iou))
+            if not handle.conn.poll(self.timeout):
+                raise EOFError("推理超时")
+            status, payload = handle.conn.recv()
+        except (EOFError, OSError) as e:
+            handle.alive = False
+            self._discard(handle)
+            raise RuntimeError(f"推理进程失效: {e}")
+        finally:
+            if handle.alive:
+                self._release(handle)
+        if status != "ok":
+            raise RuntimeError(payload)
+        with self._lock:
+            self.frames += 1
+            self.busy_seconds += time.time() - started
+        return to_detections(np.frombuffer(payload, dtype=np.float32).reshape(-1, 6), self.names)
+
+    def _release(self, handle):
+        """归还进程：热更新期间尚未换到新版本的进程交给更新线程，其余放回 idle"""
+        reload_queue = self._reload_queue
+        if reload_queue is not None and handle.version < self.version:
+            reload_queue.put(handle)
+        else:
+            self.idle.put(handle)
+
+    def reload_async(self, new_path, max_attempts=3):
+        """
+        逐个进程替换权重，其余进程继续服务
+        只有收到 "ok" 的进程才算更新完成；加载失败的进程继续用旧模型服务，下次空闲时重试，
+        重试 max_attempts 次仍失败则放弃，保留旧版本并打印日志
+        """
+        def reload():
+            with self._reload_lock:
+                reload_queue = queue.Queue()
+                with self._lock:
+                    self.version += 1
+                    self.model_path = new_path
+                    target = self.version
+                    pending = {handle for handle in self.handles if handle.version < target}
+                attempts = {}
+                gave_up = []
+                self._reload_queue = reload_queue
+
+                def collect_idle():
+                    # 空闲的旧版本进程转入更新队列；正在推理的进程由 _release 在用完后转入
+                    for _ in range(self.idle.qsize()):
+                        try:
+                            self._release(self.idle.get_nowait())
+                        except queue.Empty:
+                            break
+
+                try:
+                    collect_idle()
+                    while pending and not self._stopped:
+                        try:
+                            handle = reload_queue.get(timeout=1.0)
+                        except queue.Empty:
+                            # 异常退出的进程会以新版本重启，不再等待；加载失败后放回 idle 的进程在这里重新收回重试
+                            with self._lock:
+                                pending &= set(self.handles)
+                            collect_idle()
+                            continue
+                        if self._reload_one(handle, new_path, target):
+                            pending.discard(handle)
+                            continue
+                        if not handle.alive:
+                            pending.discard(handle)
+                            continue
+                        attempts[handle] = attempts.get(handle, 0) + 1
+                        if attempts[handle] >= max_attempts:
+                            print(f"[Pool] 推理进程 {handle.index} 加载新模型失败 {max_attempts} 次，继续使用旧模型")
+                            pending.discard(handle)
+                            gave_up.append(handle.index)
+                finally:
+                    self._reload_queue = None
+                    # 更新线程退出后仍在队列里的进程放回 idle
+                    while True:
+                        try:
+                            self.idle.put(reload_queue.get_nowait())
+                        except queue.Empty:
+                            break
+            if gave_up:
+                print(f"[Pool] 推理进程模型部分更新: {new_path}，进程 {gave_up} 仍使用旧模型")
+            elif not pending:
+                print(f"[Pool] 推理进程模型已更新: {new_path}")
+
+        thread = threading.Thread(target=reload, name="inference-pool-reload", daemon=True)
+        thread.start()
+        return thread
+
+    def _reload_one(self, handle, new_path, target):
+        """让一个进程加载新权重，成功返回 True；无论结果如何，仍存活的进程都会放回 idle"""
+        try:
+            handle.conn.send(("reload", new_path))
+            if not handle.conn.poll(600):
+                raise EOFError("模型加载超时")
+            status, payload = handle.conn.recv()
+        except (EOFError, OSError) as e:
+            print(f"[Pool] 推理进程 {handle.index} 更新模型时失效: {e}")
+            handle.alive = False
+            self._discard(handle)
+            return False
+        if status == "ok":
+            self.names = payload
+            handle.version = target
+        else:
+            print(f"[Pool] 推理进程 {handle.index} 加载新模型失败: {payload}")
+        self.idle.put(handle)
+        return status == "ok"
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "ready": len(self.handles),
+                "idle": self.idle.qsize(),
+                "threads_per_worker": self.threads_per_worker,
+                "frames": self.frames,
+                "avg_ms": round(self.busy_seconds / self.frames * 1000, 1) if self.frames else 0
+            }
+
+
+# ---------- 工作进程 ----------
+def _attach_shared_memory(name):
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        # 共享内存由父进程创建和释放，避免本进程退出时被 resource_tracker 提前回收
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+def _worker_main(host, port, shm_name, threads):
+    conn = Client((host, int(port)), authkey=bytes.fromhex(os.environ[AUTHKEY_ENV]))
+    shm = _attach_shared_memory(shm_name)
+    try:
+        import torch
+        torch.set_num_threads(int(threads))
+    except ImportError:
+        pass
+    from modules.perception import PerceptionModule
+    rings = {}  # 已映射的帧环共享内存
+
+    model_path, backend, fallback_backend, imgsz = conn.recv()
+    try:
+        perception = PerceptionModule(model_path, backend=backend, imgsz=imgsz, fallback_backend=fallback_backend)
+        model = perception.load_model()
+    except Exception as e:
+        conn.send(("error", str(e)))
+        return
+    conn.send(("ready", dict(model.names)))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        kind = message[0]
+        if kind == "stop":
+            break
+        try:
+            if kind == "reload":
+                perception.model_path = message[1]
+                perception.model = None
+                model = perception.load_model()
+                conn.send(("ok", dict(model.names)))
+                continue
+            if kind == "infer":
+                _, shape, dtype, conf, iou = message
+                frame = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+            elif kind == "infer_ring":
+                _, name, offset, shape, dtype, conf, iou = message
+                if name not in rings:
+                    for old in list(rings)[:-3]:
+                        _close_quietly(rings.pop(old))
+                    rings[name] = _attach_shared_memory(name)
+                frame = np.ndarray(shape, dtype=np.dtype(dtype), buffer=rings[name].buf, offset=offset)
+            else:
+                _, frame, conf, iou = message
+            results = model(frame, conf=conf, iou=iou, verbose=False)
+            # boxes.data 每行为 (x1, y1, x2, y2, conf, cls)
+            data = results[0].boxes.data.cpu().numpy().astype(np.float32)
+            conn.send(("ok", data.tobytes()))
+        except Exception as e:
+            conn.send(("error", str(e)))
+    frame = None
+    for ring in rings.values():
+        _close_quietly(ring)
+    _close_quietly(shm)
+
+
+def _close_quietly(shm):
+    try:
+        shm.close()
+    except BufferError:
+        pass
+
+
+if __name__ == '__main__':
+    _worker_main(*sys.argv[1:5])
@@ -0,0 +1,70 @@
+"""
+运动门控模块
+在 YOLO 推理之前用低分辨率帧差 + 滑动平均背景判断画面是否变化，
+静止画面直接复用上一次检测结果；定期强制刷新，跟踪目标或跌倒进行中时始终推理
+"""
+
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    - width: 判定用的缩略图宽度
+    - pixel_threshold: 灰度差超过该值的像素视为变化
+    - area_ratio: 变化像素占比超过该值视为有运动
+    - refresh_seconds: 最长多久强制推理一次
+    - learning_rate: 背景模型的更新速率
+    """
+
+    def __init__(self, width=160, pixel_threshold=25, area_ratio=0.002, refresh_seconds=5.0, learning_rate=0.05):
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.area_ratio = area_ratio
+        self.refresh_seconds = refresh_seconds
+        self.learning_rate = learning_rate
+        self.background = None
+        self.last_result = None
+        self.last_infer_time = 0
+        self.frames = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def has_motion(self, frame):
+        """更新背景模型并返回当前帧是否有运动"""
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (self.width, max(1, int(h * self.width / w))), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray.astype(np.float32)
+            return True
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+        changed = cv2.countNonZero(cv2.threshold(diff, self.pixel_threshold, 255, cv2.THRESH_BINARY)[1])
+        cv2.accumulateWeighted(gray, self.background, self.learning_rate)
+        return changed >= self.area_ratio * gray.size
+
+    def run(self, frame, infer, force=False):
+        """画面变化、强制刷新或到达刷新周期时调用 infer()，否则返回上一次结果"""
+        motion = self.has_motion(frame)
+        now = time.time()
+        with self._lock:
+            self.frames += 1
+            due = now - self.last_infer_time >= self.refresh_seconds
+            if self.last_result is not None and not (force or motion or due):
+                self.skipped += 1
+                return self.last_result
+        result = infer()
+        self.last_result = result
+        self.last_infer_time = now
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "frames": self.frames,
+                "skipped": self.skipped,
+                "skip_ratio": round(self.skipped / self.frames, 3) if self.frames else 0
+            }
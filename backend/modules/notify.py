@@ -0,0 +1,504 @@
+"""
+报警通知分发模块
+每个渠道（email / sms）一个有界队列和固定数量的工作线程，报警风暴时线程数和连接数都有上限；
+发送失败按指数退避重试，同一渠道同一收件人在时间窗口内的发送次数受限，避免触发服务商限流；
+超出频率限制的通知不丢弃，推迟到窗口内出现空额时发送，推迟期间同一收件人的后续通知合并进这一条
+
+- transport(recipient, payload) -> 说明文字：实际发送，抛出 PermanentError 表示不可重试（配置错误、号码无效等）
+- merge(payload, newer) -> payload：登记渠道时可选，推迟中的通知与同一收件人的新通知合并；未提供时逐条推迟
+- on_result(job, success, message)：每条通知最终成功或放弃时调用一次，用于写入 notification_logs；
+  submit_batch 提交的多收件人通知（服务商支持一次请求发给多个号码时）job.recipients 为全部收件人
+- DryRunTransport：不连接外部服务的替身，可模拟耗时和失败率，用于离线压测
+- DigestBuffer：同一收件人短时间内的多条报警合并为一条通知
+- SmtpConnectionPool：复用已登录的 SMTP 连接，省去每封邮件的 TLS 握手和登录
+"""
+
+import heapq
+import itertools
+import queue
+import random
+import smtplib
+import ssl
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+
+class PermanentError(Exception):
+    """不可重试的发送失败"""
+
+
+class SplitBatch(Exception):
+    """多收件人通知因个别收件人被拒（如号码无效）整体失败：拆成单个收件人重新发送"""
+
+
+class Notification:
+    __slots__ = ("channel", "recipient", "payload", "alarm_id", "attempts", "created_at")
+
+    def __init__(self, channel, recipient, payload, alarm_id=None):
+        self.channel = channel
+        self.recipient = recipient
+        self.payload = payload
+        self.alarm_id = alarm_id
+        self.attempts = 0
+        self.created_at = time.time()
+
+    @property
+    def recipients(self):
+        return self.recipient if isinstance(self.recipient, tuple) else (self.recipient,)
+
+    @property
+    def label(self):
+        return ",".join(self.recipients)
+
+
+class RateLimiter:
+    """滑动窗口计数：每个 key 在 window 秒内最多 limit 次；limit <= 0 表示不限制"""
+
+    def __init__(self, limit=10, window=600.0):
+        self.limit = int(limit)
+        self.window = float(window)
+        self.history = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        return self.reserve(key) == 0
+
+    def reserve(self, key):
+        """
+        为 key 预订一次发送，返回需要等待的秒数（0 表示可立即发送）；
+        超出限制时预订窗口内第一个空额的时间点，推迟发送的通知也计入频率
+        """
+        if self.limit <= 0:
+            return 0
+        now = time.time()
+        with self._lock:
+            stamps = self.history[key]
+            while stamps and now - stamps[0] >= self.window:
+                stamps.popleft()
+            if len(stamps) < self.limit:
+                stamps.append(now)
+                return 0
+            # stamps 升序（含已预订的将来时间点），新的一次须与倒数第 limit 次相隔一个窗口
+            at = max(now, stamps[-self.limit] + self.window)
+            stamps.append(at)
+            return at - now
+
+
+class DryRunTransport:
+    """
+    替身发送：不连接外部服务，只记录发送内容
+    - latency: 每次发送的模拟耗时（秒）
+    - failure_rate: 随机失败的比例，用于验证重试
+    """
+
+    def __init__(self, channel, latency=0.05, failure_rate=0.0, keep=1000):
+        self.channel = channel
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = deque(maxlen=keep)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, recipient, payload):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise ConnectionError(f"dry-run 模拟 {self.channel} 发送失败")
+        self.sent.append((recipient, payload))
+        return "dry-run 未实际发送"
+
+
+class NotificationDispatcher:
+    """
+    - queue_size: 每个渠道队列的容量，满时新通知直接判定失败
+    - max_attempts: 含首次在内的最多发送次数；base_delay / max_delay: 重试退避（秒），每次翻倍并加随机抖动
+    - rate_limit / rate_window: 同一渠道同一收件人在 rate_window 秒内最多发送 rate_limit 次，
+      超出的通知推迟到出现空额时发送（不计入重试次数），推迟期间的新通知合并进推迟中的那一条
+    """
+
+    def __init__(self, on_result=None, queue_size=500, max_attempts=4, base_delay=2.0, max_delay=120.0,
+                 rate_limit=10, rate_window=600.0):
+        self.on_result = on_result
+        self.queue_size = queue_size
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = RateLimiter(rate_limit, rate_window)
+        self.channels = {}  # channel -> {"transport", "queue", "threads", "stats"}
+        self.stop_event = threading.Event()
+        self._retries = []  # (到期时间, 序号, job)
+        self._retry_seq = itertools.count()
+        self._retry_cond = threading.Condition()
+        self._retry_thread = None
+        self._deferred = {}  # (渠道, 收件人) -> 因频率限制推迟中的通知
+        self._lock = threading.Lock()
+
+    def register(self, channel, transport, workers=2, merge=None, rate_limited=True):
+        """
+        登记渠道；工作线程在首次提交时才启动
+        merge: 推迟中的通知与新通知的合并方式；rate_limited=False 的渠道不受频率限制（如内部的报警分发任务）
+        """
+        self.channels[channel] = {
+            "transport": transport,
+            "workers": max(1, int(workers)),
+            "merge": merge,
+            "rate_limited": rate_limited,
+            "queue": queue.Queue(maxsize=self.queue_size),
+            "threads": [],
+            "stats": {"sent": 0, "failed": 0, "retried": 0, "rate_limited": 0, "coalesced": 0, "dropped": 0}
+        }
+
+    def submit(self, channel, recipient, payload, alarm_id=None):
+        """提交一条通知，立即返回；队列已满或渠道未登记时返回 False"""
+        job = Notification(channel, recipient, payload, alarm_id)
+        entry = self.channels.get(channel)
+        if entry is None:
+            self._finish(job, False, f"未登记的通知渠道 {channel}")
+            return False
+        self._ensure_started(channel)
+        if self._throttle(entry, job):
+            return True
+        try:
+            entry["queue"].put_nowait(job)
+        except queue.Full:
+            self._count(entry, "dropped")
+            self._finish(job, False, "通知队列已满")
+            return False
+        return True
+
+    def submit_batch(self, channel, recipients, payload, alarm_id=None, batch_size=100):
+        """
+        多个收件人按 batch_size 分组，每组作为一条通知交给 transport（recipient 为收件人元组），
+        各组由渠道的工作线程并发发送；频率限制仍按单个收件人计算。返回已入队（含推迟）的收件人数
+        """
+        entry = self.channels.get(channel)
+        if entry is None:
+            self._finish(Notification(channel, tuple(recipients), payload, alarm_id), False, f"未登记的通知渠道 {channel}")
+            return 0
+        self._ensure_started(channel)
+        allowed = []
+        queued = 0
+        for recipient in recipients:
+            # 超出频率限制的收件人单独推迟，其余收件人照常合并发送
+            if self._throttle(entry, Notification(channel, recipient, payload, alarm_id)):
+                queued += 1
+            else:
+                allowed.append(recipient)
+        batch_size = max(1, int(batch_size))
+        for start in range(0, len(allowed), batch_size):
+            job = Notification(channel, tuple(allowed[start:start + batch_size]), payload, alarm_id)
+            try:
+                entry["queue"].put_nowait(job)
+                queued += len(job.recipients)
+            except queue.Full:
+                self._count(entry, "dropped", len(job.recipients))
+                self._finish(job, False, "通知队列已满")
+        return queued
+
+    def _throttle(self, entry, job):
+        """
+        频率限制：收件人有推迟中的通知时合并进去；超出限制时推迟到预订的时间点再入队。
+        返回 True 表示通知已被合并或推迟，调用方不再入队
+        """
+        if not entry["rate_limited"]:
+            return False
+        key = (job.channel, job.recipient)
+        with self._lock:
+            pending = self._deferred.get(key)
+            if pending is not None:
+                merge = entry["merge"]
+                if merge is not None:
+                    pending.payload = merge(pending.payload, job.payload)
+                    entry["stats"]["coalesced"] += 1
+                    return True
+        delay = self.limiter.reserve(key)
+        if delay <= 0:
+            return False
+        with self._lock:
+            self._deferred.setdefault(key, job)
+            entry["stats"]["rate_limited"] += 1
+        print(f"[Notify] {job.channel} 发送至 {job.label} 超出频率限制，推迟 {delay:.0f}s 发送")
+        self._schedule(job, delay)
+        return True
+
+    def _schedule(self, job, delay):
+        with self._retry_cond:
+            heapq.heappush(self._retries, (time.time() + delay, next(self._retry_seq), job))
+            self._retry_cond.notify()
+
+    def stop(self):
+        self.stop_event.set()
+        with self._retry_cond:
+            self._retry_cond.notify_all()
+        for entry in self.channels.values():
+            for _ in entry["threads"]:
+                try:
+                    entry["queue"].put_nowait(None)
+                except queue.Full:
+                    pass
+
+    # ---------- 工作线程 ----------
+    def _ensure_started(self, channel):
+        entry = self.channels[channel]
+        if entry["threads"]:
+            return
+        with self._lock:
+            if entry["threads"]:
+                return
+            for i in range(entry["workers"]):
+                thread = threading.Thread(target=self._worker, args=(channel,), name=f"notify-{channel}-{i}",
+                                          daemon=True)
+                thread.start()
+                entry["threads"].append(thread)
+            if self._retry_thread is None:
+                self._retry_thread = threading.Thread(target=self._retry_loop, name="notify-retry", daemon=True)
+                self._retry_thread.start()
+
+    def _worker(self, channel):
+        entry = self.channels[channel]
+        while not self.stop_event.is_set():
+            job = entry["queue"].get()
+            if job is None:
+                return
+            self._deliver(entry, job)
+
+    def _deliver(self, entry, job):
+        job.attempts += 1
+        try:
+            message = entry["transport"](job.recipient, job.payload)
+        except SplitBatch as e:
+            if len(job.recipients) == 1:
+                self._count(entry, "failed")
+                self._finish(job, False, str(e))
+                return
+            for recipient in job.recipients:
+                single = Notification(job.channel, recipient, job.payload, job.alarm_id)
+                single.created_at = job.created_at
+                try:
+                    entry["queue"].put_nowait(single)
+                except queue.Full:
+                    self._count(entry, "dropped")
+                    self._finish(single, False, "通知队列已满")
+        except PermanentError as e:
+            self._count(entry, "failed", len(job.recipients))
+            self._finish(job, False, str(e))
+        except Exception as e:
+            if job.attempts >= self.max_attempts or self.stop_event.is_set():
+                self._count(entry, "failed", len(job.recipients))
+                self._finish(job, False, f"重试 {job.attempts - 1} 次后仍失败: {e}")
+                return
+            self._count(entry, "retried")
+            delay = min(self.max_delay, self.base_delay * 2 ** (job.attempts - 1))
+            delay *= random.uniform(0.8, 1.2)
+            print(f"[Notify] {job.channel} 发送至 {job.label} 失败，{delay:.1f}s 后重试: {e}")
+            self._schedule(job, delay)
+        else:
+            self._count(entry, "sent", len(job.recipients))
+            self._finish(job, True, message or "发送成功")
+
+    def _retry_loop(self):
+        """到期的重试和推迟的通知放回渠道队列；队列已满时判定失败"""
+        while not self.stop_event.is_set():
+            with self._retry_cond:
+                while not self.stop_event.is_set() and (
+                        not self._retries or self._retries[0][0] > time.time()):
+                    timeout = self._retries[0][0] - time.time() if self._retries else None
+                    self._retry_cond.wait(timeout)
+                if self.stop_event.is_set():
+                    return
+                _, _, job = heapq.heappop(self._retries)
+            with self._lock:
+                # 推迟的通知到期后不再接受合并
+                key = (job.channel, job.recipient)
+                if self._deferred.get(key) is job:
+                    del self._deferred[key]
+            entry = self.channels[job.channel]
+            try:
+                entry["queue"].put_nowait(job)
+            except queue.Full:
+                self._count(entry, "dropped", len(job.recipients))
+                self._finish(job, False, "通知队列已满，放弃重试")
+
+    def _count(self, entry, key, n=1):
+        with self._lock:
+            entry["stats"][key] += n
+
+    def _finish(self, job, success, message):
+        if self.on_result is None:
+            return
+        try:
+            self.on_result(job, success, message)
+        except Exception as e:
+            print(f"[Notify] 记录发送结果失败: {e}")
+
+    def stats(self):
+        with self._retry_cond:
+            waiting = len(self._retries)
+        with self._lock:
+            deferred = len(self._deferred)
+        return {
+            "channels": {
+                channel: {**entry["stats"], "queued": entry["queue"].qsize(), "workers": entry["workers"]}
+                for channel, entry in self.channels.items()
+            },
+            "retry_waiting": waiting,
+            "deferred": deferred
+        }
+
+
+class DigestBuffer:
+    """
+    按 key（收件人）合并 window 秒内到达的条目，调用 flush(key, items)：
+    窗口外的第一条立即发出并开启窗口，窗口内到达的条目在窗口结束时合并发出一次（随后开启下一个窗口），
+    首条报警不增加延迟，持续的报警风暴中每个收件人每个窗口最多一条通知
+    """
+
+    def __init__(self, window, flush):
+        self.window = float(window)
+        self.flush = flush
+        self.pending = {}  # key -> 窗口内等待合并的条目；存在即表示窗口开启中
+        self.merged = 0
+        self._lock = threading.Lock()
+
+    def add(self, key, item):
+        with self._lock:
+            items = self.pending.get(key)
+            if items is not None:
+                items.append(item)
+                return
+            self.pending[key] = []
+            self._schedule(key)
+        self._safe_flush(key, [item])
+
+    def _schedule(self, key):
+        timer = threading.Timer(self.window, self._close, args=(key,))
+        timer.daemon = True
+        timer.start()
+
+    def _close(self, key):
+        with self._lock:
+            items = self.pending.pop(key, None)
+            if items:
+                self.pending[key] = []
+                self._schedule(key)
+                self.merged += len(items) - 1
+        if items:
+            self._safe_flush(key, items)
+
+    def _safe_flush(self, key, items):
+        try:
+            self.flush(key, items)
+        except Exception as e:
+            print(f"[Notify] 合并通知发送失败 {key}: {e}")
+
+
+class SmtpConnectionPool:
+    """
+    按 (服务器, 端口, 账号) 缓存已登录的 SMTP 连接，由发送线程借出、用完归还
+    - idle_timeout: 空闲超过该秒数的连接直接关闭重建（服务商通常几分钟后断开空闲连接）
+    - check_after: 空闲超过该秒数的连接借出前先 NOOP 探活，失败则重连
+    """
+
+    def __init__(self, idle_timeout=240.0, check_after=15.0, timeout=10):
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.timeout = timeout
+        self.idle = defaultdict(list)  # key -> [(连接, 最后使用时间)]
+        self.opened = 0
+        self.reused = 0
+        self.stale = 0
+        self._lock = threading.Lock()
+
+    def _connect(self, host, port, user, password):
+        ctx = ssl.create_default_context()
+        if port == 465:
+            server = smtplib.SMTP_SSL(host, port, context=ctx, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(host, port, timeout=self.timeout)
+            server.starttls(context=ctx)
+        try:
+            server.login(user, password)
+        except Exception:
+            self._close(server)
+            raise
+        with self._lock:
+            self.opened += 1
+        return server
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _acquire(self, key):
+        while True:
+            with self._lock:
+                if not self.idle[key]:
+                    break
+                server, last_used = self.idle[key].pop()
+            idle = time.time() - last_used
+            if idle > self.idle_timeout:
+                self._close(server)
+                continue
+            if idle > self.check_after:
+                try:
+                    alive = server.noop()[0] == 250
+                except Exception:
+                    alive = False
+                if not alive:
+                    with self._lock:
+                        self.stale += 1
+                    self._close(server)
+                    continue
+            with self._lock:
+                self.reused += 1
+            return server
+        return self._connect(*key)
+
+    def _release(self, key, server):
+        now = time.time()
+        expired = []
+        with self._lock:
+            sessions = self.idle[key]
+            expired = [s for s, last_used in sessions if now - last_used > self.idle_timeout]
+            sessions[:] = [(s, last_used) for s, last_used in sessions if now - last_used <= self.idle_timeout]
+            sessions.append((server, now))
+        for stale in expired:
+            self._close(stale)
+
+    @contextmanager
+    def session(self, host, port, user, password, fresh=False):
+        """借出一个已登录的连接；fresh=True 时新建连接；块内抛出异常时连接关闭不再复用"""
+        key = (host, int(port), user, password)
+        server = self._connect(*key) if fresh else self._acquire(key)
+        try:
+            yield server
+        except Exception:
+            self._close(server)
+            raise
+        self._release(key, server)
+
+    def close_all(self):
+        with self._lock:
+            sessions = [server for servers in self.idle.values() for server, _ in servers]
+            self.idle.clear()
+        for server in sessions:
+            self._close(server)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "opened": self.opened,
+                "reused": self.reused,
+                "stale": self.stale,
+                "idle": sum(len(servers) for servers in self.idle.values())
+            }
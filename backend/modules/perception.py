@@ -1,30 +1,211 @@
 import os
-from ultralytics import YOLO
+import shutil
+import threading
+import time
+import weakref
+import zlib
+import cv2
+import numpy as np
+
+# 推理后端：torch 直接加载 .pt；onnx / openvino 由 .pt 导出后缓存到同目录；
+# int8 为训练后量化产物（modules.quantization），只在通过精度验证后存在，不会自动导出
+BACKENDS = ('torch', 'onnx', 'openvino', 'int8')
+_export_lock = threading.Lock()
+
+
+def export_artifact_path(weights_path, backend):
+    """导出产物的缓存位置：best.pt -> best.onnx / best_openvino_model/ / best_int8_openvino_model/"""
+    stem, _ = os.path.splitext(weights_path)
+    if backend == 'onnx':
+        return stem + '.onnx'
+    if backend == 'openvino':
+        return stem + '_openvino_model'
+    if backend == 'int8':
+        return stem + '_int8_openvino_model'
+    return weights_path
+
+
+def resolve_backend_weights(weights_path, backend, imgsz=640, fallback='torch'):
+    """
+    返回指定后端实际加载的权重路径；缓存不存在或比 .pt 旧时重新导出，失败则回退 torch
+    int8 没有可用的量化产物（未量化或未通过验证）时改用 fallback 后端
+    """
+    if backend not in BACKENDS:
+        print(f"[Perception] 未知推理后端 {backend}，回退到 torch")
+        return weights_path
+    if backend == 'torch':
+        return weights_path
+    artifact = export_artifact_path(weights_path, backend)
+    if backend == 'int8':
+        if os.path.exists(artifact) and os.path.getmtime(artifact) >= os.path.getmtime(weights_path):
+            return artifact
+        print(f"[Perception] 没有可用的 INT8 模型，使用 {fallback} 后端")
+        return resolve_backend_weights(weights_path, 'torch' if fallback == 'int8' else fallback, imgsz)
+    with _export_lock:
+        if os.path.exists(artifact) and os.path.getmtime(artifact) >= os.path.getmtime(weights_path):
+            return artifact
+        try:
+            from ultralytics import YOLO
+            print(f"[Perception] 导出 {backend} 模型: {weights_path}")
+            # dynamic=True 以支持微批推理的可变 batch
+            exported = YOLO(weights_path).export(format=backend, imgsz=imgsz, dynamic=True, verbose=False)
+            exported = str(exported)
+            if os.path.abspath(exported) != os.path.abspath(artifact):
+                if os.path.isdir(artifact):
+                    shutil.rmtree(artifact)
+                shutil.move(exported, artifact)
+            return artifact
+        except Exception as e:
+            print(f"[Perception] {backend} 导出失败，回退到 torch: {e}")
+            return weights_path
+
+
+def extract_detections(results, names):
+    """将 YOLO 结果转换为与模型无关的检测列表 [{"coords", "conf", "cls_name"}]"""
+    detections = []
+    for r in results:
+        for box in r.boxes:
+            coords = box.xyxy[0].cpu().numpy().astype(int)
+            detections.append({
+                "coords": coords.tolist(),
+                "conf": float(box.conf[0]),
+                "cls_name": names[int(box.cls[0])]
+            })
+    return detections
+
+
+def draw_detections(frame, detections, labels=None):
+    """在帧副本上绘制检测框；labels 为每个框的显示名称（缺省使用类别名）"""
+    annotated = frame.copy()
+    for i, det in enumerate(detections):
+        x1, y1, x2, y2 = det["coords"]
+        label = labels[i] if labels else det["cls_name"]
+        # 同一类别固定颜色
+        seed = zlib.crc32(label.encode('utf-8'))
+        color = (seed & 0xFF, (seed >> 8) & 0xFF, (seed >> 16) & 0xFF)
+        cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
+        text = f"{label} {det['conf']:.2f}"
+        (tw, th), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+        cv2.rectangle(annotated, (x1, max(0, y1 - th - 6)), (x1 + tw + 4, y1), color, -1)
+        cv2.putText(annotated, text, (x1 + 2, y1 - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    return annotated
+
+
+class ModelHandle:
+    """与 YOLO 模型调用方式兼容的句柄，每次调用都转发到 PerceptionModule 当前的模型，热替换后自动生效"""
+
+    def __init__(self, perception):
+        self.perception = perception
+
+    @property
+    def names(self):
+        return self.perception.load_model().names
+
+    def __call__(self, *args, **kwargs):
+        return self.perception.load_model()(*args, **kwargs)
+
 
 class PerceptionModule:
-    def __init__(self, model_path='yolov8n.pt'):
+    def __init__(self, model_path='yolov8n.pt', motion_gate=None, backend='torch', imgsz=640, fallback_backend='torch',
+                 warmup_runs=2):
         self.model_path = model_path
         self.model = None
+        self.motion_gate = motion_gate  # 可选的运动门控 (modules.motion.MotionGate)
+        self.backend = backend
+        self.fallback_backend = fallback_backend  # int8 模型不可用时使用的后端
+        self.imgsz = imgsz
+        self.warmup_runs = warmup_runs
+        self.version = 0  # 每次模型替换后加 1
+        self.children = weakref.WeakSet()  # spawn() 创建的独立实例，随本实例一起热替换
+        self._load_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def _build_model(self, model_path):
+        """加载权重并用空白帧预热，使首帧推理不再承担初始化开销"""
+        # ultralytics（连带 torch）导入需要数秒，放到加载模型时，Web 服务先启动
+        from ultralytics import YOLO
+        if os.path.exists(model_path):
+            print(f"[Perception] 加载自定义模型: {model_path}")
+            weights = model_path
+        else:
+            print("[Perception] 加载官方预训练模型: yolov8n.pt")
+            weights = 'yolov8n.pt'
+            if self.backend != 'torch' and not os.path.exists(weights):
+                # 先触发官方权重下载，再导出
+                YOLO(weights)
+        weights = resolve_backend_weights(weights, self.backend, self.imgsz, self.fallback_backend)
+        model = YOLO(weights, task='detect')
+        dummy = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+        started = time.time()
+        for _ in range(self.warmup_runs):
+            model(dummy, verbose=False)
+        print(f"[Perception] 模型预热完成，耗时 {time.time() - started:.2f}s")
+        return model
 
     def load_model(self):
-        """懒加载模型"""
+        """懒加载模型（后台预热进行中时等待其完成，不重复加载）"""
         if self.model is None:
-            if os.path.exists(self.model_path):
-                print(f"[Perception] 加载自定义模型: {self.model_path}")
-                self.model = YOLO(self.model_path)
-            else:
-                print("[Perception] 加载官方预训练模型: yolov8n.pt")
-                self.model = YOLO('yolov8n.pt')
+            with self._load_lock:
+                if self.model is None:
+                    self.model = self._build_model(self.model_path)
         return self.model
 
+    def warmup_async(self, on_ready=None):
+        """后台预加载并预热模型；on_ready(秒) 在加载完成后调用"""
+        def warmup():
+            started = time.time()
+            self.load_model()
+            if on_ready:
+                on_ready(time.time() - started)
+        thread = threading.Thread(target=self._safe_call, args=(warmup,), name="model-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def spawn(self):
+        """创建使用相同权重与后端的独立实例（供各推理线程使用），reload_async 时一起替换"""
+        child = PerceptionModule(self.model_path, backend=self.backend, imgsz=self.imgsz,
+                                 fallback_backend=self.fallback_backend, warmup_runs=self.warmup_runs)
+        self.children.add(child)
+        return child
+
+    def reload_async(self, new_path):
+        """后台加载并预热新权重，完成后在两帧之间原子替换；替换前旧模型继续服务"""
+        def reload():
+            with self._reload_lock:
+                model = self._build_model(new_path)
+                with self._load_lock:
+                    self.model_path = new_path
+                    self.model = model
+                    self.version += 1
+                print(f"[Perception] 模型已热替换 (version {self.version}): {new_path}")
+
+        for child in list(self.children):
+            child.reload_async(new_path)
+        thread = threading.Thread(target=self._safe_call, args=(reload,), name="model-reload", daemon=True)
+        thread.start()
+        return thread
+
     def update_model(self, new_path):
-        """更新模型路径并重置"""
-        self.model_path = new_path
-        self.model = None # 强制下次推理时重载
+        """更新模型：后台加载新权重后替换，推理不中断"""
+        return self.reload_async(new_path)
+
+    @staticmethod
+    def _safe_call(fn):
+        try:
+            fn()
+        except Exception as e:
+            print(f"[Perception] 模型加载失败: {e}")
+
+    def detect(self, frame, conf=0.3, iou=0.45, force=False):
+        """执行推理；配置了运动门控时，静止画面复用上次结果（force=True 或正在跟踪目标时总是推理）"""
+        if self.motion_gate is None:
+            return self._infer(frame, conf, iou)
+        last = self.motion_gate.last_result
+        tracking = last is not None and any(len(r.boxes) for r in last)
+        return self.motion_gate.run(frame, lambda: self._infer(frame, conf, iou), force=force or tracking)
 
-    def detect(self, frame, conf=0.3, iou=0.45):
-        """执行推理"""
+    def _infer(self, frame, conf, iou):
         model = self.load_model()
         # verbose=False 防止控制台刷屏
         results = model(frame, conf=conf, iou=iou, verbose=False)
-        return results
\ No newline at end of file
+        return results
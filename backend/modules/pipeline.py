@@ -0,0 +1,270 @@
+"""
+视频处理流水线模块
+将 采集 → 推理 → 标注/编码 → MJPEG 输出 拆分为独立线程，
+阶段之间使用有界队列，队列满时丢弃最旧帧，保证端到端延迟有上限
+"""
+
+import threading
+import time
+from collections import deque
+
+import cv2
+
+from modules.frame_ring import RingReader, pixels, release
+
+
+class DropOldestQueue:
+    """有界队列：写满时丢弃最旧元素，读端永远拿到最新的数据；on_drop(item) 在元素被丢弃或清空时调用"""
+
+    def __init__(self, maxsize=2, on_drop=None):
+        self.maxsize = max(1, int(maxsize))
+        self.on_drop = on_drop
+        self.dropped = 0
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                dropped = self._items.popleft()
+                self.dropped += 1
+                if self.on_drop:
+                    self.on_drop(dropped)
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """取出最旧的元素，超时返回 None"""
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def clear(self):
+        with self._cond:
+            items = list(self._items)
+            self._items.clear()
+        if self.on_drop:
+            for item in items:
+                self.on_drop(item)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+
+class StageStats:
+    """单个阶段的吞吐统计（滑动窗口 FPS + 平均耗时）"""
+
+    def __init__(self, name, window_seconds=2.0):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.processed = 0
+        self._busy_total = 0.0
+        self._stamps = deque()
+        self._lock = threading.Lock()
+
+    def tick(self, busy_seconds=0.0):
+        now = time.time()
+        with self._lock:
+            self.processed += 1
+            self._busy_total += busy_seconds
+            self._stamps.append(now)
+            while self._stamps and now - self._stamps[0] > self.window_seconds:
+                self._stamps.popleft()
+
+    def snapshot(self, dropped=0):
+        now = time.time()
+        with self._lock:
+            while self._stamps and now - self._stamps[0] > self.window_seconds:
+                self._stamps.popleft()
+            fps = len(self._stamps) / self.window_seconds
+            avg_ms = (self._busy_total / self.processed * 1000) if self.processed else 0
+            return {
+                "stage": self.name,
+                "fps": round(fps, 1),
+                "processed": self.processed,
+                "avg_ms": round(avg_ms, 1),
+                "dropped": dropped
+            }
+
+
+class FramePipeline:
+    """
+    分阶段视频流水线
+    - open_capture(): 返回 cv2.VideoCapture
+    - infer(frame): 推理并返回分析结果（任意对象）
+    - annotate(frame, analysis): 返回绘制后的 BGR 帧
+    - on_capture(frame): 每个采集到的原始帧的回调（例如证据缓冲）
+    - is_paused(): 返回 True 时采集阶段暂停读帧
+    - motion_gate / stride: 推理阶段使用的运动门控与跨帧检测，仅用于统计
+    - ring_slots: 共享内存帧环的槽位数；设置后采集直接解码进帧环，
+      on_capture 收到 FrameSlot 句柄（需要保留时调用 retain），infer / annotate 收到槽内像素
+    """
+
+    def __init__(self, open_capture, infer, annotate, on_capture=None, is_paused=None,
+                 loop=False, queue_size=2, jpeg_quality=80, motion_gate=None, stride=None, ring_slots=None):
+        self.open_capture = open_capture
+        self.infer = infer
+        self.annotate = annotate
+        self.on_capture = on_capture
+        self.is_paused = is_paused or (lambda: False)
+        self.loop = loop
+        self.motion_gate = motion_gate
+        self.stride = stride
+        self.jpeg_params = [int(cv2.IMWRITE_JPEG_QUALITY), int(jpeg_quality)]
+
+        # 帧环槽位至少覆盖流水线内同时存在的帧：两个队列 + 推理、编码中各一帧 + 采集中一帧
+        self.reader = RingReader(max(int(ring_slots), 2 * queue_size + 3)) if ring_slots else None
+        self.infer_queue = DropOldestQueue(queue_size, on_drop=release)
+        self.encode_queue = DropOldestQueue(queue_size, on_drop=lambda item: release(item[0]))
+        self.output_queue = DropOldestQueue(queue_size)
+        self.stats_by_stage = {
+            "capture": StageStats("capture"),
+            "inference": StageStats("inference"),
+            "encode": StageStats("encode"),
+            "output": StageStats("output")
+        }
+
+        self.stop_event = threading.Event()
+        self.capture_done = threading.Event()
+        self.inference_done = threading.Event()
+        self.threads = []
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        for name, target in (("capture", self._capture_loop),
+                             ("inference", self._inference_loop),
+                             ("encode", self._encode_loop)):
+            t = threading.Thread(target=target, name=f"pipeline-{name}", daemon=True)
+            t.start()
+            self.threads.append(t)
+        return self
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        for t in self.threads:
+            if t is not threading.current_thread():
+                t.join(timeout)
+        self.threads = []
+        self.infer_queue.clear()
+        self.encode_queue.clear()
+        if self.reader is not None:
+            self.reader.close()
+
+    def is_alive(self):
+        """采集、推理均结束且所有队列排空后视为结束"""
+        if self.stop_event.is_set():
+            return False
+        if not self.inference_done.is_set():
+            return True
+        return bool(len(self.infer_queue) or len(self.encode_queue) or len(self.output_queue))
+
+    # ---------- 输出 ----------
+    def next_jpeg(self, timeout=1.0):
+        """取出下一帧 JPEG 字节，超时返回 None"""
+        item = self.output_queue.get(timeout)
+        if item is None:
+            return None
+        self.stats_by_stage["output"].tick()
+        return item
+
+    def stats(self):
+        inference = self.stats_by_stage["inference"].snapshot(self.infer_queue.dropped)
+        if self.motion_gate is not None:
+            inference["motion"] = self.motion_gate.stats()
+        if self.stride is not None:
+            inference["stride"] = self.stride.stats()
+        capture = self.stats_by_stage["capture"].snapshot()
+        if self.reader is not None:
+            capture["ring"] = self.reader.stats()
+        return [
+            capture,
+            inference,
+            self.stats_by_stage["encode"].snapshot(self.encode_queue.dropped),
+            self.stats_by_stage["output"].snapshot(self.output_queue.dropped)
+        ]
+
+    # ---------- 各阶段线程 ----------
+    def _capture_loop(self):
+        cap = None
+        try:
+            cap = self.open_capture()
+            # 文件源按原始帧率播放，避免采集线程把整段视频快进读完
+            file_fps = cap.get(cv2.CAP_PROP_FPS) if self.loop else 0
+            frame_interval = 1.0 / file_fps if file_fps and file_fps > 0 else 0
+            stats = self.stats_by_stage["capture"]
+            while cap.isOpened() and not self.stop_event.is_set():
+                if self.is_paused():
+                    time.sleep(0.1)
+                    continue
+                started = time.time()
+                if self.reader is not None:
+                    success, frame = self.reader.read(cap)
+                else:
+                    success, frame = cap.read()
+                if not success:
+                    if self.loop:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        continue
+                    break
+                if self.on_capture:
+                    self.on_capture(frame)
+                self.infer_queue.put(frame)
+                stats.tick(time.time() - started)
+                if frame_interval:
+                    remaining = frame_interval - (time.time() - started)
+                    if remaining > 0:
+                        time.sleep(remaining)
+        except Exception as e:
+            print(f"[Pipeline] 采集阶段异常: {e}")
+        finally:
+            if cap is not None and cap.isOpened():
+                cap.release()
+            self.capture_done.set()
+
+    def _inference_loop(self):
+        stats = self.stats_by_stage["inference"]
+        try:
+            while not self.stop_event.is_set():
+                frame = self.infer_queue.get(timeout=0.2)
+                if frame is None:
+                    if self.capture_done.is_set():
+                        break
+                    continue
+                started = time.time()
+                try:
+                    analysis = self.infer(pixels(frame))
+                except Exception as e:
+                    print(f"[Pipeline] 推理阶段异常: {e}")
+                    release(frame)
+                    continue
+                self.encode_queue.put((frame, analysis))
+                stats.tick(time.time() - started)
+        finally:
+            # 推理线程退出后编码线程才能收尾，否则正在推理的最后一帧会丢失
+            self.inference_done.set()
+
+    def _encode_loop(self):
+        stats = self.stats_by_stage["encode"]
+        while not self.stop_event.is_set():
+            item = self.encode_queue.get(timeout=0.2)
+            if item is None:
+                if self.inference_done.is_set() and not len(self.encode_queue):
+                    break
+                continue
+            started = time.time()
+            frame, analysis = item
+            try:
+                annotated = self.annotate(pixels(frame), analysis)
+                ok, buffer = cv2.imencode('.jpg', annotated, self.jpeg_params)
+            except Exception as e:
+                print(f"[Pipeline] 编码阶段异常: {e}")
+                continue
+            finally:
+                release(frame)
+            if ok:
+                self.output_queue.put(buffer.tobytes())
+            stats.tick(time.time() - started)
@@ -0,0 +1,109 @@
+"""
+证据片段预览图模块
+- 封面 (poster): 跌倒发生时刻的一帧，缩放到 poster_width 以内的 JPEG
+- 拖动预览图 (sprite): count 张均匀分布的缩略图拼成一张 JPEG，附带每张缩略图对应的时间点
+片段编码时由 ThumbnailSampler 顺带抽取缩略图，不需要再次解码视频；没有预览图的旧片段可用 preview_from_file 补生成
+"""
+
+import math
+
+import cv2
+import numpy as np
+
+
+def _scale_to_width(image, width):
+    height, src_width = image.shape[:2]
+    if src_width <= width:
+        return image
+    return cv2.resize(image, (width, max(1, round(height * width / src_width))), interpolation=cv2.INTER_AREA)
+
+
+class ThumbnailSampler:
+    """
+    编码过程中按步长保留缩略图；数量达到 2*count 时丢弃一半并加倍步长，
+    内存上限约 2*count 张缩略图，与片段长度无关
+    """
+
+    def __init__(self, count=10, width=160):
+        self.count = max(1, int(count))
+        self.width = int(width)
+        self.stride = 1
+        self.index = 0
+        self.thumbs = []  # (帧序号, 缩略图)
+
+    def add(self, image):
+        if self.index % self.stride == 0:
+            self.thumbs.append((self.index, _scale_to_width(image, self.width)))
+            if len(self.thumbs) >= 2 * self.count:
+                self.thumbs = self.thumbs[::2]
+                self.stride *= 2
+        self.index += 1
+
+    def pick(self):
+        """从已保留的缩略图中均匀取 count 张"""
+        if len(self.thumbs) <= self.count:
+            return list(self.thumbs)
+        step = len(self.thumbs) / self.count
+        return [self.thumbs[int(i * step)] for i in range(self.count)]
+
+
+def encode_poster(image, width=640, quality=85):
+    ok, data = cv2.imencode('.jpg', _scale_to_width(image, width), [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return data.tobytes() if ok else None
+
+
+def compose_sprite(thumbs, fps, columns=5, quality=75):
+    """
+    thumbs: [(帧序号, 缩略图)] -> (JPEG 字节, 元数据)
+    元数据记录网格尺寸和每张缩略图的时间点（秒），前端按时间点定位到对应格子
+    """
+    if not thumbs:
+        return None, None
+    height, width = thumbs[0][1].shape[:2]
+    columns = min(columns, len(thumbs))
+    rows = math.ceil(len(thumbs) / columns)
+    sheet = np.zeros((rows * height, columns * width, 3), dtype=np.uint8)
+    for i, (_, thumb) in enumerate(thumbs):
+        row, col = divmod(i, columns)
+        # 分辨率变化的片段中个别缩略图尺寸可能不同
+        if thumb.shape[:2] != (height, width):
+            thumb = cv2.resize(thumb, (width, height), interpolation=cv2.INTER_AREA)
+        sheet[row * height:(row + 1) * height, col * width:(col + 1) * width] = thumb
+    ok, data = cv2.imencode('.jpg', sheet, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    if not ok:
+        return None, None
+    meta = {
+        "count": len(thumbs),
+        "columns": columns,
+        "rows": rows,
+        "thumb_width": width,
+        "thumb_height": height,
+        "times": [round(index / fps, 2) if fps else 0 for index, _ in thumbs]
+    }
+    return data.tobytes(), meta
+
+
+def preview_from_file(video_path, count=10, width=160, poster_width=640, poster_position=0.5):
+    """解码整个片段生成预览图（补生成旧片段用），返回 {"poster", "sprite", "sprite_meta"}，失败返回 None"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    poster_index = int(total * poster_position)
+    sampler = ThumbnailSampler(count, width)
+    poster = None
+    try:
+        while True:
+            success, frame = cap.read()
+            if not success:
+                break
+            if sampler.index == poster_index or poster is None:
+                poster = frame
+            sampler.add(frame)
+    finally:
+        cap.release()
+    if poster is None:
+        return None
+    sprite, meta = compose_sprite(sampler.pick(), fps)
+    return {"poster": encode_poster(poster, poster_width), "sprite": sprite, "sprite_meta": meta}
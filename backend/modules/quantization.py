@@ -0,0 +1,107 @@
+"""
+INT8 训练后量化模块
+用训练集的一部分样本做校准，把 best.pt 导出为 OpenVINO INT8 模型；
+在验证集上比较 mAP50 和 CPU 单帧延迟，mAP50 下降超过容差时拒绝启用量化模型
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from ultralytics import YOLO
+
+from modules.perception import export_artifact_path
+
+
+def evaluate_map50(weights_path, data_path, imgsz=640):
+    """在数据集的验证集上评估 mAP50"""
+    model = YOLO(weights_path, task='detect')
+    metrics = model.val(data=data_path, split='val', imgsz=imgsz, device='cpu', plots=False, verbose=False)
+    return round(float(metrics.box.map50), 4)
+
+
+def measure_latency(weights_path, imgsz=640, runs=30, warmup=5):
+    """CPU 单帧推理延迟中位数（毫秒）"""
+    model = YOLO(weights_path, task='detect')
+    frame = np.random.default_rng(0).integers(0, 255, (imgsz, imgsz, 3), dtype=np.uint8)
+    timings = []
+    for i in range(warmup + runs):
+        started = time.perf_counter()
+        model(frame, imgsz=imgsz, device='cpu', verbose=False)
+        if i >= warmup:
+            timings.append(time.perf_counter() - started)
+    return round(float(np.median(timings)) * 1000, 2)
+
+
+def export_int8(weights_path, data_path, imgsz=640, fraction=0.1):
+    """用训练集中 fraction 比例的图片做校准，导出 INT8 模型到权重同目录的 <stem>_int8_openvino_model/"""
+    artifact = export_artifact_path(weights_path, 'int8')
+    exported = str(YOLO(weights_path).export(format='openvino', int8=True, data=data_path, fraction=fraction,
+                                             imgsz=imgsz, dynamic=True, verbose=False))
+    if os.path.abspath(exported) != os.path.abspath(artifact):
+        if os.path.isdir(artifact):
+            shutil.rmtree(artifact)
+        shutil.move(exported, artifact)
+    return artifact
+
+
+def quantize_model(weights_path, data_path, imgsz=640, max_map_drop=0.01, fraction=0.1):
+    """
+    量化并验证，返回写入训练日志的报告；
+    先导出到权重同目录下的临时目录，验证通过后才移动到 best_int8_openvino_model/，
+    mAP50 下降（绝对值）超过 max_map_drop 或验证出错时丢弃临时产物，服务继续使用原后端
+    """
+    report = {
+        "format": "openvino-int8",
+        "calibration_fraction": fraction,
+        "max_map_drop": max_map_drop,
+        "promoted": False
+    }
+    started = time.time()
+    artifact = export_artifact_path(weights_path, 'int8')
+    # 临时目录与正式产物在同一文件系统，验证通过后原子改名；resolve_backend_weights 只看产物修改时间，
+    # 未通过验证的模型不能出现在正式路径上
+    staging_dir = tempfile.mkdtemp(prefix='.quantize_', dir=os.path.dirname(os.path.abspath(weights_path)))
+    try:
+        try:
+            staged_weights = os.path.join(staging_dir, os.path.basename(weights_path))
+            shutil.copy2(weights_path, staged_weights)
+            staged = export_int8(staged_weights, data_path, imgsz, fraction)
+            fp32_map50 = evaluate_map50(weights_path, data_path, imgsz)
+            int8_map50 = evaluate_map50(staged, data_path, imgsz)
+            fp32_ms = measure_latency(weights_path, imgsz)
+            int8_ms = measure_latency(staged, imgsz)
+        except Exception as e:
+            print(f"[Quantize] 量化失败: {e}")
+            report["error"] = str(e)
+            return report
+
+        map_drop = round(fp32_map50 - int8_map50, 4)
+        report.update({
+            "fp32_map50": fp32_map50,
+            "int8_map50": int8_map50,
+            "map50_drop": map_drop,
+            "fp32_latency_ms": fp32_ms,
+            "int8_latency_ms": int8_ms,
+            "speedup": round(fp32_ms / int8_ms, 2) if int8_ms else 0,
+            "duration_seconds": round(time.time() - started, 1)
+        })
+        if map_drop > max_map_drop:
+            print(f"[Quantize] mAP50 下降 {map_drop} 超过容差 {max_map_drop}，不启用 INT8 模型")
+            report["reason"] = "map50_drop_exceeds_tolerance"
+            return report
+
+        if os.path.isdir(artifact):
+            shutil.rmtree(artifact)
+        os.replace(staged, artifact)
+        # 改名不更新目录自身的修改时间，显式刷新以确保不早于 best.pt
+        os.utime(artifact)
+        print(f"[Quantize] INT8 模型已启用: mAP50 {fp32_map50} -> {int8_map50}, "
+              f"延迟 {fp32_ms}ms -> {int8_ms}ms")
+        report["promoted"] = True
+        report["artifact"] = artifact
+        return report
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
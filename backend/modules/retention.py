@@ -0,0 +1,262 @@
+"""
+证据保留与存储统计模块
+- StorageUsage: 启动时统计一次本地证据目录与 GridFS 的占用，之后随写入/删除增量更新
+- RetentionWorker: 后台按 storage.autoClean 删除过期片段、截图及 GridFS 文件，
+  超出配额或磁盘剩余空间不足时从最旧的片段开始清理；每批数量有限并在批次间暂停，避免冲击数据库和磁盘
+"""
+
+import os
+import re
+import shutil
+import threading
+from datetime import datetime, timedelta
+
+GB = 1024 ** 3
+_DURATION_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+def parse_duration(value):
+    """"30d" / "12h" / "2w" -> 秒数；"never"、"off"、空值或无法解析时返回 None（不清理）"""
+    if value is None:
+        return None
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([mhdw]?)\s*", str(value).lower())
+    if not match:
+        return None
+    seconds = float(match.group(1)) * _DURATION_UNITS.get(match.group(2) or "d")
+    return seconds if seconds > 0 else None
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024.0
+
+
+class StorageUsage:
+    """证据占用计数器（字节），分为 local（本地证据目录）与 gridfs 两类"""
+
+    def __init__(self):
+        self.bytes = {"local": 0, "gridfs": 0}
+        self.initialized = False
+        self._lock = threading.Lock()
+
+    def scan(self, save_dir, db=None):
+        """全量统计一次，作为增量计数的起点"""
+        local = 0
+        try:
+            for root, _, files in os.walk(save_dir):
+                for name in files:
+                    try:
+                        local += os.path.getsize(os.path.join(root, name))
+                    except OSError:
+                        pass
+        except OSError as e:
+            print(f"[Retention] 统计本地证据目录失败: {e}")
+        gridfs = 0
+        if db is not None:
+            try:
+                result = list(db.fs.files.aggregate([{"$group": {"_id": None, "total": {"$sum": "$length"}}}]))
+                gridfs = int(result[0]["total"]) if result else 0
+            except Exception as e:
+                print(f"[Retention] 统计 GridFS 占用失败: {e}")
+        with self._lock:
+            self.bytes = {"local": local, "gridfs": gridfs}
+            self.initialized = True
+
+    def add(self, kind, size):
+        with self._lock:
+            self.bytes[kind] = self.bytes.get(kind, 0) + int(size or 0)
+
+    def remove(self, kind, size):
+        with self._lock:
+            self.bytes[kind] = max(0, self.bytes.get(kind, 0) - int(size or 0))
+
+    @property
+    def total(self):
+        with self._lock:
+            return sum(self.bytes.values())
+
+    def snapshot(self, quota_bytes):
+        """返回设置页使用的占用信息"""
+        with self._lock:
+            detail = dict(self.bytes)
+        used = sum(detail.values())
+        return {
+            "used": format_bytes(used),
+            "total": format_bytes(quota_bytes),
+            "percentage": min(100, round(used * 100 / quota_bytes)) if quota_bytes else 0,
+            "bytes": {**detail, "used": used, "quota": int(quota_bytes)}
+        }
+
+
+# 全局计数器：StorageModule 写入/删除时更新，设置接口读取
+storage_usage = StorageUsage()
+
+
+def quota_bytes(settings):
+    return float(settings.get("quotaGB", 10) or 0) * GB
+
+
+class RetentionWorker:
+    """
+    - get_settings(): 返回 storage 配置分组（每轮重新读取，设置修改无需重启）
+    - interval: 常规检查周期（秒）；StorageModule 写入新片段后调用 notify() 可提前触发
+    - batch_size / batch_pause: 每批删除的记录数与批次间隔
+    - high_watermark / low_watermark: 占用超过配额的 high 比例时清理到 low 比例
+    """
+
+    def __init__(self, storage, get_settings, interval=600, batch_size=50, batch_pause=1.0,
+                 high_watermark=0.95, low_watermark=0.85):
+        self.storage = storage
+        self.get_settings = get_settings
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.deleted = 0
+        self.last_run = None
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, name="retention", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+
+    def notify(self):
+        """有新证据写入：若已接近配额则尽快清理"""
+        settings = self.get_settings()
+        if self._over(settings, self.high_watermark):
+            self.wake_event.set()
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[Retention] 清理异常: {e}")
+            self.wake_event.wait(self.interval)
+            self.wake_event.clear()
+
+    # ---------- 清理 ----------
+    def run_once(self):
+        settings = self.get_settings()
+        self.last_run = datetime.now()
+        max_age = parse_duration(settings.get("autoClean"))
+        if max_age:
+            cutoff = datetime.now() - timedelta(seconds=max_age)
+            self._expire_records(cutoff)
+            self._expire_snapshots(cutoff)
+            self._expire_local_files(cutoff.timestamp())
+        if self._over(settings, self.high_watermark):
+            self._enforce_quota(settings)
+
+    def _over(self, settings, ratio):
+        """占用超过配额的 ratio 比例，或磁盘剩余空间低于 minFreeGB"""
+        quota = quota_bytes(settings)
+        if quota and storage_usage.total > quota * ratio:
+            return True
+        min_free = float(settings.get("minFreeGB", 1) or 0) * GB
+        try:
+            return min_free > 0 and shutil.disk_usage(self.storage.save_dir).free < min_free * (2 - ratio)
+        except OSError:
+            return False
+
+    def _pause(self):
+        self.stop_event.wait(self.batch_pause)
+
+    def _delete(self, record_id):
+        ok, message = self.storage.delete_record(record_id)
+        if ok:
+            self.deleted += 1
+        else:
+            print(f"[Retention] 删除 {record_id} 失败: {message}")
+        return ok
+
+    def _expire_records(self, cutoff):
+        db = self.storage.db
+        if db is None:
+            return
+        # history.timestamp 为 "YYYY-MM-DD HH:MM:SS" 字符串，可直接按字典序比较
+        bound = cutoff.strftime("%Y-%m-%d %H:%M:%S")
+        # 删除失败的记录仍满足查询条件，本轮排除这些 id，否则下一批会反复取到同一批记录
+        failed = []
+        while not self.stop_event.is_set():
+            query = {"timestamp": {"$lt": bound}}
+            if failed:
+                query["_id"] = {"$nin": failed}
+            batch = list(db.history.find(query, {"_id": 1}).limit(self.batch_size))
+            if not batch:
+                return
+            removed = 0
+            for doc in batch:
+                if self._delete(str(doc["_id"])):
+                    removed += 1
+                else:
+                    failed.append(doc["_id"])
+            print(f"[Retention] 已清理 {removed} 条过期视频记录")
+            if not removed:
+                print("[Retention] 本批过期记录全部删除失败，停止本轮清理")
+                return
+            self._pause()
+
+    def _expire_snapshots(self, cutoff):
+        db = self.storage.db
+        if db is None:
+            return
+        while not self.stop_event.is_set():
+            batch = list(db.alarm_snapshots.find({"created_at": {"$lt": cutoff}}, {"filename": 1}).limit(self.batch_size))
+            if not batch:
+                return
+            for doc in batch:
+                self.storage.delete_local_file(doc.get("filename", ""))
+            db.alarm_snapshots.delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}})
+            self._pause()
+
+    def _expire_local_files(self, cutoff_ts):
+        """数据库未记录的本地片段与截图（离线期间生成或保留的本地副本）按修改时间清理"""
+        expired = []
+        for directory in (self.storage.save_dir, self.storage.archive_dir):
+            if not os.path.isdir(directory):
+                continue
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_file() and entry.name.endswith(('.mp4', '.jpg')) and entry.stat().st_mtime < cutoff_ts:
+                            expired.append(entry.name)
+            except OSError as e:
+                print(f"[Retention] 扫描本地证据目录失败: {e}")
+                return
+        for start in range(0, len(expired), self.batch_size):
+            if self.stop_event.is_set():
+                return
+            for name in expired[start:start + self.batch_size]:
+                self.storage.delete_local_file(name)
+            self._pause()
+
+    def _enforce_quota(self, settings):
+        """从最旧的片段开始清理，直到占用回落到配额的 low_watermark 以下"""
+        print(f"[Retention] 存储占用超限，开始清理最旧的证据")
+        while not self.stop_event.is_set() and self._over(settings, self.low_watermark):
+            oldest = self.storage.get_oldest_records(self.batch_size)
+            if not oldest:
+                print("[Retention] 已无可清理的证据")
+                return
+            before = storage_usage.total
+            for record_id in oldest:
+                if not self._over(settings, self.low_watermark):
+                    return
+                self._delete(record_id)
+            if storage_usage.total >= before:
+                # 删除未释放任何空间（记录与文件不一致），避免空转
+                print("[Retention] 清理未释放空间，停止本轮配额清理")
+                return
+            self._pause()
@@ -4,10 +4,11 @@
 """
 
 from flask import Blueprint, jsonify, request
-import pymongo
 from datetime import datetime
 import os
 from modules.auth import has_role
+from modules.retention import storage_usage, quota_bytes
+from modules.db import get_db, mongo
 
 settings_bp = Blueprint('settings', __name__, url_prefix='/api/settings')
 
@@ -16,19 +17,17 @@ mongo_client = None
 db = None
 
 def init_db():
-    """初始化数据库连接"""
+    """初始化数据库连接（共享 modules.db 的连接池，可用状态变化时重新调用）"""
     global mongo_client, db
-    try:
-        mongo_client = pymongo.MongoClient("mongodb://localhost:27017/", serverSelectionTimeoutMS=2000)
-        db = mongo_client["fall_detection_db"]
-        mongo_client.server_info()
+    db = get_db()
+    mongo_client = mongo.client if db is not None else None
+    if db is not None:
         print("[Settings] ✅ MongoDB 连接成功")
-    except Exception as e:
-        print(f"[Settings] ❌ MongoDB 连接失败: {e}")
-        db = None
+    else:
+        print(f"[Settings] ❌ MongoDB 连接失败: {mongo.last_error}")
 
-# 初始化数据库
-init_db()
+# 数据库在 app 启动时统一连接（modules.db.mongo.connect）
+mongo.on_connect(init_db)
 
 # 默认配置
 DEFAULT_SETTINGS = {
@@ -46,7 +45,18 @@ DEFAULT_SETTINGS = {
         "beforeSeconds": 3,
         "afterSeconds": 2,
         "path": "",
-        "autoClean": "30d"
+        "autoClean": "30d",
+        "bufferCodec": "raw",
+        "keepLocalCopy": False,
+        "quotaGB": 10,
+        "minFreeGB": 1,
+        "tiering": True,
+        "warmAfter": "3d",
+        "warmHeight": 480,
+        "warmFps": 10,
+        "coldAfter": "14d",
+        "coldHeight": 360,
+        "coldFps": 2
     },
     "system": {
         "language": "zh-CN",
@@ -58,12 +68,50 @@ DEFAULT_SETTINGS = {
     },
     "advanced": {
         "gpu": False,
+        "backend": "torch",
         "workers": 4,
-        "apiUrl": "http://localhost:5000"
+        "processPool": False,
+        "apiUrl": "http://localhost:5000",
+        "multiCamera": False,
+        "batchSize": 4,
+        "batchDeadlineMs": 15,
+        "motionGate": True,
+        "motionRefreshSeconds": 5,
+        "adaptiveStride": False,
+        "maxStride": 4,
+        "maxAlarmLatencyMs": 300,
+        "quantize": False,
+        "quantizeMaxMapDrop": 0.01,
+        "quantizeCalibrationFraction": 0.1
+    },
+    "notification": {
+        "dryRun": False,
+        "emailWorkers": 2,
+        "smsWorkers": 4,
+        "queueSize": 500,
+        "maxAttempts": 4,
+        "retryBaseSeconds": 2,
+        "rateLimit": 10,
+        "rateWindowSeconds": 600,
+        "emailDigestSeconds": 0,
+        "smsBatchSize": 100
     }
 }
 
 
+def get_settings_section(section):
+    """读取某个配置分组（数据库优先，缺失字段回退到默认值），供其他模块在运行时使用"""
+    defaults = DEFAULT_SETTINGS.get(section, {})
+    if db is None:
+        return dict(defaults)
+    try:
+        saved_config = db.system_config.find_one({"key": "main_settings"}) or {}
+        return {**defaults, **(saved_config.get(section) or {})}
+    except Exception as e:
+        print(f"[Settings] 读取配置分组 {section} 失败: {e}")
+        return dict(defaults)
+
+
 @settings_bp.route('', methods=['GET', 'POST'])
 def system_settings():
     """获取或更新系统配置"""
@@ -129,7 +177,8 @@ def system_settings():
                     "detection": saved_config.get("detection", DEFAULT_SETTINGS["detection"]),
                     "storage": saved_config.get("storage", DEFAULT_SETTINGS["storage"]),
                     "system": saved_config.get("system", DEFAULT_SETTINGS["system"]),
-                    "advanced": saved_config.get("advanced", DEFAULT_SETTINGS["advanced"])
+                    "advanced": saved_config.get("advanced", DEFAULT_SETTINGS["advanced"]),
+                    "notification": saved_config.get("notification", DEFAULT_SETTINGS["notification"])
                 }
                 config["storage"]["path"] = evidence_dir
             else:
@@ -183,7 +232,7 @@ def detection_settings():
 
 @settings_bp.route('/storage', methods=['GET', 'POST'])
 def storage_settings():
-    """存储配置"""
+    """存储配置（占用信息来自 modules.retention 的实时统计）"""
     allowed, _ = has_role(request, 'admin')
     if not allowed:
         return jsonify({"success": False, "message": "仅管理员可访问存储配置"}), 403
@@ -207,41 +256,17 @@ def storage_settings():
             return jsonify({
                 "success": True,
                 "message": "存储配置已更新",
-                "usage": {
-                    "used": "2.3 GB",
-                    "total": "10 GB",
-                    "percentage": 23
-                }
+                "usage": storage_usage.snapshot(quota_bytes({**DEFAULT_SETTINGS["storage"], **(settings or {})}))
             })
         except Exception as e:
             return jsonify({"success": False, "message": str(e)}), 500
     else:
-        if db is None:
-            return jsonify({
-                **DEFAULT_SETTINGS["storage"],
-                "path": evidence_dir,
-                "usage": {"used": "0 GB", "total": "10 GB", "percentage": 0}
-            })
-        
-        try:
-            config = db.system_config.find_one({"key": "main_settings"})
-            storage = config.get("storage", DEFAULT_SETTINGS["storage"]) if config else DEFAULT_SETTINGS["storage"]
-            
-            return jsonify({
-                **storage,
-                "path": evidence_dir,
-                "usage": {
-                    "used": "2.3 GB",
-                    "total": "10 GB",
-                    "percentage": 23
-                }
-            })
-        except Exception as e:
-            return jsonify({
-                **DEFAULT_SETTINGS["storage"],
-                "path": evidence_dir,
-                "usage": {"used": "0 GB", "total": "10 GB", "percentage": 0}
-            })
+        storage = get_settings_section("storage")
+        return jsonify({
+            **storage,
+            "path": evidence_dir,
+            "usage": storage_usage.snapshot(quota_bytes(storage))
+        })
 
 
 @settings_bp.route('/backup', methods=['POST'])
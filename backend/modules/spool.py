@@ -0,0 +1,243 @@
+"""
+数据库离线写入缓冲 (spool)
+MongoDB 不可用时，报警、视频记录、审计 / 通知日志等写操作追加到本地 SQLite（WAL 模式），检测流程不受影响；
+后台重放线程按退避间隔探测 modules.db 的共享连接，恢复后按写入顺序分批重放
+
+- spooled_write(db, collection, op, ...): 替代 db[collection].op(...)，离线、熔断中或 spool 尚未排空时写入 spool，保证顺序
+- replayer.register_handler(op, handler): 需要额外处理的操作（例如视频片段上传 GridFS）
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from bson import ObjectId, json_util
+from pymongo.errors import ConnectionFailure, DuplicateKeyError
+
+from modules.db import get_db, mongo
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPOOL_PATH = os.path.join(BACKEND_DIR, 'spool', 'events.db')
+# 可直接重放的集合操作
+COLLECTION_OPS = ("insert_one", "insert_many", "update_one", "update_many", "delete_one", "delete_many")
+
+
+def _dumps(value):
+    # canonical 模式保留 datetime / ObjectId / int64 类型
+    return json_util.dumps(value, json_options=json_util.CANONICAL_JSON_OPTIONS)
+
+
+def _loads(text):
+    return json_util.loads(text, json_options=json_util.CANONICAL_JSON_OPTIONS)
+
+
+class EventSpool:
+    """只追加的本地写入日志，按自增 id 保持顺序；重放成功后删除"""
+
+    def __init__(self, path=SPOOL_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self.pending = 0
+
+    def _connection(self):
+        # 首次写入时才创建文件，数据库一直可用时不产生 spool 文件
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, collection TEXT, op TEXT, payload TEXT, created_at REAL)")
+            self.pending = self._conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        return self._conn
+
+    def open_existing(self):
+        """启动时加载上次未重放完的记录"""
+        if os.path.exists(self.path):
+            with self._lock:
+                self._connection()
+        return self.pending
+
+    def append(self, collection, op, payload):
+        with self._lock:
+            self._connection().execute(
+                "INSERT INTO events (collection, op, payload, created_at) VALUES (?, ?, ?, ?)",
+                (collection, op, _dumps(payload), time.time()))
+            self.pending += 1
+
+    def read_batch(self, limit):
+        with self._lock:
+            if self._conn is None:
+                return []
+            rows = self._conn.execute(
+                "SELECT id, collection, op, payload FROM events ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(row_id, collection, op, _loads(payload)) for row_id, collection, op, payload in rows]
+
+    def remove(self, ids):
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM events WHERE id = ?", [(row_id,) for row_id in ids])
+            self.pending = max(0, self.pending - len(ids))
+
+
+class SpoolReplayer:
+    """
+    - batch_size: 每批重放的记录数，批次之间短暂停顿，避免恢复瞬间压垮数据库
+    - min_delay / max_delay: 重连退避间隔（秒），每次失败翻倍
+    """
+
+    def __init__(self, spool, batch_size=100, batch_pause=0.05, min_delay=1.0, max_delay=60.0):
+        self.spool = spool
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.db = None
+        self.handlers = {}  # 操作 -> [handler]
+        self._handlers_lock = threading.Lock()
+        self.replayed = 0
+        self.dropped = 0
+        self.last_error = None
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            if self.spool.open_existing():
+                print(f"[Spool] 发现 {self.spool.pending} 条未重放的离线记录")
+            self.thread = threading.Thread(target=self._loop, name="spool-replayer", daemon=True)
+            self.thread.start()
+            # 数据库恢复时立即开始重放
+            mongo.subscribe(self.notify)
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+
+    def notify(self):
+        self.wake_event.set()
+
+    def register_handler(self, op, handler):
+        """
+        handler(payload) 负责重放自定义操作；抛出 ConnectionFailure 表示稍后重试
+        同一操作可由多个对象登记，使用最早登记且仍未注销的那个
+        """
+        with self._handlers_lock:
+            handlers = self.handlers.setdefault(op, [])
+            if handler not in handlers:
+                handlers.append(handler)
+
+    def unregister_handler(self, op, handler):
+        """登记处理函数的对象关闭前调用，之后由其余登记者接手"""
+        with self._handlers_lock:
+            handlers = self.handlers.get(op, [])
+            if handler in handlers:
+                handlers.remove(handler)
+
+    # ---------- 后台线程 ----------
+    def _connect(self):
+        self.db = get_db()
+        if self.db is None:
+            self.last_error = mongo.last_error
+        return self.db is not None
+
+    def _loop(self):
+        delay = self.min_delay
+        while not self.stop_event.is_set():
+            if not self.spool.pending:
+                self.wake_event.wait()
+                self.wake_event.clear()
+                continue
+            if not self._connect() or not self._drain():
+                # 连接或重放失败：按退避间隔重试，等待期间新的离线写入不会提前唤醒
+                self.db = None
+                self.stop_event.wait(delay)
+                delay = min(delay * 2, self.max_delay)
+                continue
+            delay = self.min_delay
+            self.wake_event.wait(self.max_delay)
+            self.wake_event.clear()
+
+    def _drain(self):
+        """按顺序分批重放；连接中断返回 False（已重放的记录不会重复）"""
+        while not self.stop_event.is_set():
+            batch = self.spool.read_batch(self.batch_size)
+            if not batch:
+                return True
+            done = []
+            try:
+                for row_id, collection, op, payload in batch:
+                    self._apply(collection, op, payload)
+                    done.append(row_id)
+            except ConnectionFailure as e:
+                self.last_error = str(e)
+                mongo.record_failure(e)
+                print(f"[Spool] 重放中断，稍后重试: {e}")
+                return False
+            finally:
+                self.spool.remove(done)
+                self.replayed += len(done)
+            print(f"[Spool] 已重放 {len(done)} 条离线记录，剩余 {self.spool.pending} 条")
+            self.stop_event.wait(self.batch_pause)
+        return True
+
+    def _apply(self, collection, op, payload):
+        try:
+            if op in self.handlers:
+                with self._handlers_lock:
+                    handler = self.handlers[op][0] if self.handlers[op] else None
+                if handler is None:
+                    # 登记者都已关闭（如摄像头被移除），保留记录等下一个登记者
+                    raise ConnectionFailure(f"{op} 暂无可用的处理函数")
+                handler(payload)
+            elif op in COLLECTION_OPS:
+                getattr(self.db[collection], op)(*payload.get("args", []), **payload.get("kwargs", {}))
+            else:
+                raise ValueError(f"未知操作 {op}")
+        except DuplicateKeyError:
+            # 插入时已预先分配 _id，重复说明上次重放已写入
+            pass
+        except ConnectionFailure:
+            raise
+        except Exception as e:
+            # 无法重放的记录（数据本身有误）丢弃并记录，避免阻塞后续记录
+            self.dropped += 1
+            print(f"[Spool] 丢弃无法重放的记录 {collection}.{op}: {e}")
+
+    def stats(self):
+        return {
+            "connected": self.db is not None,
+            "pending": self.spool.pending,
+            "replayed": self.replayed,
+            "dropped": self.dropped,
+            "last_error": self.last_error
+        }
+
+
+spool = EventSpool()
+replayer = SpoolReplayer(spool)
+
+
+def spooled_write(db, collection, op, *args, **kwargs):
+    """
+    db 可用且 spool 已排空时直接执行 db[collection].op(*args, **kwargs) 并返回结果；
+    否则（未连接、连接中断或仍有待重放记录）写入 spool 并返回 None
+    """
+    if op == "insert_one" and args and isinstance(args[0], dict):
+        # 预先分配 _id，重放可幂等，调用方也能拿到 ID
+        args[0].setdefault("_id", ObjectId())
+    if db is not None and mongo.available and spool.pending == 0:
+        try:
+            return getattr(db[collection], op)(*args, **kwargs)
+        except ConnectionFailure as e:
+            mongo.record_failure(e)
+            print(f"[Spool] 写入 {collection} 失败，转存本地: {e}")
+    spool.append(collection, op, {"args": list(args), "kwargs": kwargs})
+    replayer.notify()
+    return None
@@ -0,0 +1,74 @@
+"""
+启动耗时统计
+app.py 在每个启动阶段结束时调用 profiler.mark(name)，记录距上一个标记的耗时；
+模型等在后台完成的阶段用 record() 单独记录，不计入主线程启动耗时。
+启动完成后 report() 打印各阶段耗时，/api/system/startup 返回同样的数据
+"""
+
+import os
+import threading
+import time
+
+
+def _interpreter_seconds():
+    """进程创建到导入本模块经过的秒数（解释器启动 + 导入前的代码），仅 Linux 可用，其他平台返回 None"""
+    try:
+        with open('/proc/self/stat') as f:
+            # comm 字段可能含空格，从最后一个 ')' 之后开始按空格切分，starttime 为其后第 20 个字段
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupProfiler:
+    def __init__(self):
+        self.interpreter = _interpreter_seconds()
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.phases = []       # [(阶段, 秒)]，按启动顺序
+        self.background = {}   # 后台阶段 -> 秒
+        self.ready = None      # 主线程启动完成时距 started 的秒数
+        self._lock = threading.Lock()
+
+    def mark(self, name):
+        """结束一个阶段：记录从上一个标记到现在的耗时"""
+        now = time.perf_counter()
+        with self._lock:
+            self.phases.append((name, now - self.last))
+            self.last = now
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.background[name] = seconds
+        print(f"[Startup] {name} 后台完成，耗时 {seconds * 1000:.0f} ms")
+
+    def finish(self):
+        self.ready = time.perf_counter() - self.started
+        self.report()
+
+    def report(self):
+        lines = [f"[Startup] {name:<12} {seconds * 1000:8.0f} ms" for name, seconds in self.phases]
+        if self.interpreter is not None:
+            lines.insert(0, f"[Startup] {'interpreter':<12} {self.interpreter * 1000:8.0f} ms")
+        total = (self.ready if self.ready is not None else self.last - self.started) + (self.interpreter or 0)
+        lines.append(f"[Startup] {'total':<12} {total * 1000:8.0f} ms")
+        for name, seconds in self.background.items():
+            lines.append(f"[Startup] {name:<12} {seconds * 1000:8.0f} ms（后台）")
+        print("\n".join(lines))
+
+    def stats(self):
+        with self._lock:
+            phases = [{"name": name, "ms": round(seconds * 1000, 1)} for name, seconds in self.phases]
+            background = {name: round(seconds * 1000, 1) for name, seconds in self.background.items()}
+        return {
+            "interpreter_ms": round(self.interpreter * 1000, 1) if self.interpreter is not None else None,
+            "phases": phases,
+            "ready_ms": round(self.ready * 1000, 1) if self.ready is not None else None,
+            "background": background
+        }
+
+
+profiler = StartupProfiler()
@@ -4,10 +4,10 @@
 """
 
 from flask import Blueprint, jsonify, request
-import pymongo
 from datetime import datetime, timedelta
 from collections import defaultdict
 from modules.auth import has_role
+from modules.db import get_db, mongo
 
 statistics_bp = Blueprint('statistics', __name__, url_prefix='/api/statistics')
 
@@ -16,19 +16,17 @@ mongo_client = None
 db = None
 
 def init_db():
-    """初始化数据库连接"""
+    """初始化数据库连接（共享 modules.db 的连接池，可用状态变化时重新调用）"""
     global mongo_client, db
-    try:
-        mongo_client = pymongo.MongoClient("mongodb://localhost:27017/", serverSelectionTimeoutMS=2000)
-        db = mongo_client["fall_detection_db"]
-        mongo_client.server_info()
+    db = get_db()
+    mongo_client = mongo.client if db is not None else None
+    if db is not None:
         print("[Statistics] ✅ MongoDB 连接成功")
-    except Exception as e:
-        print(f"[Statistics] ❌ MongoDB 连接失败: {e}")
-        db = None
+    else:
+        print(f"[Statistics] ❌ MongoDB 连接失败: {mongo.last_error}")
 
-# 初始化数据库
-init_db()
+# 数据库在 app 启动时统一连接（modules.db.mongo.connect）
+mongo.on_connect(init_db)
 
 
 @statistics_bp.route('/summary', methods=['GET'])
@@ -1,86 +1,662 @@
 import os
+import json
+import bisect
 import cv2
 import time
 import threading
+import queue
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import pymongo
 import gridfs
 from bson.objectid import ObjectId
+from pymongo.errors import ConnectionFailure
+from modules.frame_ring import pixels, retain, release
+from modules.retention import storage_usage
+from modules.preview import ThumbnailSampler, compose_sprite, encode_poster, preview_from_file
+from modules.db import get_db, mongo
+from modules.spool import replayer, spool, spooled_write
+
+class EncodedFrame:
+    """压缩后的缓冲帧（JPEG 字节），保存片段时才解码"""
+    __slots__ = ("data", "shape")
+
+    def __init__(self, data, shape):
+        self.data = data
+        self.shape = shape
+
+
+def decode_frame(frame):
+    """缓冲帧 -> BGR 像素，兼容 ndarray / 帧环句柄 / EncodedFrame"""
+    if isinstance(frame, EncodedFrame):
+        return cv2.imdecode(frame.data, cv2.IMREAD_COLOR)
+    return pixels(frame)
+
+
+# 片段编码线程池（多路摄像头共享，限制同时编码的线程数）
+_encoder_pool = None
+_encoder_pool_lock = threading.Lock()
+_filename_lock = threading.Lock()
+_reserved_filenames = set()
+
+# 旧片段预览图补生成：单线程后台执行，同一片段只排队一次，不在 HTTP 请求中下载和解码整个视频
+_preview_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preview-backfill")
+_preview_pending = set()
+_preview_lock = threading.Lock()
+PREVIEW_QUEUE_LIMIT = 200
+
+
+def get_encoder_pool(workers=2):
+    global _encoder_pool
+    with _encoder_pool_lock:
+        if _encoder_pool is None:
+            _encoder_pool = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="clip-encoder")
+        return _encoder_pool
+
+
+class ClipSession:
+    """
+    单个跌倒事件的片段编码会话
+    跌倒前的帧在会话开始时整体入队，跌倒后的帧到达即追加，编码线程边收边写，不再集中在事件结束后一次性编码
+    """
+
+    def __init__(self, storage, before_frames):
+        self.storage = storage
+        self.display_time = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.filename = storage._reserve_filename()
+        self.frames = queue.Queue()
+        self.before_count = len(before_frames)
+        self.after_count = 0
+        self.total = 0
+        self.written = 0
+        self.max_frames = int(storage.max_clip_seconds * storage.fps)
+        self.snapshot = None  # 报警截图使用跌倒后的第一帧
+        self.sampler = ThumbnailSampler(storage.preview_count, storage.preview_width)  # 拖动预览缩略图
+        self.closed = False
+        for frame in before_frames:
+            self._put(frame)
+
+    def _put(self, frame):
+        self.frames.put(frame)
+        self.total += 1
+
+    def append(self, frame):
+        """追加一帧跌倒后的帧；录满 after_seconds 或达到片段上限时结束会话"""
+        if self.closed:
+            return
+        if self.snapshot is None:
+            self.snapshot = retain(frame)
+        self._put(retain(frame))
+        self.after_count += 1
+        if self.after_count >= self.storage.after_frames or self.total >= self.max_frames:
+            self.close()
+
+    def extend(self):
+        """事件持续或再次触发：从当前帧起重新计算跌倒后时长"""
+        self.after_count = 0
+
+    def close(self):
+        self.closed = True
+        self.frames.put(None)
+
+    @property
+    def idle_timeout(self):
+        return max(5.0, self.storage.after_seconds * 2)
+
+    def run(self):
+        """编码线程：逐帧写入，收到结束标记后入库"""
+        storage = self.storage
+        abs_path = os.path.join(storage.encoding_dir, self.filename)
+        out = None
+        try:
+            while True:
+                try:
+                    frame = self.frames.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    # 视频源已停止，不再有后续帧：用已收到的帧结束片段
+                    with storage._session_lock:
+                        if not self.closed:
+                            self.close()
+                    continue
+                if frame is None:
+                    break
+                try:
+                    image = decode_frame(frame)
+                    if out is None:
+                        height, width = image.shape[:2]
+                        out = storage._open_writer(abs_path, width, height)
+                    out.write(image)
+                    self.sampler.add(image)
+                    self.written += 1
+                finally:
+                    release(frame)
+            if out is None:
+                print("[Storage] ⚠️ 无有效帧，跳过保存")
+                return
+            out.release()
+            out = None
+            storage._complete_clip(self, abs_path)
+        except Exception as e:
+            print(f"[Storage] 保存流程异常: {e}")
+            if os.path.exists(abs_path):
+                os.remove(abs_path)
+            # 异常时停止接收新帧并排空队列，释放持有的帧
+            with storage._session_lock:
+                self.closed = True
+            while True:
+                try:
+                    frame = self.frames.get_nowait()
+                except queue.Empty:
+                    break
+                release(frame)
+        finally:
+            if out is not None:
+                out.release()
+            release(self.snapshot)
+            with _filename_lock:
+                _reserved_filenames.discard(self.filename)
+
+
+def _time_bound(value, is_end):
+    """"YYYY-MM-DD" 补全为当天起止时间，便于与 timestamp 字符串比较"""
+    if not value:
+        return None
+    value = value.strip().replace('T', ' ')
+    if len(value) == 10:
+        value += " 23:59:59" if is_end else " 00:00:00"
+    return value
+
+
+class LocalEvidenceIndex:
+    """
+    本地证据目录的增量索引（数据库不可用时的历史记录来源）
+    目录 mtime 变化时才重新扫描，且只对新增文件取修改时间；mtime 粒度较粗的文件系统另有定期兜底扫描
+    冷归档目录 (archive/) 中的片段一并索引，tier 标记为 cold
+    """
+
+    def __init__(self, save_dir, archive_dir=None, rescan_seconds=30):
+        self.save_dir = save_dir
+        self.archive_dir = archive_dir
+        self.rescan_seconds = rescan_seconds
+        self.entries = {}   # 文件名 -> 记录
+        self.ordered = []   # 按 (修改时间, 文件名) 倒序的记录
+        self.dir_mtime = None
+        self.scanned_at = 0
+        self._lock = threading.Lock()
+
+    def _display_time(self, filename, mtime):
+        # 尝试从文件名解析时间 fall_20251214_202138.mp4 / fall_20251214_202138_1.mp4
+        try:
+            time_part = filename.replace('fall_', '').replace('.mp4', '')[:15]
+            ts = time.strptime(time_part, "%Y%m%d_%H%M%S")
+            return time.strftime("%Y-%m-%d %H:%M:%S", ts)
+        except ValueError:
+            # 解析失败则使用文件修改时间
+            return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime))
+
+    def refresh(self, force=False):
+        dirs = [(self.save_dir, "evidence", "hot")]
+        if self.archive_dir and os.path.isdir(self.archive_dir):
+            dirs.append((self.archive_dir, "evidence/archive", "cold"))
+        try:
+            dir_mtime = tuple(os.stat(path).st_mtime_ns for path, _, _ in dirs)
+        except OSError:
+            return
+        with self._lock:
+            if not force and dir_mtime == self.dir_mtime and time.time() - self.scanned_at < self.rescan_seconds:
+                return
+            entries = {}
+            for path, rel_dir, tier in dirs:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if not entry.name.endswith('.mp4') or not entry.is_file() or entry.name in entries:
+                            continue
+                        known = self.entries.get(entry.name)
+                        if known is not None and known["tier"] == tier:
+                            entries[entry.name] = known
+                            continue
+                        mtime = entry.stat().st_mtime
+                        entries[entry.name] = {
+                            "id": entry.name,  # 本地文件 ID 直接使用文件名
+                            "filename": entry.name,
+                            "timestamp": self._display_time(entry.name, mtime),
+                            "filepath": f"{rel_dir}/{entry.name}",
+                            "source": "local",
+                            "tier": tier,
+                            "_mtime": mtime
+                        }
+            if entries != self.entries:
+                self.ordered = sorted(entries.values(), key=lambda r: (r["_mtime"], r["filename"]), reverse=True)
+            self.entries = entries
+            self.dir_mtime = dir_mtime
+            self.scanned_at = time.time()
+
+    def query(self, limit=None, cursor=None, start=None, end=None):
+        """
+        cursor 为上一页最后一条的 "文件名@修改时间"，按排序键定位续读位置；
+        游标对应的文件已被保留策略或分层迁移删除时，仍从它原来的位置之后继续，不会回到第一页
+        """
+        self.refresh()
+        with self._lock:
+            ordered = self.ordered
+        position = 0
+        if cursor:
+            key = self._parse_cursor(cursor)
+            # ordered 按排序键倒序，定位第一条严格排在游标之后（更旧）的记录
+            position = bisect.bisect_left(ordered, True, key=lambda r: (r["_mtime"], r["filename"]) < key)
+        data = []
+        next_cursor = None
+        for record in ordered[position:]:
+            if (start and record["timestamp"] < start) or (end and record["timestamp"] > end):
+                continue
+            if limit and len(data) >= limit:
+                next_cursor = f"{last['filename']}@{last['_mtime']!r}"
+                break
+            last = record
+            data.append({k: v for k, v in record.items() if k != "_mtime"})
+        return data, next_cursor
+
+    def _parse_cursor(self, cursor):
+        name, sep, mtime = cursor.rpartition('@')
+        if sep:
+            try:
+                return float(mtime), name
+            except ValueError:
+                pass
+        # 不带修改时间的旧格式游标只能按文件名定位
+        record = self.entries.get(cursor)
+        if record is None:
+            raise ValueError("分页游标已失效，请从第一页重新加载")
+        return record["_mtime"], record["filename"]
+
 
 class StorageModule:
-    def __init__(self, save_dir='evidence', buffer_seconds=3, after_seconds=2, fps=30):
+    """
+    - buffer_codec: 跌倒前循环缓冲的存储方式，raw 保存原始帧，jpeg 压缩保存（内存约为原来的 1/10~1/20）
+    - jpeg_quality: jpeg 缓冲的压缩质量
+    - max_clip_seconds: 事件持续时片段最长录制时长，超过后下一次触发新建片段
+    - encoder_workers: 所有 StorageModule 共享的片段编码线程数
+    - keep_local_copy: 入库成功后是否保留本地 MP4（数据库不可用时总是保留）
+    - preview_count / preview_width: 拖动预览图的缩略图数量与宽度
+    """
+
+    def __init__(self, save_dir='evidence', buffer_seconds=3, after_seconds=2, fps=30, location="监控区域",
+                 buffer_codec="raw", jpeg_quality=90, max_clip_seconds=30, encoder_workers=2,
+                 keep_local_copy=False, chunk_size=255 * 1024, preview_count=10, preview_width=160):
         # 视频保存路径 (生成过程仍需暂存磁盘)
         self.save_dir = save_dir
         if not os.path.exists(self.save_dir):
             os.makedirs(self.save_dir)
+        self.encoding_dir = os.path.join(self.save_dir, '.encoding')  # 编码中的片段
+        os.makedirs(self.encoding_dir, exist_ok=True)
+        self.archive_dir = os.path.join(self.save_dir, 'archive')  # 冷归档片段 (modules.tiering)
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self.preview_dir = os.path.join(self.save_dir, 'previews')  # 未入库片段的封面与拖动预览图
+        os.makedirs(self.preview_dir, exist_ok=True)
+        self.preview_count = preview_count
+        self.preview_width = preview_width
+        self.keep_local_copy = keep_local_copy  # 入库成功后是否仍在证据目录保留 MP4
+        self.chunk_size = int(chunk_size)  # GridFS 分块大小
+        self.local_index = LocalEvidenceIndex(self.save_dir, self.archive_dir)
+        self.on_clip_saved = None  # 片段保存后的回调（例如触发保留策略检查）
         
         self.fps = fps
+        self.location = location  # 报警记录中的位置
         self.buffer_seconds = buffer_seconds  # 跌倒前的秒数
         self.after_seconds = after_seconds    # 跌倒后的秒数
-        self.buffer_size = buffer_seconds * fps
-        self.frame_buffer = deque(maxlen=self.buffer_size)  # 跌倒前的帧缓冲
-        self.after_buffer = []  # 跌倒后的帧缓冲
-        self.is_saving = False
-        self.is_recording_after = False  # 是否正在录制跌倒后的帧
-        self.after_frame_count = 0  # 已录制的跌倒后帧数
+        self.buffer_size = int(buffer_seconds * fps)
+        self.buffer_codec = buffer_codec if buffer_codec in ("raw", "jpeg") else "raw"
+        self.jpeg_params = [int(cv2.IMWRITE_JPEG_QUALITY), int(jpeg_quality)]
+        self.frame_buffer = deque()  # 跌倒前的帧缓冲（帧或帧环句柄，按 buffer_size 手动淘汰以释放句柄）
+        self.max_clip_seconds = max_clip_seconds  # 持续事件延长片段的上限
+        self.encoder_workers = encoder_workers
+        self.session = None  # 正在录制跌倒后帧的片段会话
+        self._session_lock = threading.Lock()
         
         # --- MongoDB 配置 ---
-        # 请确保您的 MongoDB 服务已启动
-        self.mongo_uri = "mongodb://localhost:27017/"
-        self.db_name = "fall_detection_db"
+        # 共享 modules.db 的连接池；可用状态变化时重新初始化
         self._init_mongo()
+        mongo.subscribe(self._init_mongo)
+        # 离线期间保存在本地的片段，数据库恢复后由 spool 重放线程上传
+        replayer.register_handler("storage.clip", self._replay_clip)
+
+    def close(self):
+        """
+        摄像头移除时调用：取消数据库状态订阅和离线片段重放登记，释放循环缓冲持有的帧；
+        已触发的片段由编码线程继续写完
+        """
+        mongo.unsubscribe(self._init_mongo)
+        replayer.unregister_handler("storage.clip", self._replay_clip)
+        with self._session_lock:
+            frames = list(self.frame_buffer)
+            self.frame_buffer.clear()
+        for frame in frames:
+            release(frame)
 
     def _init_mongo(self):
         """初始化 MongoDB 连接和 GridFS"""
         try:
-            self.client = pymongo.MongoClient(self.mongo_uri, serverSelectionTimeoutMS=2000)
-            self.db = self.client[self.db_name]
+            db = get_db()
+            if db is None:
+                raise ConnectionError(mongo.last_error)
+            self.client = mongo.client
+            self.db = db
             # 初始化 GridFS 用于存储大文件
             self.fs = gridfs.GridFS(self.db)
-            
-            # 测试连接
-            self.client.server_info()
+            # 历史记录按时间范围查询
+            self.db.history.create_index("timestamp")
             print("[Storage] ✅ MongoDB 已连接 (使用 GridFS 存储视频)")
         except Exception as e:
             print(f"[Storage] ❌ MongoDB 连接失败: {e}")
             self.db = None
             self.fs = None
 
-    def _save_to_db(self, filename, timestamp, filepath, video_binary):
-        """将视频存入 GridFS，并将元数据写入集合"""
+    def _save_to_db(self, filename, timestamp, filepath, video_path, preview=None):
+        """将视频按块流式写入 GridFS，预览图一并写入 GridFS，元数据写入集合；成功返回 True"""
         if self.db is None:
             print("[Storage] 数据库未连接，跳过保存")
-            return
+            return False
 
         try:
-            # 1. 将视频二进制数据存入 GridFS
-            # put 方法会返回文件在 GridFS 中的唯一 ID (ObjectId)
-            grid_file_id = self.fs.put(video_binary, filename=filename, content_type='video/mp4')
+            # 1. 分块写入 GridFS
+            grid_file_id = self.upload_file(filename, video_path)
 
             # 2. 将元数据存入普通集合，并关联 GridFS 的 ID
             record = {
                 "filename": filename,
                 "timestamp": timestamp,
                 "filepath": filepath, # 保留相对路径字段，兼容前端逻辑
-                "video_file_id": grid_file_id # 关联 GridFS 文件的关键 ID
+                "video_file_id": grid_file_id, # 关联 GridFS 文件的关键 ID
+                "created_at": datetime.now()
             }
+            if preview:
+                record.update(self._upload_preview(filename, preview))
             self.db.history.insert_one(record)
             
             print(f"[Storage] 📝 MongoDB 记录已添加 (GridFS ID: {grid_file_id})")
+            return True
         except Exception as e:
             print(f"[Storage] MongoDB 写入错误: {e}")
+            return False
+
+    def _spool_clip(self, filename, timestamp, filepath):
+        """入库失败的片段已保存在本地，记录到 spool，数据库恢复后补传"""
+        spool.append("history", "storage.clip", {
+            "_id": ObjectId(),
+            "filename": filename,
+            "timestamp": timestamp,
+            "filepath": filepath,
+            "created_at": datetime.now()
+        })
+        replayer.notify()
+
+    def _replay_clip(self, payload):
+        """spool 重放：上传离线期间保存在本地的片段和预览图，补写 history 文档"""
+        if self.db is None:
+            # 状态回调可能晚于重放线程执行
+            self._init_mongo()
+        if self.db is None:
+            raise ConnectionFailure("Storage 数据库连接尚未恢复")
+        filename = payload["filename"]
+        if self.db.history.find_one({"_id": payload["_id"]}, {"_id": 1}):
+            return
+        local_path = self.locate_local(filename)
+        if local_path is None:
+            print(f"[Storage] 离线片段 {filename} 已不存在（可能已被清理），跳过补传")
+            return
+        record = dict(payload)
+        if os.path.dirname(local_path) == self.archive_dir:
+            # 离线期间已被分层线程归档，直接登记为 cold
+            record.update({"tier": "cold", "archive_path": f"evidence/archive/{filename}"})
+        else:
+            record["video_file_id"] = self.upload_file(filename, local_path)
+        preview = self._load_local_preview(filename)
+        if preview:
+            record.update(self._upload_preview(filename, preview))
+        self.db.history.insert_one(record)
+        print(f"[Storage] 📝 离线片段已补传: {filename}")
+        if "video_file_id" in record and not self.keep_local_copy:
+            self.delete_local_file(filename)
+        elif preview:
+            self._delete_local_preview(filename)
+
+    def upload_file(self, filename, video_path):
+        """分块写入 GridFS 并计入占用统计，返回文件 ID；内存占用只与块大小有关，与片段大小无关"""
+        grid_in = self.fs.new_file(filename=filename, content_type='video/mp4', chunk_size=self.chunk_size)
+        try:
+            with open(video_path, 'rb') as video_file:
+                while True:
+                    chunk = video_file.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    grid_in.write(chunk)
+            grid_in.close()
+        except Exception:
+            grid_in.abort()
+            raise
+        storage_usage.add("gridfs", grid_in.length)
+        return grid_in._id
+
+    def _put_image(self, filename, data):
+        file_id = self.fs.put(data, filename=filename, content_type='image/jpeg')
+        storage_usage.add("gridfs", len(data))
+        return file_id
+
+    def _upload_preview(self, filename, preview):
+        """预览图写入 GridFS，返回写入 history 文档的字段"""
+        fields = {}
+        if preview.get("poster"):
+            fields["poster_file_id"] = self._put_image(f"{filename}.poster.jpg", preview["poster"])
+        if preview.get("sprite"):
+            fields["sprite_file_id"] = self._put_image(f"{filename}.sprite.jpg", preview["sprite"])
+            fields["sprite"] = preview["sprite_meta"]
+        return fields
+
+    def download_file(self, file_id, dest_path):
+        """把 GridFS 文件按块写到本地路径（转码等需要文件路径的场景）"""
+        grid_out = self.fs.get(file_id)
+        with open(dest_path, 'wb') as dest:
+            while True:
+                chunk = grid_out.readchunk()
+                if not chunk:
+                    break
+                dest.write(chunk)
+        return dest_path
+
+    def delete_grid_file(self, file_id):
+        """删除 GridFS 文件并更新占用统计"""
+        grid_file = self.db.fs.files.find_one({"_id": file_id}, {"length": 1})
+        self.fs.delete(file_id)
+        if grid_file:
+            storage_usage.remove("gridfs", grid_file.get("length", 0))
+
+    def locate_local(self, filename):
+        """本地副本路径：先找证据目录，再找冷归档目录；都没有返回 None"""
+        name = os.path.basename(filename or "")
+        if not name:
+            return None
+        for directory in (self.save_dir, self.archive_dir):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def replace_local_file(self, filename, new_path, archive=False, mtime=None):
+        """
+        用转码后的文件替换本地副本（archive=True 时移入冷归档目录并删除原位置的副本）
+        保留原文件的修改时间，本地索引的排序和保留期限不受转码影响
+        """
+        old_path = self.locate_local(filename)
+        old_size = os.path.getsize(old_path) if old_path else 0
+        if mtime is None and old_path:
+            mtime = os.path.getmtime(old_path)
+        if mtime is not None:
+            os.utime(new_path, (mtime, mtime))
+        target = os.path.join(self.archive_dir if archive else self.save_dir, os.path.basename(filename))
+        new_size = os.path.getsize(new_path)
+        os.replace(new_path, target)
+        storage_usage.add("local", new_size)
+        if old_path:
+            # new_path 即原文件（仅移入归档目录）时原位置已不存在
+            if old_path != target and os.path.exists(old_path):
+                os.remove(old_path)
+            storage_usage.remove("local", old_size)
+        return target
+
+    # ---------- 预览图 ----------
+    def _preview_paths(self, filename):
+        base = os.path.join(self.preview_dir, os.path.basename(filename))
+        return {"poster": f"{base}.poster.jpg", "sprite": f"{base}.sprite.jpg", "meta": f"{base}.json"}
+
+    def _save_local_preview(self, filename, preview):
+        paths = self._preview_paths(filename)
+        for kind in ("poster", "sprite"):
+            if preview.get(kind):
+                with open(paths[kind], 'wb') as f:
+                    f.write(preview[kind])
+                storage_usage.add("local", len(preview[kind]))
+        with open(paths["meta"], 'w', encoding='utf-8') as f:
+            json.dump(preview.get("sprite_meta") or {}, f)
+
+    def _load_local_preview(self, filename):
+        paths = self._preview_paths(filename)
+        if not os.path.isfile(paths["poster"]):
+            return None
+        preview = {}
+        for kind in ("poster", "sprite"):
+            if os.path.isfile(paths[kind]):
+                with open(paths[kind], 'rb') as f:
+                    preview[kind] = f.read()
+        if os.path.isfile(paths["meta"]):
+            with open(paths["meta"], encoding='utf-8') as f:
+                preview["sprite_meta"] = json.load(f)
+        return preview
+
+    def _delete_local_preview(self, filename):
+        for path in self._preview_paths(filename).values():
+            if os.path.isfile(path):
+                storage_usage.remove("local", os.path.getsize(path))
+                os.remove(path)
+
+    def _build_preview(self, session):
+        """用编码时抽取的缩略图生成封面和拖动预览图；失败不影响片段保存"""
+        try:
+            poster_frame = decode_frame(session.snapshot) if session.snapshot is not None else None
+            thumbs = session.sampler.pick()
+            if poster_frame is None and thumbs:
+                poster_frame = thumbs[len(thumbs) // 2][1]
+            if poster_frame is None:
+                return None
+            sprite, meta = compose_sprite(thumbs, self.fps)
+            return {"poster": encode_poster(poster_frame), "sprite": sprite, "sprite_meta": meta}
+        except Exception as e:
+            print(f"[Storage] 生成预览图失败: {e}")
+            return None
+
+    def get_preview(self, record_id_str, kind):
+        """
+        片段的封面 (poster) / 拖动预览图 (sprite) / 预览元数据 (meta)
+        返回 {"path"}、{"grid_out"} 或 {"meta"}，找不到返回 None；
+        没有预览图的旧片段提交后台补生成并返回 {"pending": True}，生成完成前接口返回 404
+        """
+        if record_id_str.endswith('.mp4'):
+            paths = self._preview_paths(record_id_str)
+            if not os.path.isfile(paths["meta"]):
+                if self.locate_local(record_id_str) is None:
+                    return None
+                self._queue_backfill(record_id_str, self._backfill_local_preview, record_id_str)
+                return {"pending": True}
+            if kind == "meta":
+                with open(paths["meta"], encoding='utf-8') as f:
+                    return {"meta": json.load(f)}
+            return {"path": paths[kind]} if os.path.isfile(paths[kind]) else None
+
+        if self.db is None: return None
+        try:
+            record = self.db.history.find_one({"_id": ObjectId(record_id_str)})
+            if not record:
+                return None
+            if "poster_file_id" not in record:
+                self._queue_backfill(record_id_str, self._backfill_preview, record)
+                return {"pending": True}
+            if kind == "meta":
+                return {"meta": record.get("sprite") or {}}
+            file_id = record.get(f"{kind}_file_id")
+            return {"grid_out": self.fs.get(file_id)} if file_id else None
+        except Exception as e:
+            print(f"[Storage] 获取预览图失败: {e}")
+            return None
+
+    def _queue_backfill(self, key, func, arg):
+        """提交预览图补生成任务；已在排队或队列已满时忽略（下次请求会重新提交）"""
+        with _preview_lock:
+            if key in _preview_pending or len(_preview_pending) >= PREVIEW_QUEUE_LIMIT:
+                return
+            _preview_pending.add(key)
+
+        def run():
+            try:
+                func(arg)
+            except Exception as e:
+                print(f"[Storage] 补生成预览图失败 ({key}): {e}")
+            finally:
+                with _preview_lock:
+                    _preview_pending.discard(key)
+
+        _preview_pool.submit(run)
+
+    def _backfill_local_preview(self, filename):
+        """为只有本地文件的旧片段补生成预览图"""
+        if os.path.isfile(self._preview_paths(filename)["meta"]):
+            return
+        video_path = self.locate_local(filename)
+        preview = preview_from_file(video_path, self.preview_count, self.preview_width) if video_path else None
+        if preview:
+            self._save_local_preview(filename, preview)
+
+    def _backfill_preview(self, record):
+        """为入库的旧片段补生成预览图并写回 history 文档"""
+        record_id = str(record["_id"])
+        video = self.open_video(record_id)
+        if not video:
+            return None
+        temp_path = None
+        try:
+            video_path = video.get("path")
+            if video_path is None:
+                video["grid_out"].close()
+                temp_path = self.download_file(record["video_file_id"],
+                                               os.path.join(self.encoding_dir, f"preview_{record['filename']}"))
+                video_path = temp_path
+            preview = preview_from_file(video_path, self.preview_count, self.preview_width)
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+        if not preview:
+            return None
+        fields = self._upload_preview(record["filename"], preview)
+        # 并发请求同时补生成时只保留先写入的一份
+        result = self.db.history.update_one({"_id": record["_id"], "poster_file_id": {"$exists": False}},
+                                            {"$set": fields})
+        if not result.matched_count:
+            for key in ("poster_file_id", "sprite_file_id"):
+                if key in fields:
+                    self.delete_grid_file(fields[key])
+            return self.db.history.find_one({"_id": record["_id"]})
+        record.update(fields)
+        return record
 
     def _save_snapshot_record(self, alarm_id, frame):
         """为报警保存关键帧截图和元数据"""
-        if self.db is None or frame is None:
+        if frame is None:
             return
         try:
             snapshot_name = f"snapshot_{alarm_id}.jpg"
             snapshot_abs = os.path.join(self.save_dir, snapshot_name)
             snapshot_rel = f"evidence/{snapshot_name}"
-            cv2.imwrite(snapshot_abs, frame)
-            self.db.alarm_snapshots.insert_one({
+            cv2.imwrite(snapshot_abs, decode_frame(frame))
+            storage_usage.add("local", os.path.getsize(snapshot_abs))
+            spooled_write(self.db, "alarm_snapshots", "insert_one", {
                 "alarm_id": alarm_id,
                 "filename": snapshot_name,
                 "filepath": snapshot_rel,
@@ -91,14 +667,26 @@ class StorageModule:
         except Exception as e:
             print(f"[Storage] 保存截图失败: {e}")
 
+    def delete_local_file(self, filename):
+        """删除证据目录（含冷归档目录）中的文件并更新占用统计"""
+        deleted = False
+        if filename and filename.endswith('.mp4'):
+            self._delete_local_preview(filename)
+        while True:
+            local_path = self.locate_local(filename)
+            if local_path is None:
+                return deleted
+            size = os.path.getsize(local_path)
+            os.remove(local_path)
+            storage_usage.remove("local", size)
+            deleted = True
+
     def delete_record(self, record_id_str):
-        """删除一条历史记录（同时删除 GridFS 视频文件和 history 文档，或本地文件）"""
+        """删除一条历史记录（同时删除 GridFS 视频文件、history 文档和本地副本，或本地文件）"""
         # 本地文件
         if record_id_str.endswith('.mp4'):
-            local_path = os.path.join(self.save_dir, record_id_str)
             try:
-                if os.path.exists(local_path):
-                    os.remove(local_path)
+                self.delete_local_file(record_id_str)
                 return True, "本地文件已删除"
             except Exception as e:
                 return False, str(e)
@@ -110,14 +698,18 @@ class StorageModule:
             record = self.db.history.find_one({"_id": ObjectId(record_id_str)})
             if not record:
                 return False, "记录不存在"
-            # 删除 GridFS 文件
-            if "video_file_id" in record:
+            # 删除 GridFS 视频与预览图
+            for key in ("video_file_id", "poster_file_id", "sprite_file_id"):
+                if key not in record:
+                    continue
                 try:
-                    self.fs.delete(record["video_file_id"])
+                    self.delete_grid_file(record[key])
                 except Exception:
                     pass
             # 删除 history 文档
             self.db.history.delete_one({"_id": ObjectId(record_id_str)})
+            # 删除保留的本地副本或冷归档文件
+            self.delete_local_file(record.get("filename", ""))
             return True, "记录已删除"
         except Exception as e:
             return False, str(e)
@@ -133,70 +725,110 @@ class StorageModule:
                     "id": str(doc["_id"]),
                     "filename": doc["filename"],
                     "timestamp": doc["timestamp"],
-                    "filepath": doc.get("filepath", ""),
-                    "source": "db"
+                    "filepath": doc.get("archive_path") or doc.get("filepath", ""),
+                    "source": "db",
+                    "tier": doc.get("tier", "hot")
                 }
         except Exception:
             pass
         return None
 
-    def get_all_records(self):
-        """查询所有历史记录 (支持 MongoDB 和 本地文件)"""
-        data = []
-        
-        # 1. 尝试从 MongoDB 读取
-        if self.db is not None:
+    def get_records(self, limit=None, cursor=None, start=None, end=None):
+        """
+        分页查询历史记录 (支持 MongoDB 和 本地文件)，返回 (记录列表, 下一页游标)
+        - limit: 每页条数，None 表示不分页
+        - cursor: 上一页返回的游标（数据库记录为 _id，本地文件为 "文件名@修改时间"）
+        - start / end: 时间范围 "YYYY-MM-DD" 或 "YYYY-MM-DD HH:MM:SS"（含两端）
+        """
+        start, end = _time_bound(start, False), _time_bound(end, True)
+        local_cursor = cursor is not None and not ObjectId.is_valid(cursor)
+
+        # 1. 尝试从 MongoDB 读取（数据库为空时回退到本地目录，与原逻辑一致）
+        if self.db is not None and not local_cursor:
             try:
-                cursor = self.db.history.find().sort('_id', -1)
-                for doc in cursor:
-                    data.append({
-                        "id": str(doc["_id"]),
-                        "filename": doc["filename"],
-                        "timestamp": doc["timestamp"],
-                        "filepath": doc["filepath"],
-                        "source": "db"
-                    })
+                if cursor is not None or self.db.history.estimated_document_count() > 0:
+                    return self._query_db_records(limit, cursor, start, end)
             except Exception as e:
                 print(f"[Storage] DB 查询失败: {e}")
 
-        # 2. 如果数据为空（DB未连接或无数据），扫描本地 evidence 目录
-        if not data:
+        # 2. DB 未连接或无数据，使用本地 evidence 目录索引
+        return self.local_index.query(limit, cursor if local_cursor else None, start, end)
+
+    def _query_db_records(self, limit, cursor, start, end):
+        query = {}
+        if cursor is not None:
+            query["_id"] = {"$lt": ObjectId(cursor)}
+        # timestamp 为 "YYYY-MM-DD HH:MM:SS" 字符串，字典序即时间序
+        if start or end:
+            query["timestamp"] = {}
+            if start: query["timestamp"]["$gte"] = start
+            if end: query["timestamp"]["$lte"] = end
+        docs = self.db.history.find(query, {"filename": 1, "timestamp": 1, "filepath": 1, "tier": 1, "archive_path": 1}).sort('_id', -1)
+        if limit:
+            docs = docs.limit(limit + 1)
+        data = [{
+            "id": str(doc["_id"]),
+            "filename": doc["filename"],
+            "timestamp": doc["timestamp"],
+            "filepath": doc.get("archive_path") or doc.get("filepath", ""),
+            "source": "db",
+            "tier": doc.get("tier", "hot")
+        } for doc in docs]
+        next_cursor = None
+        if limit and len(data) > limit:
+            data = data[:limit]
+            next_cursor = data[-1]["id"]
+        return data, next_cursor
+
+    def get_oldest_records(self, limit):
+        """最旧的若干条记录 ID（供配额清理使用）"""
+        if self.db is not None:
             try:
-                files = [f for f in os.listdir(self.save_dir) if f.endswith('.mp4')]
-                # 按修改时间倒序
-                files.sort(key=lambda x: os.path.getmtime(os.path.join(self.save_dir, x)), reverse=True)
-                
-                for f in files:
-                    file_path = os.path.join(self.save_dir, f)
-                    # 尝试从文件名解析时间 fall_20251214_202138.mp4
-                    try:
-                        time_part = f.replace('fall_', '').replace('.mp4', '')
-                        ts = time.strptime(time_part, "%Y%m%d_%H%M%S")
-                        display_time = time.strftime("%Y-%m-%d %H:%M:%S", ts)
-                    except:
-                        # 解析失败则使用文件修改时间
-                        mtime = os.path.getmtime(file_path)
-                        display_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime))
-                    
-                    data.append({
-                        "id": f, # 本地文件 ID 直接使用文件名
-                        "filename": f,
-                        "timestamp": display_time,
-                        "filepath": f"evidence/{f}",
-                        "source": "local"
-                    })
+                docs = list(self.db.history.find({}, {"_id": 1}).sort('_id', 1).limit(limit))
+                if docs:
+                    return [str(doc["_id"]) for doc in docs]
             except Exception as e:
-                print(f"[Storage] 本地扫描失败: {e}")
-        
-        return data
+                print(f"[Storage] DB 查询失败: {e}")
+        self.local_index.refresh()
+        return [record["id"] for record in self.local_index.ordered[-limit:]][::-1]
+
+    def get_all_records(self):
+        """查询所有历史记录 (支持 MongoDB 和 本地文件)"""
+        return self.get_records()[0]
+
+    def open_video(self, record_id_str):
+        """
+        定位记录对应的视频但不读取内容，供分段（Range）响应使用
+        返回 {"path": 本地文件} 或 {"grid_out": GridOut}；找不到返回 None
+        入库记录在本地保留了副本或已移入冷归档时使用本地文件，调用方无需区分所在层级
+        """
+        if record_id_str.endswith('.mp4'):
+            local_path = self.locate_local(record_id_str)
+            return {"path": local_path} if local_path else None
+
+        if self.db is None: return None
+        try:
+            record = self.db.history.find_one({"_id": ObjectId(record_id_str)})
+            if not record:
+                return None
+            local_path = self.locate_local(record.get("filename"))
+            if local_path:
+                return {"path": local_path}
+            if "video_file_id" not in record:
+                print("[Storage] 未找到关联的视频文件")
+                return None
+            return {"grid_out": self.fs.get(record["video_file_id"])}
+        except Exception as e:
+            print(f"[Storage] 获取视频失败: {e}")
+            return None
 
     def get_video_blob(self, record_id_str):
         """根据记录 ID 获取视频数据 (支持 MongoDB 和 本地文件)"""
         
         # 1. 如果 ID 以 .mp4 结尾，说明是本地文件
         if record_id_str.endswith('.mp4'):
-            local_path = os.path.join(self.save_dir, record_id_str)
-            if os.path.exists(local_path):
+            local_path = self.locate_local(record_id_str)
+            if local_path:
                 try:
                     with open(local_path, 'rb') as f:
                         return f.read()
@@ -211,6 +843,10 @@ class StorageModule:
         try:
             # 先通过记录 ID 找到 history 文档
             record = self.db.history.find_one({"_id": ObjectId(record_id_str)})
+            local_path = self.locate_local(record.get("filename")) if record else None
+            if local_path:
+                with open(local_path, 'rb') as f:
+                    return f.read()
             if not record or "video_file_id" not in record:
                 print("[Storage] 未找到关联的视频文件")
                 return None
@@ -224,104 +860,108 @@ class StorageModule:
             return None
 
     def buffer_frame(self, frame):
-        """缓冲帧：跌倒前存入循环队列，跌倒后存入临时列表"""
-        # 如果正在录制跌倒后的帧
-        if self.is_recording_after:
-            self.after_buffer.append(frame.copy())
-            self.after_frame_count += 1
-            # 检查是否已录制足够的跌倒后帧
-            if self.after_frame_count >= self.after_seconds * self.fps:
-                self._finalize_video()
-        else:
-            # 正常情况下，存入循环缓冲区（跌倒前）
-            self.frame_buffer.append(frame)
+        """
+        缓冲帧：始终存入跌倒前循环队列；有进行中的事件片段时同时追加到该片段
+        frame 可以是 ndarray 或帧环句柄 (modules.frame_ring.FrameSlot)，缓冲期间持有一个引用，不复制像素；
+        调用方不得原地修改已传入的帧
+        """
+        buffered = self._encode(frame) if self.buffer_codec == "jpeg" else retain(frame)
+        # 淘汰和追加与推理线程上的 save_event_clip 快照共用 _session_lock，快照期间循环缓冲不会变化
+        with self._session_lock:
+            session = self.session
+            if session is not None:
+                session.append(frame)
+                if session.closed:
+                    self.session = None
+            if len(self.frame_buffer) >= self.buffer_size:
+                release(self.frame_buffer.popleft())
+            self.frame_buffer.append(buffered)
+
+    def _encode(self, frame):
+        image = pixels(frame)
+        ok, data = cv2.imencode('.jpg', image, self.jpeg_params)
+        return EncodedFrame(data, image.shape) if ok else image.copy()
+
+    @property
+    def held_frames(self):
+        """缓冲区最多持有的原始帧数（jpeg 缓冲只持有跌倒后的帧），用于确定帧环槽位数"""
+        after_frames = self.after_frames
+        return after_frames if self.buffer_codec == "jpeg" else self.buffer_size + after_frames
+
+    @property
+    def after_frames(self):
+        return int(self.after_seconds * self.fps)
+
+    @property
+    def is_recording_after(self):
+        """是否有正在录制跌倒后帧的事件片段"""
+        return self.session is not None and not self.session.closed
 
     def save_event_clip(self):
         """
-        触发跌倒事件：标记开始录制跌倒后的帧
+        触发跌倒事件：新建片段会话，跌倒前的帧立即开始写入；
+        片段仍在录制跌倒后帧时再次触发（事件持续或重叠）则延长该片段
         """
-        if self.is_saving or self.is_recording_after:
-            return
-        
+        with self._session_lock:
+            if self.session is not None and not self.session.closed:
+                self.session.extend()
+                return
+            # save_event_clip 在推理线程调用，持锁取快照并持有引用，写入期间循环缓冲淘汰的帧不会被覆盖
+            before_frames = [retain(f) for f in self.frame_buffer]
+            self.session = ClipSession(self, before_frames)
         print(f"[Storage] 🎬 跌倒检测触发，开始录制后续 {self.after_seconds} 秒...")
-        self.is_recording_after = True
-        self.after_frame_count = 0
-        self.after_buffer = []
-    
-    def _finalize_video(self):
-        """
-        完成视频录制：合并跌倒前后的帧并保存
-        """
-        if self.is_saving:
-            return
-        
-        self.is_saving = True
-        self.is_recording_after = False
-        
-        def _write_task():
-            try:
-                # 1. 准备文件名和路径
-                display_time = time.strftime("%Y-%m-%d %H:%M:%S")
-                file_time = time.strftime("%Y%m%d_%H%M%S")
-                filename = f"fall_{file_time}.mp4"
-                abs_path = os.path.join(self.save_dir, filename)
-                rel_path = f"evidence/{filename}"
-
-                # 2. 合并跌倒前后的帧
-                before_frames = list(self.frame_buffer)  # 跌倒前3秒
-                after_frames = self.after_buffer.copy()  # 跌倒后2秒
-                all_frames = before_frames + after_frames
-                
-                if not all_frames:
-                    print("[Storage] ⚠️ 无有效帧，跳过保存")
-                    self.is_saving = False
-                    return
-                
-                print(f"[Storage] 📊 合并帧数: 跌倒前 {len(before_frames)} 帧 + 跌倒后 {len(after_frames)} 帧 = 总计 {len(all_frames)} 帧")
-                
-                height, width, _ = all_frames[0].shape
-
-                # 3. 写入视频文件
-                try:
-                    fourcc = cv2.VideoWriter_fourcc(*'avc1')
-                    out = cv2.VideoWriter(abs_path, fourcc, self.fps, (width, height))
-                    if not out.isOpened():
-                         raise Exception("avc1 writer not opened")
-                except Exception as e:
-                    print(f"[Storage] avc1 编码不可用 ({e})，尝试回退到 mp4v")
-                    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-                    out = cv2.VideoWriter(abs_path, fourcc, self.fps, (width, height))
+        get_encoder_pool(self.encoder_workers).submit(self.session.run)
 
-                for f in all_frames:
-                    out.write(f)
-                out.release()
-                print(f"[Storage] 🎥 视频文件已生成: {abs_path}")
-
-                # 4. 读取生成的文件为二进制数据
-                with open(abs_path, 'rb') as video_file:
-                    video_binary = video_file.read()
-
-                # 5. 存入 MongoDB
-                self._save_to_db(filename, display_time, rel_path, video_binary)
-                
-                # 6. 同时保存报警记录
-                self._save_alarm_record(display_time, filename)
-                
-                # 清空跌倒后缓冲区
-                self.after_buffer = []
+    def _reserve_filename(self):
+        """生成不重复的片段文件名（同一秒内的多个事件或多路摄像头追加序号）"""
+        file_time = time.strftime("%Y%m%d_%H%M%S")
+        with _filename_lock:
+            index = 0
+            while True:
+                filename = f"fall_{file_time}.mp4" if index == 0 else f"fall_{file_time}_{index}.mp4"
+                if filename not in _reserved_filenames and self.locate_local(filename) is None:
+                    _reserved_filenames.add(filename)
+                    return filename
+                index += 1
 
-            except Exception as e:
-                print(f"[Storage] 保存流程异常: {e}")
-            finally:
-                self.is_saving = False
+    def _open_writer(self, abs_path, width, height, fps=None):
+        fps = fps or self.fps
+        try:
+            fourcc = cv2.VideoWriter_fourcc(*'avc1')
+            out = cv2.VideoWriter(abs_path, fourcc, fps, (width, height))
+            if not out.isOpened():
+                 raise Exception("avc1 writer not opened")
+        except Exception as e:
+            print(f"[Storage] avc1 编码不可用 ({e})，尝试回退到 mp4v")
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            out = cv2.VideoWriter(abs_path, fourcc, fps, (width, height))
+        return out
 
-        threading.Thread(target=_write_task).start()
+    def _complete_clip(self, session, encoded_path):
+        """
+        片段写完后：生成预览图，流式上传 GridFS 并保存报警记录
+        cv2 只能编码到文件，编码产物先放在 .encoding/ 下；仅在配置保留本地副本或入库失败时移入证据目录
+        """
+        filename = session.filename
+        rel_path = f"evidence/{filename}"
+        print(f"[Storage] 🎥 视频文件已生成: {filename} (跌倒前 {session.before_count} 帧 + 跌倒后 {session.written - session.before_count} 帧)")
+        preview = self._build_preview(session)
+        uploaded = self._save_to_db(filename, session.display_time, rel_path, encoded_path, preview)
+        if uploaded and not self.keep_local_copy:
+            os.remove(encoded_path)
+        else:
+            storage_usage.add("local", os.path.getsize(encoded_path))
+            os.replace(encoded_path, os.path.join(self.save_dir, filename))
+            if not uploaded:
+                if preview:
+                    self._save_local_preview(filename, preview)
+                self._spool_clip(filename, session.display_time, rel_path)
+        self._save_alarm_record(session.display_time, filename, session.snapshot)
+        if self.on_clip_saved:
+            self.on_clip_saved()
 
-    def _save_alarm_record(self, timestamp_str, video_filename):
-        """保存报警记录到MongoDB"""
-        if self.db is None:
-            return
-        
+    def _save_alarm_record(self, timestamp_str, video_filename, snapshot_frame=None):
+        """保存报警记录到MongoDB（数据库不可用时暂存本地 spool）"""
         try:
             from datetime import datetime
             # 生成唯一ID（使用当前时间戳）
@@ -330,20 +970,24 @@ class StorageModule:
             alarm_record = {
                 "id": alarm_id,
                 "timestamp": datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S"),
-                "location": "监控区域",  # 可以后续根据实际情况更新
+                "location": self.location,
                 "type": "跌倒",
                 "status": "待处理",
                 "video_filename": video_filename,
                 "created_at": datetime.now()
             }
             
-            self.db.alarms.insert_one(alarm_record)
+            spooled_write(self.db, "alarms", "insert_one", alarm_record)
             print(f"[Storage] 📢 报警记录已保存 (ID: {alarm_id})")
-            snapshot_frame = None
-            if self.after_buffer:
-                snapshot_frame = self.after_buffer[0]
-            elif self.frame_buffer:
-                snapshot_frame = self.frame_buffer[-1]
-            self._save_snapshot_record(alarm_id, snapshot_frame)
+            if snapshot_frame is not None:
+                self._save_snapshot_record(alarm_id, snapshot_frame)
+                return
+            # 取循环缓冲最新帧时持有引用，避免写截图期间帧环槽位被采集线程复用
+            with self._session_lock:
+                snapshot_frame = retain(self.frame_buffer[-1]) if self.frame_buffer else None
+            try:
+                self._save_snapshot_record(alarm_id, snapshot_frame)
+            finally:
+                release(snapshot_frame)
         except Exception as e:
             print(f"[Storage] 保存报警记录失败: {e}")
@@ -0,0 +1,317 @@
+"""
+证据分层存储模块
+- hot: 最近的片段，保持摄像头原始分辨率（本地 / GridFS）
+- warm: 超过 storage.warmAfter 的片段在低优先级线程中按 warmHeight / warmFps 转码，替换原文件
+- cold: 超过 storage.coldAfter 的片段按 coldHeight / coldFps 转码（接近只保留关键帧）后移入证据目录下的 archive/，并从 GridFS 删除
+history 文档的 tier 字段记录片段所在层级，StorageModule.open_video 据此定位文件，历史记录接口无需区分
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import cv2
+
+from modules.retention import parse_duration, storage_usage
+
+TIERS = ("hot", "warm", "cold")
+
+
+def _lower_priority():
+    """转码线程初始化：调低调度优先级（Linux 下 nice 值按线程生效），不与采集和推理争抢 CPU"""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
+
+
+def probe(path):
+    """返回片段的 (高度, 帧率)，无法打开时返回 None"""
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            return None
+        return int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), float(cap.get(cv2.CAP_PROP_FPS) or 0)
+    finally:
+        cap.release()
+
+
+def needs_transcode(path, max_height, fps):
+    info = probe(path)
+    if info is None:
+        return False
+    height, src_fps = info
+    return height > max_height or src_fps > fps * 1.5
+
+
+def transcode(src_path, dst_path, max_height, fps, open_writer):
+    """
+    等比缩放到不超过 max_height 并按目标帧率抽帧，返回写入的帧数
+    open_writer(path, width, height, fps) 与片段编码使用同一套编码器回退逻辑
+    """
+    cap = cv2.VideoCapture(src_path)
+    if not cap.isOpened():
+        raise IOError(f"无法打开 {src_path}")
+    step = max(1.0, (cap.get(cv2.CAP_PROP_FPS) or fps) / fps)
+    out_fps = (cap.get(cv2.CAP_PROP_FPS) or fps) / step
+    out = None
+    written = 0
+    index = 0
+    next_pick = 0.0
+    try:
+        while True:
+            success, frame = cap.read()
+            if not success:
+                break
+            if index >= next_pick:
+                next_pick += step
+                height, width = frame.shape[:2]
+                if height > max_height:
+                    # H.264 要求宽高为偶数
+                    new_height = max_height - max_height % 2
+                    new_width = max(2, int(round(width * new_height / height / 2)) * 2)
+                    frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
+                if out is None:
+                    out = open_writer(dst_path, frame.shape[1], frame.shape[0], out_fps)
+                out.write(frame)
+                written += 1
+            index += 1
+    finally:
+        cap.release()
+        if out is not None:
+            out.release()
+    return written
+
+
+class TieringWorker:
+    """
+    - get_settings(): 返回 storage 配置分组（每轮重新读取）
+    - interval: 检查周期（秒）；initial_delay: 启动后首次检查的延迟，避开模型加载和预热
+    - workers: 转码线程数；batch_size: 每批提交的片段数
+    """
+
+    def __init__(self, storage, get_settings, interval=1800, initial_delay=60, workers=1, batch_size=20):
+        self.storage = storage
+        self.get_settings = get_settings
+        self.interval = interval
+        self.initial_delay = initial_delay
+        self.batch_size = batch_size
+        self.pool = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="tiering",
+                                       initializer=_lower_priority)
+        self.migrated = {"warm": 0, "cold": 0}
+        self.saved_bytes = 0
+        self.failed = set()   # 本轮转码失败的记录 id / 本地文件名，本轮内不再重试，每轮开始时清空
+        self.settled = {}     # 本地文件名 -> 已确认达到 warm 规格时的修改时间
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, name="tiering", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def _loop(self):
+        delay = self.initial_delay
+        while not self.stop_event.wait(delay):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[Tiering] 分层迁移异常: {e}")
+            delay = self.interval
+
+    def run_once(self):
+        settings = self.get_settings()
+        if not settings.get("tiering", True):
+            return
+        # 失败的片段下一轮重试（文件可能已恢复可读），同时避免集合随运行时间无限增长
+        self.failed = set()
+        now = datetime.now()
+        # 先处理 cold，足够旧的片段直接从 hot 转为 cold，不经过 warm 的中间转码
+        for tier in ("cold", "warm"):
+            max_age = parse_duration(settings.get(f"{tier}After"))
+            if not max_age:
+                continue
+            profile = (int(settings.get(f"{tier}Height", 480 if tier == "warm" else 360)),
+                       float(settings.get(f"{tier}Fps", 10 if tier == "warm" else 2)))
+            cutoff = now - timedelta(seconds=max_age)
+            self._migrate_records(tier, cutoff, profile)
+            self._migrate_local_files(tier, cutoff.timestamp(), profile)
+
+    def _run_batch(self, jobs):
+        """提交一批转码任务并等待完成，返回成功数"""
+        futures = [self.pool.submit(job, *args) for job, *args in jobs]
+        return sum(1 for future in futures if future.result())
+
+    # ---------- 数据库记录 ----------
+    def _migrate_records(self, tier, cutoff, profile):
+        db = self.storage.db
+        if db is None:
+            return
+        # 尚未到达 tier 或更深层级的记录；旧记录没有 tier 字段，视为 hot
+        query = {
+            "timestamp": {"$lt": cutoff.strftime("%Y-%m-%d %H:%M:%S")},
+            "tier": {"$nin": list(TIERS[TIERS.index(tier):])}
+        }
+        while not self.stop_event.is_set():
+            if self.failed:
+                query["_id"] = {"$nin": list(self.failed)}
+            docs = list(db.history.find(query).sort("_id", 1).limit(self.batch_size))
+            if not docs:
+                return
+            done = self._run_batch([(self._migrate_record, doc, tier, profile) for doc in docs])
+            print(f"[Tiering] {done}/{len(docs)} 条记录已迁移到 {tier}")
+
+    def _migrate_record(self, doc, tier, profile):
+        storage = self.storage
+        filename = doc["filename"]
+        temp_source = None
+        output = os.path.join(storage.encoding_dir, f"tier_{tier}_{filename}")
+        try:
+            source = storage.locate_local(filename)
+            if source is None:
+                if "video_file_id" not in doc:
+                    raise FileNotFoundError("本地与 GridFS 均无视频文件")
+                temp_source = storage.download_file(
+                    doc["video_file_id"], os.path.join(storage.encoding_dir, f"tier_src_{filename}"))
+                source = temp_source
+            if not transcode(source, output, profile[0], profile[1], storage._open_writer):
+                raise ValueError("片段没有可读取的帧")
+            before = os.path.getsize(source)
+            self.saved_bytes += max(0, before - os.path.getsize(output))
+            if tier == "cold":
+                migrated = self._archive_record(doc, output)
+            else:
+                migrated = self._replace_record(doc, output)
+            if migrated:
+                self.migrated[tier] += 1
+            return migrated
+        except Exception as e:
+            print(f"[Tiering] 迁移 {filename} 到 {tier} 失败: {e}")
+            self.failed.add(doc["_id"])
+            return False
+        finally:
+            for path in (temp_source, output):
+                if path and os.path.exists(path):
+                    os.remove(path)
+
+    def _replace_record(self, doc, output):
+        """warm：上传转码结果替换 GridFS 文件，保留的本地副本同步替换"""
+        storage = self.storage
+        update = {"tier": "warm", "tiered_at": datetime.now()}
+        old_file_id = doc.get("video_file_id")
+        if old_file_id is not None:
+            update["video_file_id"] = storage.upload_file(doc["filename"], output)
+        # 以原 video_file_id 为条件，期间被保留策略删除或被其他进程迁移时放弃本次结果
+        result = storage.db.history.update_one({"_id": doc["_id"], "video_file_id": old_file_id}, {"$set": update})
+        if not result.matched_count:
+            if "video_file_id" in update:
+                storage.delete_grid_file(update["video_file_id"])
+            return False
+        if old_file_id is not None:
+            storage.delete_grid_file(old_file_id)
+        if storage.locate_local(doc["filename"]):
+            storage.replace_local_file(doc["filename"], output)
+        return True
+
+    def _archive_record(self, doc, output):
+        """cold：转码结果写入归档目录后再删除 GridFS 文件和原位置的本地副本"""
+        storage = self.storage
+        mtime = None
+        if not storage.locate_local(doc["filename"]):
+            # 仅存于 GridFS 的片段：归档文件的修改时间取事件时间，保证按修改时间的清理与排序一致
+            try:
+                mtime = datetime.strptime(doc["timestamp"], "%Y-%m-%d %H:%M:%S").timestamp()
+            except (KeyError, TypeError, ValueError):
+                pass
+        archive_path = storage.replace_local_file(doc["filename"], output, archive=True, mtime=mtime)
+        old_file_id = doc.get("video_file_id")
+        result = storage.db.history.update_one(
+            {"_id": doc["_id"], "video_file_id": old_file_id},
+            {"$set": {"tier": "cold", "tiered_at": datetime.now(),
+                      "archive_path": f"evidence/archive/{os.path.basename(archive_path)}"},
+             "$unset": {"video_file_id": ""}})
+        if not result.matched_count:
+            # 记录已被删除或迁移：只撤回本次写入的归档文件，预览图仍由记录的删除流程处理
+            if os.path.isfile(archive_path):
+                size = os.path.getsize(archive_path)
+                os.remove(archive_path)
+                storage_usage.remove("local", size)
+            return False
+        if old_file_id is not None:
+            storage.delete_grid_file(old_file_id)
+        return True
+
+    # ---------- 未入库的本地片段 ----------
+    def _migrate_local_files(self, tier, cutoff_ts, profile):
+        """
+        数据库未记录的本地片段（离线期间生成）：warm 原地转码，cold 转码后移入归档目录
+        已入库记录保留的本地副本由 _migrate_records 随记录一起处理，这里跳过；数据库不可用时无法区分，本轮不处理
+        """
+        db = self.storage.db
+        if db is None:
+            return
+        candidates = []
+        try:
+            with os.scandir(self.storage.save_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith('.mp4') or not entry.is_file() or entry.name in self.failed:
+                        continue
+                    mtime = entry.stat().st_mtime
+                    if mtime < cutoff_ts and self.settled.get(entry.name) != mtime:
+                        candidates.append((entry.name, mtime))
+        except OSError as e:
+            print(f"[Tiering] 扫描本地证据目录失败: {e}")
+            return
+        for start in range(0, len(candidates), self.batch_size):
+            if self.stop_event.is_set():
+                return
+            batch = candidates[start:start + self.batch_size]
+            try:
+                recorded = {doc["filename"] for doc in db.history.find(
+                    {"filename": {"$in": [name for name, _ in batch]}}, {"filename": 1})}
+            except Exception as e:
+                print(f"[Tiering] 查询本地片段的入库状态失败: {e}")
+                return
+            batch = [(name, mtime) for name, mtime in batch if name not in recorded]
+            self._run_batch([(self._migrate_local_file, name, mtime, tier, profile) for name, mtime in batch])
+
+    def _migrate_local_file(self, name, mtime, tier, profile):
+        storage = self.storage
+        path = os.path.join(storage.save_dir, name)
+        output = os.path.join(storage.encoding_dir, f"tier_{tier}_{name}")
+        try:
+            if not needs_transcode(path, *profile):
+                if tier == "cold":
+                    storage.replace_local_file(name, path, archive=True, mtime=mtime)
+                    self.migrated[tier] += 1
+                else:
+                    self.settled[name] = mtime
+                return True
+            if not transcode(path, output, profile[0], profile[1], storage._open_writer):
+                raise ValueError("片段没有可读取的帧")
+            self.saved_bytes += max(0, os.path.getsize(path) - os.path.getsize(output))
+            storage.replace_local_file(name, output, archive=(tier == "cold"), mtime=mtime)
+            if tier == "warm":
+                self.settled[name] = mtime
+            self.migrated[tier] += 1
+            return True
+        except Exception as e:
+            print(f"[Tiering] 迁移本地片段 {name} 到 {tier} 失败: {e}")
+            self.failed.add(name)
+            return False
+        finally:
+            if os.path.exists(output):
+                os.remove(output)
+
+    def stats(self):
+        return {
+            "migrated": dict(self.migrated),
+            "saved_bytes": self.saved_bytes,
+            "failed": len(self.failed)
+        }
@@ -0,0 +1,152 @@
+"""
+自适应跨帧检测模块
+检测器每 N 帧运行一次，中间帧由轻量跟踪器按匀速模型外推检测框；
+N 根据 CPU 负载和画面中是否有人自动调整，并受报警延迟上限约束
+"""
+
+import math
+import os
+import time
+
+import numpy as np
+
+
+def box_iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class BoxTracker:
+    """IoU 关联 + 匀速外推的轻量跟踪器"""
+
+    def __init__(self, iou_threshold=0.3, max_age=1.0):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.tracks = []
+
+    def update(self, detections, timestamp):
+        tracks = []
+        used = set()
+        for det in detections:
+            box = np.array(det["coords"], dtype=np.float32)
+            best, best_iou = None, self.iou_threshold
+            for j, track in enumerate(self.tracks):
+                if j in used or track["det"]["cls_name"] != det["cls_name"]:
+                    continue
+                overlap = box_iou(box, track["box"])
+                if overlap > best_iou:
+                    best, best_iou = j, overlap
+            velocity = np.zeros(4, dtype=np.float32)
+            if best is not None:
+                used.add(best)
+                previous = self.tracks[best]
+                dt = timestamp - previous["t"]
+                if dt > 0:
+                    velocity = (box - previous["box"]) / dt
+            tracks.append({"box": box, "velocity": velocity, "det": det, "t": timestamp})
+        self.tracks = tracks
+
+    def predict(self, timestamp, frame_shape=None):
+        """返回外推到 timestamp 的检测列表（超过 max_age 的轨迹不再外推）"""
+        detections = []
+        for track in self.tracks:
+            dt = timestamp - track["t"]
+            if dt > self.max_age:
+                continue
+            box = track["box"] + track["velocity"] * dt
+            if frame_shape is not None:
+                h, w = frame_shape[:2]
+                box = np.clip(box, 0, [w - 1, h - 1, w - 1, h - 1])
+            detections.append({**track["det"], "coords": box.round().astype(int).tolist(), "interpolated": True})
+        return detections
+
+
+class AdaptiveStride:
+    """
+    每 N 帧检测一次，N 自动调整：
+    - CPU 负载高（检测耗时占帧间隔比例高或系统负载高）时增大 N，负载低时减小
+    - 画面中有目标（人或跌倒类别）时 N 不超过 person_stride
+    - N × 帧间隔不超过 max_latency_ms，保证报警延迟上限
+    """
+
+    def __init__(self, max_stride=4, person_stride=2, max_latency_ms=300, high_load=0.8, low_load=0.5):
+        self.max_stride = max(1, int(max_stride))
+        self.person_stride = max(1, int(person_stride))
+        self.max_latency = max(0.0, float(max_latency_ms)) / 1000.0
+        self.high_load = high_load
+        self.low_load = low_load
+        self.stride = 1
+        self.tracker = BoxTracker(max_age=max(self.max_latency, 0.5))
+        self.frames_since_detect = 0
+        self.frame_interval = 1 / 30.0
+        self.infer_seconds = 0.0
+        self.last_frame_time = None
+        self.frames = 0
+        self.detections_run = 0
+        self.cpu_count = os.cpu_count() or 1
+
+    def _system_load(self):
+        try:
+            return os.getloadavg()[0] / self.cpu_count
+        except (AttributeError, OSError):
+            return 0.0
+
+    def _adapt(self, detections):
+        load = max(self.infer_seconds / self.frame_interval if self.frame_interval > 0 else 0, self._system_load())
+        if load > self.high_load:
+            self.stride += 1
+        elif load < self.low_load:
+            self.stride -= 1
+        bound = self.max_stride
+        if detections:
+            bound = min(bound, self.person_stride)
+        if self.frame_interval > 0:
+            bound = min(bound, max(1, math.floor(self.max_latency / self.frame_interval)))
+        self.stride = max(1, min(self.stride, bound))
+
+    def run(self, frame, detect, force=False):
+        """返回当前帧的检测列表：到达步长或 force 时调用 detect()，否则由跟踪器外推"""
+        now = time.time()
+        if self.last_frame_time is not None:
+            # 帧间隔取指数滑动平均
+            self.frame_interval = 0.9 * self.frame_interval + 0.1 * max(1e-3, now - self.last_frame_time)
+        self.last_frame_time = now
+        self.frames += 1
+        if force or self.frames_since_detect + 1 >= self.stride:
+            started = time.time()
+            detections = detect()
+            self.infer_seconds = 0.8 * self.infer_seconds + 0.2 * (time.time() - started)
+            self.tracker.update(detections, now)
+            self.frames_since_detect = 0
+            self.detections_run += 1
+            self._adapt(detections)
+            return detections
+        self.frames_since_detect += 1
+        return self.tracker.predict(now, frame.shape)
+
+    def stats(self):
+        return {
+            "stride": self.stride,
+            "frames": self.frames,
+            "detector_runs": self.detections_run,
+            "detect_ratio": round(self.detections_run / self.frames, 3) if self.frames else 0
+        }
+
+
+def detect_adaptive(frame, run_detector, motion_gate=None, stride=None, alarm=False, tracking=False):
+    """
+    组合运动门控与自适应跨帧检测，返回当前帧的检测列表
+    - alarm: 跌倒进行中，门控和跨帧都强制运行检测器
+    - tracking: 上一帧有目标，门控不跳过（跨帧仍可由跟踪器外推）
+    """
+    def detect():
+        if motion_gate is None:
+            return run_detector()
+        return motion_gate.run(frame, run_detector, force=alarm or tracking)
+
+    if stride is None:
+        return detect()
+    return stride.run(frame, detect, force=alarm)
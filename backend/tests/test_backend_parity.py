@@ -0,0 +1,81 @@
+"""
+推理后端一致性测试
+以 torch 后端为基准，onnx / openvino 在样例帧上的检测结果须在容差内一致（同类别、框 IoU、置信度）；
+未安装 ultralytics / 对应运行时、没有权重或导出失败时跳过
+
+在 backend 目录下运行:
+    python -m pytest tests/test_backend_parity.py
+环境变量:
+    FALL_PARITY_WEIGHTS  权重路径，默认 backend/best.pt
+    FALL_PARITY_VIDEO    取样视频，默认使用 ultralytics 自带的样例图片
+"""
+
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.bench_backends import compare  # noqa: E402
+from modules.perception import extract_detections, resolve_backend_weights  # noqa: E402
+
+WEIGHTS = os.environ.get("FALL_PARITY_WEIGHTS", os.path.join(BACKEND_DIR, "best.pt"))
+RUNTIMES = {"onnx": "onnxruntime", "openvino": "openvino"}
+CONF, IOU = 0.30, 0.45
+MATCH_IOU, CONF_TOLERANCE, MIN_MATCH = 0.9, 0.05, 0.95
+
+
+def load_frames(count=20, stride=5):
+    cv2 = pytest.importorskip("cv2")
+    video = os.environ.get("FALL_PARITY_VIDEO")
+    frames = []
+    if video:
+        cap = cv2.VideoCapture(video)
+        index = 0
+        while len(frames) < count:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if index % stride == 0:
+                frames.append(frame)
+            index += 1
+        cap.release()
+    else:
+        from ultralytics.utils import ASSETS
+        for name in sorted(os.listdir(ASSETS)):
+            if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                frames.append(cv2.imread(str(ASSETS / name)))
+    if not frames:
+        pytest.skip("没有可用的样例帧")
+    return frames
+
+
+def detect(weights, frames):
+    from ultralytics import YOLO
+    model = YOLO(weights, task='detect')
+    return [extract_detections(model(frame, conf=CONF, iou=IOU, verbose=False), model.names) for frame in frames]
+
+
+@pytest.fixture(scope="module")
+def reference():
+    pytest.importorskip("ultralytics")
+    if not os.path.exists(WEIGHTS):
+        pytest.skip(f"权重不存在: {WEIGHTS}")
+    frames = load_frames()
+    return frames, detect(WEIGHTS, frames)
+
+
+@pytest.mark.parametrize("backend", ["onnx", "openvino"])
+def test_backend_matches_torch(backend, reference):
+    pytest.importorskip(RUNTIMES[backend])
+    frames, expected = reference
+    weights = resolve_backend_weights(WEIGHTS, backend)
+    if weights == WEIGHTS:
+        pytest.skip(f"{backend} 导出失败，已回退 torch")
+    actual = detect(weights, frames)
+    matched, total_ref, total_cand = compare(expected, actual, MATCH_IOU, CONF_TOLERANCE)
+    denominator = max(total_ref, total_cand)
+    rate = matched / denominator if denominator else 1.0
+    assert rate >= MIN_MATCH, f"{backend} 与 torch 的检测匹配率 {rate:.1%}（{matched}/{denominator}）低于 {MIN_MATCH:.0%}"